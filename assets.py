@@ -0,0 +1,286 @@
+"""
+Image variant pipeline for the storefront.
+
+The source PNGs in the repo are full-size photos (some close to 850 KB), far
+bigger than the cards they are shown in. This module produces resized,
+recompressed WebP/AVIF variants per display preset and keeps them on disk
+under ASSET_CACHE_DIR, keyed by a hash of the source bytes, so a variant is
+only rebuilt when its source image actually changes.
+
+Variants (and other static files such as styles.css) are then published to
+the Streamlit static folder under their content hash (static/<hash>.<ext>),
+which dedups identical files and gives every asset a stable URL that never
+changes meaning, so browsers can keep it across reruns and visits.
+
+Pre-build everything before deploying with:
+
+    python assets.py
+"""
+import hashlib
+import html
+import mimetypes
+import os
+import shutil
+import sys
+import threading
+
+from PIL import Image, ImageOps
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+ASSET_CACHE_DIR = os.path.join(APP_DIR, ".asset_cache")
+# Served by Streamlit at app/static/ when server.enableStaticServing is on
+STATIC_DIR = os.path.join(APP_DIR, "static")
+STATIC_URL_PREFIX = "app/static/"
+
+# Older mimetypes tables don't know AVIF, and Streamlit sends nosniff
+mimetypes.add_type("image/avif", ".avif")
+
+# Display presets: max width in pixels (about 2x the CSS width so they stay
+# sharp on phones) and encoder quality per format. AVIF's quality scale runs
+# lower than WebP's for the same visual result.
+VARIANT_PRESETS = {
+    "card": {"width": 640, "webp": 78, "avif": 55},      # Product cards in the menu grid
+    "logo": {"width": 440, "webp": 85, "avif": 65},      # Header logo, shown at 220px
+    "sevilla": {"width": 720, "webp": 80, "avif": 60},   # Sevilla section (3 columns)
+}
+VARIANT_FORMATS = ("webp", "avif")
+
+# What `python assets.py` pre-builds: every photo gets a card variant, plus
+# the images used by the header and the Sevilla section.
+# The Nequi QR must stay pixel-exact to scan, so it is never recompressed.
+BUILD_EXCLUDE = {"nequi_qr.png"}
+EXTRA_BUILDS = {
+    "logo": ["logo.png"],
+    "sevilla": ["sevilla_plaza.png", "sevilla_paisaje.png", "logo.png"],
+}
+# Published as-is
+BUILD_STATIC = ["styles.css", "nequi_qr.png"]
+
+_HASH_LEN = 16
+_lock = threading.Lock()
+# (path, mtime_ns, size) -> content hash, so we don't re-hash unchanged files on every rerun
+_hash_memo = {}
+# content hash -> published URL
+_published = {}
+# source path -> content hash it was last published with
+_published_from = {}
+
+
+def _resolve(path):
+    return path if os.path.isabs(path) else os.path.join(APP_DIR, path)
+
+
+def content_hash(path):
+    """Returns a short SHA-256 of the file contents, memoized on mtime and size."""
+    full_path = _resolve(path)
+    stat = os.stat(full_path)
+    key = (full_path, stat.st_mtime_ns, stat.st_size)
+    digest = _hash_memo.get(key)
+    if digest is None:
+        with open(full_path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()[:_HASH_LEN]
+        _hash_memo[key] = digest
+    return digest
+
+
+def variant_filename(path, preset, fmt="webp"):
+    """Builds the cache file name for a variant: <stem>-<preset>-<hash>.<fmt>."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return f"{stem}-{preset}-{content_hash(path)}.{fmt}"
+
+
+def build_variant(path, preset, fmt="webp"):
+    """
+    Writes the resized variant to the cache (if missing) and returns its path.
+    - Never upscales: images narrower than the preset keep their size.
+    - Writes to a temp file first so concurrent sessions never read half a file.
+    """
+    if preset not in VARIANT_PRESETS:
+        raise ValueError(f"Preset desconocido: {preset}")
+    if fmt not in VARIANT_FORMATS:
+        raise ValueError(f"Formato no soportado: {fmt}")
+
+    target = os.path.join(ASSET_CACHE_DIR, variant_filename(path, preset, fmt))
+    if os.path.exists(target):
+        return target
+
+    with _lock:
+        if os.path.exists(target):
+            return target
+        os.makedirs(ASSET_CACHE_DIR, exist_ok=True)
+
+        settings = VARIANT_PRESETS[preset]
+        with Image.open(_resolve(path)) as img:
+            img = ImageOps.exif_transpose(img)
+            if img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+            max_width = settings["width"]
+            if img.width > max_width:
+                height = round(img.height * max_width / img.width)
+                img = img.resize((max_width, height), Image.LANCZOS)
+
+            tmp_path = f"{target}.{os.getpid()}.tmp"
+            save_kwargs = {"quality": settings[fmt]}
+            if fmt == "webp":
+                save_kwargs["method"] = 6
+            img.save(tmp_path, format=fmt.upper(), **save_kwargs)
+        os.replace(tmp_path, target)
+        _prune_stale(path, preset, fmt, keep=target)
+    return target
+
+
+def _prune_stale(path, preset, fmt, keep):
+    """Removes variants built from older versions of the same source image."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    prefix = f"{stem}-{preset}-"
+    for name in os.listdir(ASSET_CACHE_DIR):
+        candidate = os.path.join(ASSET_CACHE_DIR, name)
+        if (
+            name.startswith(prefix)
+            and name.endswith(f".{fmt}")
+            and len(name) == len(prefix) + _HASH_LEN + len(fmt) + 1
+            and candidate != keep
+        ):
+            try:
+                # Its static copy is stale too
+                _unpublish(content_hash(candidate), f".{fmt}")
+                os.remove(candidate)
+            except OSError:
+                pass
+
+
+def variant_path(path, preset, fmt="webp"):
+    """
+    Returns the path of the display variant for `path`, building it on demand.
+    Falls back to the original file if the variant can't be produced, so the
+    storefront keeps working even with a read-only disk.
+    """
+    try:
+        return build_variant(path, preset, fmt)
+    except ValueError:
+        raise
+    except Exception:
+        return path
+
+
+def publish(path):
+    """
+    Copies a file into STATIC_DIR as <hash>.<ext> and returns its URL.
+    Identical files (e.g. the two Sevilla photos) share one URL and one copy.
+    When a source file changes, the copy of its previous version is removed.
+    """
+    digest = content_hash(path)
+    ext = os.path.splitext(path)[1].lower()
+    name = f"{digest}{ext}"
+    target = os.path.join(STATIC_DIR, name)
+    url = _published.get(digest)
+    # The memo only holds while the file is there (static/ may have been wiped)
+    if url is not None and os.path.exists(target):
+        return url
+
+    if not os.path.exists(target):
+        os.makedirs(STATIC_DIR, exist_ok=True)
+        tmp_path = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copyfile(_resolve(path), tmp_path)
+        os.replace(tmp_path, target)
+    url = STATIC_URL_PREFIX + name
+    with _lock:
+        _published[digest] = url
+        source = _resolve(path)
+        previous = _published_from.get(source)
+        _published_from[source] = digest
+        stale = previous not in (None, digest) and previous not in _published_from.values()
+    if stale:
+        _unpublish(previous, ext)
+    return url
+
+
+def _unpublish(digest, ext):
+    """Removes the static copy of a content hash that is no longer used."""
+    _published.pop(digest, None)
+    try:
+        os.remove(os.path.join(STATIC_DIR, f"{digest}{ext}"))
+    except OSError:
+        pass
+
+
+def prune_static(keep_urls):
+    """Removes hashed files from STATIC_DIR that aren't in `keep_urls`; returns their names."""
+    keep = {url[len(STATIC_URL_PREFIX):] for url in keep_urls}
+    removed = []
+    if not os.path.isdir(STATIC_DIR):
+        return removed
+    for name in os.listdir(STATIC_DIR):
+        stem = name.split(".", 1)[0]
+        if name in keep or len(stem) != _HASH_LEN or any(c not in "0123456789abcdef" for c in stem):
+            continue
+        try:
+            os.remove(os.path.join(STATIC_DIR, name))
+            removed.append(name)
+        except OSError:
+            pass
+    return removed
+
+
+def static_url(path, preset=None, fmt="webp"):
+    """
+    Returns the hashed static URL of an image (or of its variant for `preset`).
+    If the variant can't be built, this is the URL of the original image.
+    """
+    if preset:
+        path = variant_path(path, preset, fmt)
+    return publish(path)
+
+
+def picture_html(path, preset, alt="", style="width: 100%;"):
+    """
+    Builds a <picture> tag with AVIF and WebP sources for a preset.
+    Images load lazily and are fetched by the browser from their static URLs,
+    so they are never pushed through the Streamlit websocket. Formats whose
+    variant can't be built are left out, down to a plain <img> of the original.
+    """
+    avif_path = variant_path(path, preset, "avif")
+    webp_path = variant_path(path, preset, "webp")
+    source = ""
+    if avif_path != path:
+        source = f'<source srcset="{publish(avif_path)}" type="image/avif">'
+    return (
+        f'<picture>{source}'
+        f'<img src="{publish(webp_path)}" alt="{html.escape(alt, quote=True)}" '
+        f'loading="lazy" decoding="async" style="{style}">'
+        f'</picture>'
+    )
+
+
+def build_all(paths, presets=None, formats=VARIANT_FORMATS):
+    """Pre-builds every preset/format combination for the given images."""
+    built = []
+    for path in paths:
+        for preset in presets or VARIANT_PRESETS:
+            for fmt in formats:
+                built.append(build_variant(path, preset, fmt))
+    return built
+
+
+if __name__ == "__main__":
+    if sys.argv[1:]:
+        variants = build_all(sys.argv[1:])
+    else:
+        photos = sorted(
+            name for name in os.listdir(APP_DIR)
+            if name.endswith(".png") and name not in BUILD_EXCLUDE
+        )
+        variants = build_all(photos, presets=["card"])
+        for preset, sources in EXTRA_BUILDS.items():
+            variants += build_all(sources, presets=[preset])
+    for static_file in BUILD_STATIC:
+        variants.append(static_file)
+    urls = []
+    for variant in variants:
+        url = publish(variant)
+        urls.append(url)
+        print(f"{os.path.getsize(variant):>9,}  {os.path.relpath(variant, APP_DIR)} -> {url}")
+    if not sys.argv[1:]:
+        # A full build publishes everything the storefront uses: the rest is stale
+        for name in prune_static(urls):
+            print(f"removed  static/{name}")
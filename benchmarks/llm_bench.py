@@ -0,0 +1,227 @@
+"""
+End-to-end benchmark of the OpenRouter client against the local mock server.
+
+Starts benchmarks/mock_openrouter.py on a free port, points utils at it
+(OPENROUTER_BASE_URL) and drives call_openrouter through a few scenarios:
+
+    baseline     one healthy model: TTFT, latency and tokens/s
+    fallback     429, then 402, then a healthy model: cost of walking the list
+    timeout      the first model never answers: sequential vs hedged
+    malformed    invalid frames mixed into the stream: replies still complete
+    concurrency  N parallel calls (1, 4, 8, 16): TTFT percentiles and calls/s
+
+No network or API key is needed. Numbers come from the telemetry records
+(telemetry.py), so they measure the same thing the dev panel shows.
+
+    python benchmarks/llm_bench.py [--client sync|async] [--calls 10]
+    python benchmarks/llm_bench.py --json before.json
+    python benchmarks/llm_bench.py --compare before.json
+
+--json saves the results (with the git commit); --compare prints the
+change against a saved run.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_openrouter import Behaviour, MockConfig, start_server  # noqa: E402
+
+CONFIG = MockConfig(Behaviour(ttft=0.15, rate=200.0, tokens=60))
+SERVER = start_server(CONFIG)
+# Must be set before utils is imported: the URL is read once
+os.environ["OPENROUTER_BASE_URL"] = SERVER.base_url
+os.environ.pop("MODEL_HEALTH_FILE", None)
+os.environ.pop("LLM_METRICS_FILE", None)
+
+import llm_limits  # noqa: E402
+import model_health  # noqa: E402
+import utils  # noqa: E402
+from telemetry import get_telemetry, percentile  # noqa: E402
+
+MODELS = utils.FALLBACK_MODELS
+API_KEY = "mock-key"
+HEDGE_DELAY = 0.5
+CONCURRENCY_LEVELS = (1, 4, 8, 16)
+
+
+def reset_state():
+    """Fresh health registry and admission limits high enough not to interfere."""
+    model_health._registry = model_health.HealthRegistry(None)
+    llm_limits._controller = llm_limits.AdmissionController(
+        max_concurrent=64, max_queued=64, per_session=64,
+        rate_per_minute=1_000_000, model_rate_per_minute=1_000_000)
+
+
+def configure(modes=None):
+    """Per-model modes for the next scenario, by position in FALLBACK_MODELS."""
+    modes = modes or {}
+    CONFIG.models = {MODELS[index]: CONFIG.default.copy(mode=mode) for index, mode in modes.items()}
+
+
+class Runner:
+    """Makes calls with the chosen client and collects their telemetry records."""
+
+    def __init__(self, client):
+        if client == "async":
+            from openrouter_async import call_openrouter_on_loop
+            self.call = call_openrouter_on_loop
+        else:
+            self.call = utils.call_openrouter
+        self.client = client
+        self._records = {}
+        self._lock = threading.Lock()
+        get_telemetry().add_listener(self._collect)
+
+    def _collect(self, record):
+        with self._lock:
+            self._records[record["session"]] = record
+
+    def one(self, session_id, **kwargs):
+        """One call, consumed to the end; returns (telemetry record, reply text)."""
+        response = self.call("¿Qué me recomiendas con el kumis?", model=MODELS[0], manual_api_key=API_KEY,
+                             session_id=session_id, **kwargs)
+        text = response if isinstance(response, str) else "".join(response)
+        with self._lock:
+            return self._records.pop(session_id, None), text
+
+    def sequential(self, name, calls, **kwargs):
+        results = []
+        for index in range(calls):
+            reset_state()
+            results.append(self.one(f"{name}-{index}", **kwargs))
+        return results
+
+    def parallel(self, name, count, **kwargs):
+        results = [None] * count
+
+        def worker(index):
+            results[index] = self.one(f"{name}-{index}", **kwargs)
+
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(count)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, time.perf_counter() - started
+
+
+def summarize(results, wall=None):
+    records = [record for record, _ in results if record]
+    streams = [r for r in records if r["outcome"] == "stream"]
+
+    def pct(name, q):
+        value = percentile([r[name] for r in streams if r[name] is not None], q)
+        return round(value, 4) if value is not None else None
+
+    summary = {
+        "calls": len(results),
+        "ok": len(streams),
+        "ttft_p50": pct("ttft", 50),
+        "ttft_p95": pct("ttft", 95),
+        "latency_p50": pct("latency", 50),
+        "latency_p95": pct("latency", 95),
+        "tokens_per_s_p50": pct("tokens_per_s", 50),
+        "attempts_per_call": round(sum(len(r["attempts"]) for r in records) / len(records), 2) if records else None,
+        "complete": sum(1 for r in streams if r["finish_reason"] == "stop"),
+    }
+    if wall is not None:
+        summary["wall"] = round(wall, 4)
+        summary["calls_per_s"] = round(len(results) / wall, 2)
+    return summary
+
+
+def run_scenarios(runner, calls):
+    results = {}
+
+    configure()
+    results["baseline"] = summarize(runner.sequential("baseline", calls))
+
+    configure({0: "429", 1: "402"})
+    results["fallback"] = summarize(runner.sequential("fallback", calls))
+
+    configure({0: "timeout"})
+    results["timeout_sequential"] = summarize(runner.sequential("timeout-seq", calls))
+    results["timeout_hedged"] = summarize(runner.sequential("timeout-hedged", calls, hedge_delay=HEDGE_DELAY))
+
+    configure({0: "malformed"})
+    results["malformed"] = summarize(runner.sequential("malformed", calls))
+
+    configure()
+    for level in CONCURRENCY_LEVELS:
+        reset_state()
+        batch, wall = runner.parallel(f"concurrency-{level}", level)
+        results[f"concurrency_{level}"] = summarize(batch, wall)
+    return results
+
+
+COLUMNS = ("ok", "ttft_p50", "ttft_p95", "latency_p50", "tokens_per_s_p50", "attempts_per_call", "calls_per_s")
+
+
+def print_table(results, baseline=None):
+    print(f"{'scenario':<20}" + "".join(f"{column:>18}" for column in COLUMNS))
+    for scenario, summary in results.items():
+        cells = []
+        for column in COLUMNS:
+            value = summary.get(column)
+            cell = "-" if value is None else f"{value:g}"
+            old = (baseline or {}).get(scenario, {}).get(column)
+            if isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+                cell += f" ({(value - old) / old:+.0%})"
+            cells.append(f"{cell:>18}")
+        print(f"{scenario:<20}" + "".join(cells))
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--client", choices=("sync", "async"), default="sync")
+    parser.add_argument("--calls", type=int, default=10, help="calls per sequential scenario")
+    parser.add_argument("--read-timeout", type=float, default=2.0,
+                        help="READ_TIMEOUT for the run, so the timeout scenario doesn't take 30 s per call")
+    parser.add_argument("--json", metavar="FILE", help="save the results")
+    parser.add_argument("--compare", metavar="FILE", help="show the change against a saved run")
+    args = parser.parse_args()
+
+    utils.READ_TIMEOUT = args.read_timeout
+    CONFIG.default.hang = args.read_timeout + 1
+    if args.client == "async":
+        import openrouter_async
+        openrouter_async.READ_TIMEOUT = args.read_timeout
+
+    runner = Runner(args.client)
+    results = run_scenarios(runner, args.calls)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            saved = json.load(f)
+        baseline = saved["results"]
+        print(f"Comparado con {args.compare} (commit {saved.get('commit')}, cliente {saved.get('client')})")
+    print_table(results, baseline)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"commit": git_commit(), "client": args.client, "calls": args.calls, "ts": time.time(),
+                       "results": results}, f, indent=2)
+        print(f"Resultados guardados en {args.json}")
+    SERVER.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+Local stand-in for OpenRouter's /api/v1/chat/completions (streaming only).
+
+Speaks the same SSE protocol as the real API: ": OPENROUTER PROCESSING"
+keep-alives, content deltas, a finish frame with usage, then [DONE]. Each
+model can be given its own behaviour:
+
+    ok          stream normally (default)
+    429 / 402   answer with that status and a JSON error body
+    timeout     accept the request and never answer (the client times out)
+    malformed   mix invalid JSON frames into a normal stream
+    midstream   send a few tokens, then an error frame
+
+plus first-token latency, token rate and answer length. Run it standalone:
+
+    python benchmarks/mock_openrouter.py --port 8765 --ttft 0.3 --rate 80 \\
+        --model "mistralai/mistral-small-3.1-24b-instruct:free=429"
+    OPENROUTER_BASE_URL=http://127.0.0.1:8765/api/v1 streamlit run pagina-web.py
+
+or from Python with start_server() (see llm_bench.py).
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = ("¡Claro que sí, vecino! El kumis de la casa es cremoso y suave, y queda delicioso con un pandebono "
+         "recién horneado. ").split(" ")
+
+
+class Behaviour:
+    """How the mock answers for one model."""
+
+    def __init__(self, mode="ok", ttft=0.2, rate=60.0, tokens=60, hang=60.0):
+        self.mode = mode
+        self.ttft = ttft        # seconds before the first token
+        self.rate = rate        # tokens per second after that
+        self.tokens = tokens    # tokens per answer
+        self.hang = hang        # how long "timeout" keeps the connection silent
+
+    def copy(self, **changes):
+        behaviour = Behaviour(self.mode, self.ttft, self.rate, self.tokens, self.hang)
+        for name, value in changes.items():
+            setattr(behaviour, name, value)
+        return behaviour
+
+
+class MockConfig:
+    """Default behaviour plus per-model overrides; safe to change while serving."""
+
+    def __init__(self, default=None, models=None):
+        self.default = default or Behaviour()
+        self.models = dict(models or {})
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def for_model(self, model):
+        with self._lock:
+            self.requests += 1
+            return self.models.get(model, self.default)
+
+
+def _frame(payload):
+    return ("data: " + json.dumps(payload, ensure_ascii=False) + "\n\n").encode("utf-8")
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real API
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._json(404, {"error": {"message": "Not found", "code": 404}})
+            return
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        try:
+            request = json.loads(body)
+        except ValueError:
+            self._json(400, {"error": {"message": "Invalid JSON", "code": 400}})
+            return
+        model = request.get("model", "")
+        behaviour = self.server.config.for_model(model)
+
+        if behaviour.mode in ("429", "402"):
+            code = int(behaviour.mode)
+            self._json(code, {"error": {"message": f"Mock {code} for {model}", "code": code}})
+            return
+        if behaviour.mode == "timeout":
+            time.sleep(behaviour.hang)
+            self.close_connection = True
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            self._stream(model, behaviour, len(body))
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True  # The client hung up (e.g. a cancelled hedge)
+
+    def _stream(self, model, behaviour, prompt_bytes):
+        self._chunk(b": OPENROUTER PROCESSING\n\n")
+        time.sleep(behaviour.ttft)
+        interval = 1.0 / behaviour.rate if behaviour.rate > 0 else 0
+        base = {"id": "gen-mock", "provider": "Mock", "model": model, "object": "chat.completion.chunk",
+                "created": int(time.time())}
+        for index in range(behaviour.tokens):
+            if index and interval:
+                time.sleep(interval)
+            if behaviour.mode == "midstream" and index == behaviour.tokens // 3:
+                self._chunk(_frame({"error": {"message": "Mock provider error", "code": 502}}))
+                break
+            if behaviour.mode == "malformed" and index % 10 == 5:
+                self._chunk(b"data: {not json\n\n")
+            word = WORDS[index % len(WORDS)]
+            self._chunk(_frame(dict(base, choices=[{"index": 0, "delta": {"role": "assistant", "content": word + " "},
+                                                    "finish_reason": None}])))
+        self._chunk(_frame(dict(base, choices=[{"index": 0, "delta": {"content": ""}, "finish_reason": "stop"}],
+                                usage={"prompt_tokens": prompt_bytes // 4, "completion_tokens": behaviour.tokens,
+                                       "total_tokens": prompt_bytes // 4 + behaviour.tokens})))
+        self._chunk(b"data: [DONE]\n\n")
+        self._chunk(b"")
+
+    def _chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _json(self, code, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The benchmark opens many connections at once
+    request_queue_size = 128
+
+    def __init__(self, address, config):
+        super().__init__(address, Handler)
+        self.config = config
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up (timeouts, cancelled hedges) are part of the test
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/api/v1"
+
+
+def start_server(config=None, host="127.0.0.1", port=0):
+    """Starts the mock in a daemon thread; port 0 picks a free one. Returns the server."""
+    server = MockServer((host, port), config or MockConfig())
+    threading.Thread(target=server.serve_forever, name="mock-openrouter", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor OpenRouter simulado (SSE).")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ttft", type=float, default=0.2, help="segundos hasta el primer token")
+    parser.add_argument("--rate", type=float, default=60.0, help="tokens por segundo")
+    parser.add_argument("--tokens", type=int, default=60, help="tokens por respuesta")
+    parser.add_argument("--model", action="append", default=[], metavar="MODELO=MODO",
+                        help="ok, 429, 402, timeout, malformed o midstream para un modelo (repetible)")
+    args = parser.parse_args()
+
+    default = Behaviour(ttft=args.ttft, rate=args.rate, tokens=args.tokens)
+    models = {}
+    for spec in args.model:
+        model, _, mode = spec.rpartition("=")
+        models[model] = default.copy(mode=mode)
+    server = MockServer((args.host, args.port), MockConfig(default, models))
+    print(f"Mock OpenRouter en {server.base_url} (Ctrl+C para salir)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Micro-benchmark of the SSE stream parser on recorded OpenRouter streams.
+
+Compares the line-by-line parser call_openrouter used before sse.py
+(requests' iter_lines, decode every line, json.loads every frame) with
+sse.iter_events, both fed the same recorded bytes cut into socket-sized
+chunks through a requests.Response, as in production.
+
+sse.py is there for correctness (multi-line data, CRLF, keep-alives, typed
+provider errors, usage and timings), not speed: both parsers spend most of
+their time in one JSON decode per frame, and sse.py also times every delta.
+This checks that it stays close to the old parser, including on small reads
+(--chunk 64).
+
+    python benchmarks/sse_bench.py [--repeat 200] [--chunk 512]
+
+Recorded streams live in benchmarks/streams/*.sse (raw response bodies).
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sse import Delta, iter_events  # noqa: E402
+
+STREAMS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "streams")
+
+
+class _RecordedRaw:
+    """Stands in for the urllib3 response: hands out the recorded chunks."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+
+    def stream(self, chunk_size, decode_content=True):
+        yield from self._chunks
+
+
+def _response(chunks):
+    response = requests.Response()
+    response.raw = _RecordedRaw(chunks)
+    response.status_code = 200
+    return response
+
+
+def legacy_parse(chunks):
+    """The previous parser: requests' iter_lines, then decode + json.loads per line."""
+    text = []
+    for line in _response(chunks).iter_lines():
+        if line:
+            line_str = line.decode('utf-8')
+            if line_str.startswith('data: '):
+                data_str = line_str[6:]
+                if data_str == '[DONE]':
+                    break
+                try:
+                    data_json = json.loads(data_str)
+                    if "choices" in data_json and len(data_json["choices"]) > 0:
+                        delta = data_json["choices"][0].get("delta", {})
+                        if "content" in delta:
+                            text.append(delta["content"])
+                except Exception:
+                    pass
+    return "".join(text)
+
+
+def new_parse(chunks):
+    """What utils._iter_content does now."""
+    events = iter_events(_response(chunks).iter_content(chunk_size=None))
+    return "".join(event.text for event in events if type(event) is Delta)
+
+
+def bench(parse, chunks, repeat):
+    best = float("inf")
+    for _ in range(5):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            parse(chunks)
+        best = min(best, time.perf_counter() - started)
+    return best / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--chunk", type=int, default=512, help="bytes per simulated socket read")
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(STREAMS_DIR, "*.sse")))
+    if not paths:
+        sys.exit(f"No hay streams grabados en {STREAMS_DIR}")
+    print(f"{'stream':<20} {'bytes':>7} {'frames':>7} {'legacy µs':>10} {'sse.py µs':>10} {'speedup':>8}")
+    for path in paths:
+        with open(path, "rb") as f:
+            raw = f.read()
+        chunks = [raw[i:i + args.chunk] for i in range(0, len(raw), args.chunk)]
+        assert new_parse(chunks) == legacy_parse(chunks), f"{path}: parsers disagree"
+        legacy = bench(legacy_parse, chunks, args.repeat)
+        new = bench(new_parse, chunks, args.repeat)
+        frames = raw.count(b"\ndata: ") + raw.startswith(b"data: ")
+        print(f"{os.path.basename(path):<20} {len(raw):>7} {frames:>7} {legacy * 1e6:>10.1f} {new * 1e6:>10.1f} "
+              f"{legacy / new:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
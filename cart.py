@@ -0,0 +1,63 @@
+"""
+Shopping cart for the storefront.
+
+Lines are keyed by SKU with a quantity, so 40 kumis are one line instead of
+40 entries, and the total is summed over those few lines. Each line prices
+all its units with one menu item, so the total, the line amounts, the
+WhatsApp order and the Wompi amount always agree, even after menu.json
+changes a price.
+"""
+
+
+class Cart:
+    """Quantity-aggregated cart: sku -> line, plus a running unit count."""
+
+    def __init__(self):
+        # sku -> {"item": <menu item dict>, "qty": int}, in the order products were first added
+        self.lines = {}
+        self.count = 0
+
+    def __bool__(self):
+        return self.count > 0
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def total(self):
+        return sum(line["item"]["price"] * line["qty"] for line in self.lines.values())
+
+    def add(self, item, qty=1):
+        """Adds `qty` units of a menu item; the whole line takes this item's (current) price."""
+        line = self.lines.get(item["sku"])
+        if line is None:
+            line = self.lines[item["sku"]] = {"item": item, "qty": 0}
+        line["item"] = item
+        line["qty"] += qty
+        self.count += qty
+
+    def remove(self, sku, qty=1):
+        """Removes up to `qty` units of a SKU, dropping the line when it reaches zero."""
+        line = self.lines.get(sku)
+        if line is None:
+            return
+        qty = min(qty, line["qty"])
+        line["qty"] -= qty
+        self.count -= qty
+        if line["qty"] == 0:
+            del self.lines[sku]
+
+    def clear(self):
+        self.lines.clear()
+        self.count = 0
+
+    def order_text(self):
+        """Item list for the WhatsApp order message, one line per product."""
+        return "\n".join(
+            f"- {line['qty']} x {line['item']['name']} (${line['item']['price'] * line['qty']:,})"
+            for line in self.lines.values()
+        )
+
+    def amount_in_cents(self):
+        """Total in cents, as Wompi expects it."""
+        return self.total * 100
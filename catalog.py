@@ -0,0 +1,121 @@
+"""
+Menu catalog for Kumis del Balcón.
+
+The menu lives in menu.json so staff can change prices or products without a
+redeploy. load_catalog() re-reads the file only when its mtime changes and
+builds every derived view (SKU index, category lists, price lookup, the menu
+text for the assistant prompt) once per catalog version, so each rerun or
+chat message only does dictionary lookups.
+"""
+import hashlib
+import json
+import os
+import threading
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+CATALOG_FILE = os.path.join(APP_DIR, "menu.json")
+
+REQUIRED_FIELDS = ("sku", "name", "price", "desc", "img")
+
+# Allergen fields of an item:
+# - "contains": allergens it has, from ALLERGENS; must agree with its "details"
+# - "gluten_free": true / "free_of": [...]: allergens it is declared NOT to have.
+#   Leaving an allergen out of "contains" says nothing: only these declarations
+#   back a "no contiene" answer.
+ALLERGENS = ("gluten", "lácteos", "lactosa", "huevo", "azúcar", "nueces")
+# Allergens that an ingredient implies: anything with dairy has lactose
+IMPLIED_BY = {"lactosa": {"lactosa", "lácteos"}}
+
+
+def has_allergen(item, allergen):
+    """True if the item's "contains" list includes `allergen` (or something implying it)."""
+    return bool(set(item.get("contains") or ()) & IMPLIED_BY.get(allergen, {allergen}))
+
+
+def declared_free(item, allergen):
+    """True only if the catalog explicitly says the item has no `allergen`."""
+    if allergen == "gluten" and item.get("gluten_free"):
+        return True
+    # Declared free of dairy means free of lactose too
+    return bool(set(item.get("free_of") or ()) & IMPLIED_BY.get(allergen, {allergen}))
+
+
+class Catalog:
+    """An immutable snapshot of menu.json plus its precomputed lookups."""
+
+    def __init__(self, data, version):
+        self.version = version
+        # category name -> list of item dicts, in file order (same shape the UI always used)
+        self.categories = {}
+        self.items_by_sku = {}
+        self.category_by_sku = {}
+
+        for category in data["categories"]:
+            items = []
+            for raw in category["items"]:
+                missing = [field for field in REQUIRED_FIELDS if field not in raw]
+                if missing:
+                    raise ValueError(f"Producto sin campos {missing}: {raw.get('name', raw)}")
+                item = dict(raw)
+                item["price"] = int(item["price"])
+                if item["sku"] in self.items_by_sku:
+                    raise ValueError(f"SKU duplicado en el menú: {item['sku']}")
+                self.items_by_sku[item["sku"]] = item
+                self.category_by_sku[item["sku"]] = category["name"]
+                items.append(item)
+            self.categories[category["name"]] = items
+
+        self.category_names = list(self.categories)
+        self.prices = {sku: item["price"] for sku, item in self.items_by_sku.items()}
+        self.prompt_menu = self._build_prompt_menu()
+
+    def _build_prompt_menu(self):
+        """Menu and prices as plain text for the assistant's system prompt."""
+        lines = []
+        for category, items in self.categories.items():
+            lines.append(f"\n### {category}:")
+            for item in items:
+                lines.append(f"- {item['name']}: ${item['price']:,} ({item['desc']})")
+        return "\n".join(lines) + "\n"
+
+    def item(self, sku):
+        return self.items_by_sku[sku]
+
+    def price(self, sku):
+        return self.prices[sku]
+
+
+_lock = threading.Lock()
+# path -> (mtime_ns, Catalog)
+_cache = {}
+
+
+def load_catalog(path=CATALOG_FILE):
+    """
+    Returns the current Catalog, re-parsing menu.json only when it changed.
+    - One os.stat per call; parsing and derived views happen once per version.
+    - If an edited file is broken, keeps serving the last good catalog.
+    """
+    mtime = os.stat(path).st_mtime_ns
+    cached = _cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    with _lock:
+        cached = _cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        try:
+            with open(path, "rb") as f:
+                raw = f.read()
+            version = hashlib.sha256(raw).hexdigest()[:12]
+            if cached and cached[1].version == version:
+                catalog = cached[1]  # Touched but unchanged
+            else:
+                catalog = Catalog(json.loads(raw.decode("utf-8")), version)
+        except (ValueError, KeyError, TypeError):
+            if not cached:
+                raise
+            catalog = cached[1]  # Don't retry the broken file until it changes again
+        _cache[path] = (mtime, catalog)
+        return catalog
@@ -0,0 +1,133 @@
+"""
+Conversation history for the La Vaquita chat.
+
+Sending the whole chat on every turn makes each reply slower and costlier
+than the last, and long chats overflow the small fallback models. Instead:
+- the last KEEP_TURNS exchanges go to the model verbatim;
+- older ones are folded, once, into a rolling summary that is kept and
+  extended as the chat grows (no extra model call, it is extractive);
+- fit_to_context() trims the payload to each model's context window;
+- at most MAX_STORED_MESSAGES are kept in session state for display.
+Token counts are offline estimates (knowledge.estimate_tokens).
+"""
+from knowledge import estimate_tokens
+
+# Exchanges (user + assistant) sent verbatim
+KEEP_TURNS = 4
+# Messages kept per session for display; older ones only live in the summary
+MAX_STORED_MESSAGES = 40
+# The summary keeps its newest lines within this many tokens
+SUMMARY_TOKEN_BUDGET = 300
+# How much of each folded message the summary keeps
+SUMMARY_USER_CHARS = 120
+SUMMARY_ASSISTANT_CHARS = 160
+
+# Context windows (tokens) of the models we call; unknown models get the default
+MODEL_CONTEXT_TOKENS = {
+    "mistralai/mistral-small-3.1-24b-instruct:free": 96000,
+    "meta-llama/llama-3.2-3b-instruct:free": 8192,
+    "google/gemma-3-e4b-it:free": 8192,
+    "cognitivecomputations/dolphin3.0-r1-mistral-24b:free": 32768,
+    "liquid/lfm-2.5-1.2b-instruct:free": 8192,
+    "nvidia/nemotron-nano-9b-v2:free": 32768,
+}
+DEFAULT_CONTEXT_TOKENS = 8192
+# Room left for the answer
+RESPONSE_TOKEN_RESERVE = 1024
+# Per-message overhead of the chat format (role markers)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def message_tokens(message):
+    """Estimated tokens of one API message (plain or content-part form)."""
+    content = message["content"]
+    if not isinstance(content, str):
+        content = "".join(part.get("text", "") for part in content)
+    return estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+
+
+def fit_to_context(model, messages, reserve=RESPONSE_TOKEN_RESERVE):
+    """
+    Drops the oldest conversation messages until the payload fits `model`'s
+    context window. System messages and the latest message are always kept.
+    """
+    limit = MODEL_CONTEXT_TOKENS.get(model, DEFAULT_CONTEXT_TOKENS) - reserve
+    sizes = [message_tokens(message) for message in messages]
+    total = sum(sizes)
+    if total <= limit:
+        return messages
+    keep = [True] * len(messages)
+    for index in range(len(messages) - 1):
+        if total <= limit:
+            break
+        if messages[index]["role"] == "system":
+            continue
+        keep[index] = False
+        total -= sizes[index]
+    return [message for message, kept in zip(messages, keep) if kept]
+
+
+def _clip(text, limit):
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit].rsplit(" ", 1)[0] + "…"
+
+
+def _first_sentence(text):
+    text = " ".join(text.split())
+    for mark in (". ", "! ", "? "):
+        cut = text.find(mark)
+        if 0 < cut < SUMMARY_ASSISTANT_CHARS:
+            return text[:cut + 1]
+    return text
+
+
+class ChatHistory:
+    """Displayed messages plus a rolling summary of what scrolled out of the payload."""
+
+    def __init__(self):
+        self.messages = []
+        self._summary_lines = []
+        # How many messages (counted from the start of the chat) are in the summary
+        self._summarized = 0
+        # How many messages were dropped from self.messages (all already summarized)
+        self._dropped = 0
+
+    def __len__(self):
+        return len(self.messages)
+
+    def append(self, role, content):
+        self.messages.append({"role": role, "content": content})
+        self._roll()
+
+    def clear(self):
+        self.__init__()
+
+    @property
+    def summary(self):
+        return "\n".join(self._summary_lines)
+
+    def _roll(self):
+        """Folds messages older than the verbatim window into the summary, then caps storage."""
+        verbatim_start = self._dropped + max(0, len(self.messages) - KEEP_TURNS * 2)
+        while self._summarized < verbatim_start:
+            message = self.messages[self._summarized - self._dropped]
+            if message["role"] == "user":
+                self._summary_lines.append("- Cliente: " + _clip(message["content"], SUMMARY_USER_CHARS))
+            else:
+                self._summary_lines.append("- Vaquita: " + _clip(_first_sentence(message["content"]), SUMMARY_ASSISTANT_CHARS))
+            self._summarized += 1
+        while self._summary_lines and estimate_tokens(self.summary) > SUMMARY_TOKEN_BUDGET:
+            self._summary_lines.pop(0)
+
+        overflow = len(self.messages) - MAX_STORED_MESSAGES
+        if overflow > 0:
+            del self.messages[:overflow]
+            self._dropped += overflow
+
+    def payload(self):
+        """Messages for the API: the summary (if any) and the last KEEP_TURNS exchanges."""
+        recent = self.messages[-KEEP_TURNS * 2:]
+        if not self._summary_lines:
+            return [dict(message) for message in recent]
+        summary = {"role": "system", "content": "Resumen de la conversación anterior:\n" + self.summary}
+        return [summary] + [dict(message) for message in recent]
@@ -0,0 +1,155 @@
+"""
+Background worker for assistant replies.
+
+The LLM call and its token stream run in a daemon thread that fills a text
+buffer, so the Streamlit script never waits on the model: the storefront
+paints and stays interactive, and the chat fragment just reads the buffer,
+painting when a flush brings new text (wait_for_update).
+Nothing in here touches Streamlit; collect whatever the call needs from
+session state before starting the worker.
+"""
+import threading
+import time
+
+# Stream deltas are grouped before they reach the UI: flushed when the
+# oldest buffered text is this old (seconds) or the buffer is this long
+COALESCE_INTERVAL = 0.05
+COALESCE_MAX_CHARS = 40
+# A reply started right after a cancelled one waits up to this long (seconds)
+# for it to stop, since until then it holds the session's admission slot
+CANCEL_WAIT = 10.0
+
+
+def coalesce(chunks, interval=COALESCE_INTERVAL, max_chars=COALESCE_MAX_CHARS, clock=time.monotonic):
+    """
+    Regroups a stream of small deltas into fewer, larger ones, so a fast
+    model's one-character deltas don't each become a UI update. Works on any
+    iterable of strings (st.write_stream accepts the result as is).
+    Flushes are checked when a delta arrives, so during a pause in the model
+    the last `interval` worth of text waits for the next delta or the end.
+    If `chunks` raises, the buffered text is still yielded before the error.
+    """
+    buffer = []
+    size = 0
+    first_at = None
+    started = False
+    closed = False
+    try:
+        for chunk in chunks:
+            if not chunk:
+                continue
+            if not started:
+                # The first delta goes out at once: time to first paint matters most
+                started = True
+                yield chunk
+                continue
+            if first_at is None:
+                first_at = clock()
+            buffer.append(chunk)
+            size += len(chunk)
+            if size >= max_chars or clock() - first_at >= interval:
+                yield "".join(buffer)
+                buffer.clear()
+                size = 0
+                first_at = None
+    except GeneratorExit:
+        closed = True  # The consumer stopped: nobody is left to take the rest
+        raise
+    finally:
+        if buffer and not closed:
+            yield "".join(buffer)
+
+
+class BackgroundReply:
+    """
+    Runs `produce()` in a thread and collects what it returns or streams.
+    `after` is a cancelled BackgroundReply to wait for before starting.
+    """
+
+    def __init__(self, produce, after=None):
+        self._produce = produce
+        self._after = after
+        self._cancelled = threading.Event()
+        self._chunks = []
+        self._lock = threading.Lock()
+        # Notified on every flush, so the UI can paint when text arrives instead of on a clock
+        self._updated = threading.Condition(self._lock)
+        self._done = threading.Event()
+        self.error = None
+        self.started_at = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="chat-reply", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            if self._after is not None:
+                self._after.wait(CANCEL_WAIT)
+                self._after = None
+            if self._cancelled.is_set():
+                return
+            response = self._produce()
+            if isinstance(response, str):
+                self._append(response)
+            else:
+                # The UI only sees whole coalesced pieces; fewer lock round-trips too
+                try:
+                    for chunk in coalesce(response):
+                        if self._cancelled.is_set():
+                            break
+                        self._append(chunk)
+                finally:
+                    # Closing the stream gives back its admission slot (its on_close)
+                    close = getattr(response, "close", None)
+                    if close is not None:
+                        close()
+        except Exception as e:
+            self.error = e
+            self._append(f"Lo siento, amiguito, mi ubre se enredó (Error: {str(e)[:50]}). 🐮")
+        finally:
+            with self._lock:
+                self._done.set()
+                self._updated.notify_all()
+
+    def _append(self, chunk):
+        with self._lock:
+            self._chunks.append(chunk)
+            self._updated.notify_all()
+
+    def cancel(self):
+        """
+        Asks the worker to stop: it drops the rest of the reply and closes the
+        stream as soon as the call returns or the next delta arrives.
+        """
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    @property
+    def version(self):
+        """Flushes so far (plus one once done): unchanged means nothing new to paint."""
+        return len(self._chunks) + self._done.is_set()
+
+    def text(self):
+        """Everything received so far."""
+        with self._lock:
+            return "".join(self._chunks)
+
+    def snapshot(self):
+        """(text, version), read together."""
+        with self._lock:
+            return "".join(self._chunks), self.version
+
+    def wait_for_update(self, version, timeout):
+        """Blocks until `version` is outdated (new text, or the end) or `timeout` passes."""
+        with self._lock:
+            return self._updated.wait_for(lambda: self.version != version, timeout)
+
+    def wait(self, timeout=None):
+        """Blocks until the reply is complete (used outside the UI, e.g. scripts)."""
+        return self._done.wait(timeout)
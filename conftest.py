@@ -0,0 +1,2 @@
+# test_api.py is a manual check against the live OpenRouter API (python test_api.py)
+collect_ignore = ["test_api.py"]
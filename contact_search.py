@@ -0,0 +1,211 @@
+"""
+Search index for the CRM contacts page.
+
+Built once per version of the contacts table (see crm_store.load_frame) and
+shared by every session, so a keystroke in the search box costs a few numpy
+operations instead of str.contains over every text cell:
+- Name, Company, Email and Phone are normalized like the assistant's
+  knowledge base (knowledge.normalize: lowercase, no accents), so "Balcón"
+  finds "Balcon". Unlike the knowledge base, no stopwords are dropped:
+  "Mas" and "Cuesta" are surnames here. Phone numbers are indexed as their
+  digits.
+- Vocabulary tokens are kept sorted with their rows stored contiguously, so
+  a prefix ("balc") is one bisect and one slice, however many tokens share it.
+- Trigrams of the vocabulary find query words inside longer tokens
+  ("villa" in "jaimevilla70p", the middle digits of a phone number).
+- Every query word must match. Rows are ranked by the field and kind of
+  match (exact > prefix > inside a word; name > company > email > phone) and
+  only the top `limit` are returned.
+"""
+import bisect
+import itertools
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+
+from knowledge import normalize
+
+# Field weights for ranking
+FIELDS = {"Name": 4.0, "Company": 3.0, "Email": 2.0, "Phone": 1.0}
+# Match kinds, multiplied by the field weight
+EXACT, PREFIX, INFIX = 3.0, 2.0, 1.0
+# Shortest query word looked up inside other words (trigrams)
+MIN_INFIX = 3
+SEARCH_LIMIT = 50
+
+_NON_DIGITS = re.compile(r"[^0-9]")
+
+
+# Tokens only contain [a-z0-9] (knowledge.normalize); each byte gets a code 1..36, 0 is padding
+_ALPHABET = b"abcdefghijklmnopqrstuvwxyz0123456789"
+_BASE = len(_ALPHABET) + 1
+_BYTE_CODES = np.zeros(256, dtype=np.int32)
+_BYTE_CODES[np.frombuffer(_ALPHABET, dtype=np.uint8)] = np.arange(1, _BASE)
+# Vocabulary tokens per numpy batch when building the trigram postings
+TRIGRAM_BATCH = 65536
+
+
+def _trigram_codes(tokens):
+    """(codes, token positions) for every trigram of `tokens`."""
+    chars = _BYTE_CODES[np.array(tokens, dtype="S").view(np.uint8).reshape(len(tokens), -1)]
+    codes, owners = [], []
+    for start in range(chars.shape[1] - 2):
+        window = chars[:, start:start + 3]
+        present = np.flatnonzero(window[:, 2])  # Shorter tokens end in padding
+        codes.append((window[present, 0] * _BASE + window[present, 1]) * _BASE + window[present, 2])
+        owners.append(present)
+    if not codes:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int64)
+    return np.concatenate(codes), np.concatenate(owners)
+
+
+def _field_tokens(field, value):
+    if field == "Phone":
+        digits = _NON_DIGITS.sub("", value)
+        return [digits] if digits else []
+    return normalize(value).split()
+
+
+class ContactIndex:
+    """Token -> rows postings over one contacts frame; rows are positions in that frame."""
+
+    def __init__(self, frame):
+        self.size = len(frame)
+        entry_tokens, entry_rows, entry_weights = [], [], []
+        for field, weight in FIELDS.items():
+            if field not in frame.columns:
+                continue
+            # Names and companies repeat a lot: tokenize each distinct value once
+            codes, uniques = frame[field].factorize()
+            value_tokens = [_field_tokens(field, str(value)) for value in uniques.tolist()]
+            lengths = np.array([len(tokens) for tokens in value_tokens] + [0], dtype=np.int64)
+            starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+            row_lengths = lengths[codes]  # Missing values have code -1: the zero-length sentinel
+            total = int(row_lengths.sum())
+            if not total:
+                continue
+            flat = np.array(list(itertools.chain.from_iterable(value_tokens)), dtype=object)
+            offsets = np.repeat(starts[codes] - np.cumsum(row_lengths) + row_lengths, row_lengths)
+            entry_tokens.append(flat[offsets + np.arange(total)])
+            entry_rows.append(np.repeat(np.arange(self.size, dtype=np.int64), row_lengths))
+            entry_weights.append(np.full(total, weight, dtype=np.float32))
+
+        # Sorted vocabulary; each token's rows are one contiguous slice of self._rows
+        if entry_tokens:
+            tokens, vocab = pd.factorize(np.concatenate(entry_tokens), sort=True)
+            self.vocab = vocab.tolist()
+            order = np.argsort(tokens, kind="stable")
+            self._rows = np.concatenate(entry_rows)[order]
+            self._weights = np.concatenate(entry_weights)[order]
+            self._offsets = np.searchsorted(tokens[order], np.arange(len(self.vocab) + 1))
+        else:
+            self.vocab = []
+            self._rows = np.empty(0, dtype=np.int64)
+            self._weights = np.empty(0, dtype=np.float32)
+            self._offsets = np.zeros(1, dtype=np.int64)
+
+        # Trigram -> vocabulary token ids, as one sorted array sliced by _gram_offsets
+        codes, owners = [np.empty(0, dtype=np.int32)], [np.empty(0, dtype=np.int64)]
+        for start in range(0, len(self.vocab), TRIGRAM_BATCH):
+            batch_codes, batch_owners = _trigram_codes(self.vocab[start:start + TRIGRAM_BATCH])
+            codes.append(batch_codes)
+            owners.append(batch_owners + start)
+        codes, owners = np.concatenate(codes), np.concatenate(owners)
+        order = np.argsort(codes, kind="stable")
+        self._gram_tokens = owners[order]
+        self._gram_offsets = np.searchsorted(codes[order], np.arange(_BASE ** 3 + 1))
+
+    def _postings(self, first, last):
+        """Rows and weights of tokens first..last-1 (contiguous in the sorted vocabulary)."""
+        return self._rows[self._offsets[first]:self._offsets[last]], self._weights[self._offsets[first]:self._offsets[last]]
+
+    def _gather(self, token_ids):
+        """Rows and weights of scattered tokens, in one fancy-indexing pass."""
+        starts = self._offsets[token_ids]
+        lengths = self._offsets[token_ids + 1] - starts
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(int(lengths.sum()))
+        return self._rows[positions], self._weights[positions]
+
+    def _match(self, word):
+        """Score of every row for one query word (0 = no match)."""
+        first = bisect.bisect_left(self.vocab, word)
+        last = bisect.bisect_left(self.vocab, word + "\uffff")
+        parts = []
+        if first < last:
+            exact = self.vocab[first] == word
+            if exact:
+                rows, weights = self._postings(first, first + 1)
+                parts.append((rows, weights * EXACT))
+                first += 1
+            rows, weights = self._postings(first, last)
+            parts.append((rows, weights * PREFIX))
+        if len(word) >= MIN_INFIX:
+            # Tokens holding all of the word's trigrams, then a substring check
+            grams = sorted(set(_trigram_codes([word])[0].tolist()),
+                           key=lambda code: self._gram_offsets[code + 1] - self._gram_offsets[code])
+            candidates = None
+            for code in grams:
+                tokens = self._gram_tokens[self._gram_offsets[code]:self._gram_offsets[code + 1]]
+                candidates = np.unique(tokens) if candidates is None else np.intersect1d(candidates, tokens)
+                if not len(candidates):
+                    break
+            inside = [token_id for token_id in candidates.tolist()
+                      if word in self.vocab[token_id] and not self.vocab[token_id].startswith(word)]
+            if inside:
+                rows, weights = self._gather(np.array(inside, dtype=np.int64))
+                parts.append((rows, weights * INFIX))
+        # Best score per row, dense: at a million rows this beats sorting the matches
+        best = np.zeros(self.size, dtype=np.float32)
+        for rows, scores in parts:
+            np.maximum.at(best, rows, scores)
+        return best
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        """
+        Returns (positions, total): up to `limit` row positions, best first
+        (ties keep table order), and how many rows matched in all.
+        """
+        words = []
+        for word in normalize(query).split():
+            if word not in words:
+                words.append(word)
+        if not words:
+            return np.arange(min(self.size, limit)), self.size
+        total_scores = None
+        for word in words:
+            best = self._match(word)
+            if total_scores is None:
+                total_scores = best
+            else:
+                # Every word must match: a miss zeroes the row
+                total_scores = np.where((best > 0) & (total_scores > 0), total_scores + best, 0)
+        rows = np.flatnonzero(total_scores)
+        scores = total_scores[rows]
+        total = len(rows)
+        if total > limit:
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            rows, scores = rows[top], scores[top]
+        order = np.lexsort((rows, -scores))
+        return rows[order], total
+
+
+_lock = threading.Lock()
+# Index for the latest contacts version: (version, ContactIndex)
+_cached = None
+
+
+def get_contact_index(frame):
+    """The ContactIndex for `frame`, built once per version (frame.attrs["version"])."""
+    global _cached
+    version = frame.attrs.get("version")
+    if version is None:
+        return ContactIndex(frame)
+    cached = _cached
+    if cached is None or cached[0] != version:
+        with _lock:
+            cached = _cached
+            if cached is None or cached[0] != version:
+                cached = _cached = (version, ContactIndex(frame))
+    return cached[1]
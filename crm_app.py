@@ -1,40 +1,81 @@
 import streamlit as st
-import pandas as pd
 import plotly.express as px
-import os
 from datetime import datetime
 import requests
 import json
 from utils import call_openrouter
+from contact_search import SEARCH_LIMIT, get_contact_index
+from crm_store import CONTACT_STATUSES, DEAL_STAGES, blank_rows, editor_changes, get_store, load_frame, query
 
 # --- CONFIGURATION ---
 st.set_page_config(page_title="Growth CRM", page_icon="🚀", layout="wide")
 
 # --- DATA PERSISTENCE ---
-CONTACTS_FILE = "contacts.csv"
-DEALS_FILE = "deals.csv"
+# Rows live in crm_store (SQLite by default, CSV with CRM_STORAGE=csv); the
+# DataFrames are indexed by row id so single rows can be written directly.
+# Pages ask the store for what they show (one page, a count, a sum) instead
+# of loading whole tables; results are cached until the table changes.
+store = get_store()
 
-def load_data():
-    if not os.path.exists(CONTACTS_FILE):
-        contacts = pd.DataFrame(columns=["Name", "Company", "Email", "Phone", "Status", "Last Contact"])
-        contacts.to_csv(CONTACTS_FILE, index=False)
-    else:
-        contacts = pd.read_csv(CONTACTS_FILE)
+PAGE_SIZES = [25, 50, 100]
+KANBAN_LIMIT = 20
 
-    if not os.path.exists(DEALS_FILE):
-        deals = pd.DataFrame(columns=["Deal Name", "Company", "Value", "Stage", "Close Date"])
-        deals.to_csv(DEALS_FILE, index=False)
-    else:
-        deals = pd.read_csv(DEALS_FILE)
-    
-    return contacts, deals
+def editor_key(table):
+    # A new key after each save, so the editor starts clean on the reloaded data
+    return f"{table}_editor_{st.session_state.get(f'{table}_editor_rev', 0)}"
+
+def apply_edits(table, frame, key, carried=0):
+    """on_change of a data editor: writes only the rows in its change set, to its own table."""
+    state = st.session_state[key]
+    updates, inserts, deletes = editor_changes(table, frame, state)
+    # The next editor (after a save, or another filter, sort or page) shows these again
+    st.session_state[f"{table}_blank_rows"] = blank_rows(frame, state, carried)
+    if not (updates or inserts or deletes):
+        # Only blank rows so far ("+ add row" syncs right away): a new key would drop them
+        return
+    store.apply_changes(table, updates, inserts, deletes)
+    st.session_state[f"{table}_editor_rev"] = st.session_state.get(f"{table}_editor_rev", 0) + 1
 
-def save_data(contacts, deals):
-    contacts.to_csv(CONTACTS_FILE, index=False)
-    deals.to_csv(DEALS_FILE, index=False)
+def paged_editor(table, column_config, filter_column, filter_options, sort_columns):
+    """Editable grid over one page of `table`; filtering, sorting and paging run in the store."""
+    col_filter, col_sort, col_desc, col_size, col_page = st.columns([2, 2, 1, 1, 1])
+    selected = col_filter.selectbox(filter_column, ["All"] + filter_options, key=f"{table}_filter")
+    sort_by = col_sort.selectbox("Sort by", ["Added"] + sort_columns, key=f"{table}_sort")
+    descending = col_desc.toggle("Desc.", key=f"{table}_desc")
+    page_size = col_size.selectbox("Rows", PAGE_SIZES, key=f"{table}_page_size")
+    filters = {filter_column: selected} if selected != "All" else None
 
-# Load data locally
-contacts_df, deals_df = load_data()
+    total = query(table, "count", filters=filters, store=store)
+    pages = max(1, -(-total // page_size))
+    page_key = f"{table}_page"
+    if st.session_state.get(page_key, 1) > pages:
+        st.session_state[page_key] = pages  # The filter or a delete left fewer pages
+    page_number = col_page.number_input("Page", min_value=1, max_value=pages, key=page_key)
+
+    offset = (page_number - 1) * page_size
+    frame = query(table, "page", offset, page_size, sort_by=None if sort_by == "Added" else sort_by,
+                  descending=descending, filters=filters, store=store)
+    # The editor needs a range index to add rows; ids stay in `frame`
+    key = f"{editor_key(table)}_{selected}_{sort_by}_{descending}_{page_size}_{page_number}"
+    if key not in st.session_state:
+        # A new editor: rows added but not filled in yet in the last one go at the bottom
+        st.session_state[f"{table}_carried_rows"] = st.session_state.get(f"{table}_blank_rows", 0)
+    carried = st.session_state.get(f"{table}_carried_rows", 0)
+    data = frame.reset_index(drop=True)
+    if carried:
+        data = data.reindex(range(len(frame) + carried))
+    st.data_editor(
+        data,
+        use_container_width=True,
+        num_rows="dynamic",
+        column_config=column_config,
+        hide_index=True,
+        key=key,
+        on_change=apply_edits,
+        args=(table, frame, key, carried)
+    )
+    if total:
+        st.caption(f"Rows {offset + 1:,}–{offset + len(frame):,} of {total:,}")
 
 # --- SIDEBAR STYLE ---
 st.sidebar.title("🚀 Growth CRM")
@@ -49,10 +90,10 @@ if page == "Dashboard":
     # Top KPI Cards
     col1, col2, col3, col4 = st.columns(4)
     
-    total_pipeline_value = deals_df['Value'].sum() if not deals_df.empty else 0
-    total_deals = len(deals_df)
-    total_contacts = len(contacts_df)
-    won_deals = len(deals_df[deals_df['Stage'] == 'Closed Won']) if not deals_df.empty else 0
+    total_pipeline_value = query("deals", "total", "Value", store=store)
+    total_deals = query("deals", "count", store=store)
+    total_contacts = query("contacts", "count", store=store)
+    won_deals = query("deals", "count", filters={"Stage": "Closed Won"}, store=store)
 
     col1.metric("Pipeline Value", f"${total_pipeline_value:,.0f}")
     col2.metric("Active Deals", total_deals)
@@ -63,8 +104,9 @@ if page == "Dashboard":
 
     # Recent Deals Table
     st.subheader("Recent Deals")
-    if not deals_df.empty:
-        st.dataframe(deals_df.tail(5), use_container_width=True)
+    if total_deals:
+        recent_deals = query("deals", "page", 0, 5, descending=True, store=store)
+        st.dataframe(recent_deals.iloc[::-1], use_container_width=True)
     else:
         st.info("No deals found. Go to 'Pipeline' to add one.")
 
@@ -81,60 +123,52 @@ elif page == "Contacts":
                 company = st.text_input("Company")
                 email = st.text_input("Email")
                 phone = st.text_input("Phone")
-                status = st.selectbox("Status", ["Lead", "Customer", "Partner", "Inactive"])
+                status = st.selectbox("Status", CONTACT_STATUSES)
                 submitted = st.form_submit_button("Save Contact")
                 
                 if submitted:
-                    new_contact = pd.DataFrame([{
+                    store.insert("contacts", {
                         "Name": name, "Company": company, "Email": email, 
                         "Phone": phone, "Status": status, 
                         "Last Contact": datetime.now().strftime("%Y-%m-%d")
-                    }])
-                    contacts_df = pd.concat([contacts_df, new_contact], ignore_index=True)
-                    save_data(contacts_df, deals_df)
+                    })
                     st.success("Contact Added!")
                     st.rerun()
 
     with col1:
-        search = st.text_input("🔍 Search Contacts", placeholder="Search by name, company...")
+        search = st.text_input("🔍 Search Contacts", placeholder="Search by name, company, email, phone...")
     
-    # Filter
+    # Filter (index built once per contacts version, shared by all sessions)
     if search:
-        filtered_df = contacts_df[
-            contacts_df['Name'].str.contains(search, case=False, na=False) |
-            contacts_df['Company'].str.contains(search, case=False, na=False)
-        ]
+        contacts_df = load_frame("contacts", store)
+        positions, total = get_contact_index(contacts_df).search(search, limit=SEARCH_LIMIT)
+        filtered_df = contacts_df.iloc[positions]
+        st.caption(f"{total:,} match{'' if total == 1 else 'es'}" + (f", showing the best {SEARCH_LIMIT}" if total > SEARCH_LIMIT else ""))
         st.dataframe(
             filtered_df, 
             use_container_width=True, 
             column_config={
                 "Email": st.column_config.LinkColumn("Email"),
                 "Status": st.column_config.SelectboxColumn(
-                    "Status", options=["Lead", "Customer", "Partner", "Inactive"]
+                    "Status", options=CONTACT_STATUSES
                 )
             },
             hide_index=True
         )
         st.info("Clear search to enable editing.")
     else:
-        edited_contacts = st.data_editor(
-            contacts_df,
-            use_container_width=True,
-            num_rows="dynamic",
+        paged_editor(
+            "contacts",
             column_config={
                 "Email": st.column_config.LinkColumn("Email"),
                 "Status": st.column_config.SelectboxColumn(
-                    "Status", options=["Lead", "Customer", "Partner", "Inactive"]
+                    "Status", options=CONTACT_STATUSES
                 )
             },
-            hide_index=True,
-            key="contacts_editor"
+            filter_column="Status",
+            filter_options=CONTACT_STATUSES,
+            sort_columns=["Name", "Company", "Last Contact"],
         )
-        
-        if not edited_contacts.equals(contacts_df):
-            contacts_df = edited_contacts
-            save_data(contacts_df, deals_df)
-            st.rerun()
 
 # --- PIPELINE PAGE ---
 elif page == "Pipeline":
@@ -143,20 +177,19 @@ elif page == "Pipeline":
     with st.expander("➕ Add New Deal"):
         with st.form("new_deal"):
             deal_name = st.text_input("Deal Name")
-            deal_company = st.selectbox("Company", contacts_df['Company'].unique()) if not contacts_df.empty else st.text_input("Company")
+            companies = query("contacts", "distinct", "Company", store=store)
+            deal_company = st.selectbox("Company", companies) if companies else st.text_input("Company")
             value = st.number_input("Value ($)", min_value=0, step=100)
-            stage = st.selectbox("Stage", ["New", "Discovery", "Proposal", "Negotiation", "Closed Won", "Closed Lost"])
+            stage = st.selectbox("Stage", DEAL_STAGES)
             close_date = st.date_input("Expected Close Date")
             submitted_deal = st.form_submit_button("Create Deal")
             
             if submitted_deal:
-                new_deal = pd.DataFrame([{
+                store.insert("deals", {
                     "Deal Name": deal_name, "Company": deal_company, 
                     "Value": value, "Stage": stage, 
                     "Close Date": close_date
-                }])
-                deals_df = pd.concat([deals_df, new_deal], ignore_index=True)
-                save_data(contacts_df, deals_df)
+                })
                 st.success("Deal Created!")
                 st.rerun()
 
@@ -167,8 +200,8 @@ elif page == "Pipeline":
     for i, stage in enumerate(stages):
         with cols[i]:
             st.markdown(f"### {stage}")
-            stage_deals = deals_df[deals_df['Stage'] == stage]
-            for _, deal in stage_deals.iterrows():
+            stage_deals = query("deals", "page", 0, KANBAN_LIMIT, filters={"Stage": stage}, store=store)
+            for deal_id, deal in stage_deals.iterrows():
                 with st.container(border=True):
                     st.markdown(f"**{deal['Deal Name']}**")
                     st.caption(f"{deal['Company']}")
@@ -177,45 +210,42 @@ elif page == "Pipeline":
                     # Action Buttons
                     col_move, col_del = st.columns(2)
                     with col_move:
-                        if st.button("➡", key=f"move_{deal['Deal Name']}_{i}", help="Move to next stage"):
+                        if st.button("➡", key=f"move_{deal_id}_{i}", help="Move to next stage"):
                             if i < len(stages) - 1:
-                                next_stage = stages[i+1]
-                                deals_df.loc[deals_df['Deal Name'] == deal['Deal Name'], 'Stage'] = next_stage
-                                save_data(contacts_df, deals_df)
+                                store.update("deals", deal_id, {"Stage": stages[i+1]})
                                 st.rerun()
                     with col_del:
-                        if st.button("🗑️", key=f"del_{deal['Deal Name']}_{i}", help="Delete Deal"):
-                            deals_df = deals_df[deals_df['Deal Name'] != deal['Deal Name']]
-                            save_data(contacts_df, deals_df)
+                        if st.button("🗑️", key=f"del_{deal_id}_{i}", help="Delete Deal"):
+                            store.delete("deals", [deal_id])
                             st.rerun()
+            if len(stage_deals) == KANBAN_LIMIT:
+                more = query("deals", "count", filters={"Stage": stage}, store=store) - KANBAN_LIMIT
+                if more:
+                    st.caption(f"+{more:,} more in the table below")
 
     st.markdown("---")
     st.subheader("📋 Deals Management (Add/Edit/Delete)")
     st.info("You can add new rows at the bottom, or select rows and press 'Delete' to remove them.")
-    edited_deals = st.data_editor(
-        deals_df,
-        use_container_width=True,
-        num_rows="dynamic",
+    paged_editor(
+        "deals",
         column_config={
             "Stage": st.column_config.SelectboxColumn(
-                "Stage", options=["New", "Discovery", "Proposal", "Negotiation", "Closed Won", "Closed Lost"]
+                "Stage", options=DEAL_STAGES
             ),
             "Value": st.column_config.NumberColumn(
                 "Value", format="$%d"
             )
         },
-        hide_index=True,
-        key="deals_editor"
+        filter_column="Stage",
+        filter_options=DEAL_STAGES,
+        sort_columns=["Value", "Close Date", "Deal Name", "Company"],
     )
-    
-    if not edited_deals.equals(deals_df):
-        deals_df = edited_deals
-        save_data(contacts_df, deals_df)
-        st.rerun()
 
 # --- ANALYTICS PAGE ---
 elif page == "Analytics":
     st.title("📈 Analytics & Insights")
+    # The charts plot every deal: this page uses the cached full table
+    deals_df = load_frame("deals", store)
     
     if not deals_df.empty:
         col1, col2 = st.columns(2)
@@ -236,7 +266,6 @@ elif page == "Analytics":
         st.markdown("---")
         
         st.subheader("Expected Close Dates")
-        deals_df['Close Date'] = pd.to_datetime(deals_df['Close Date'])
         fig_timeline = px.scatter(deals_df, x="Close Date", y="Value", color="Stage",
                                   size="Value", hover_name="Deal Name",
                                   title="Deal Value Over Time")
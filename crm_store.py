@@ -0,0 +1,615 @@
+"""
+Storage for the Growth CRM (crm_app.py).
+
+The CRM used to rewrite contacts.csv and deals.csv from scratch on every
+change. The app now reads and writes through a store with single-row
+paths, so the cost of a write depends on the size of the change, not of the table:
+- SQLiteStore (default): one database file in WAL mode, an INTEGER PRIMARY
+  KEY per row and indexes on the columns the app filters by. Inserts,
+  updates and deletes touch only their rows.
+- CSVStore: the previous files, kept for setups that want plain CSVs
+  (CRM_STORAGE=csv). Appends are cheap; anything else rewrites the file.
+
+Both hand out DataFrames with the app's column names and the row id as the
+index, so the UI can address rows directly.
+
+load_frame() is what the app reads through: it parses a table once per
+version into the typed schema below (categorical Stage/Status, int64 Value,
+datetime dates) and keeps it for every rerun and session. A rerun that
+wrote nothing costs a version check (a counter plus one PRAGMA, or one
+os.stat for CSV), not a read.
+
+Pages that only need part of a table go through query(): page(), count(),
+total() and distinct() run in SQLite (LIMIT/OFFSET, WHERE and ORDER BY on
+indexed columns), so a page view holds one page of rows, not the table.
+Results are cached per table version too.
+
+The first time the SQLite store is opened, the existing CSVs are imported
+once (migrate_csv). export_csv writes a table back to CSV, for backups:
+
+    python crm_store.py export --out backup/
+    python crm_store.py migrate          # re-run the import by hand
+"""
+import argparse
+import collections
+import contextlib
+import datetime
+import math
+import os
+import sqlite3
+import threading
+
+import pandas as pd
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+CONTACTS_FILE = os.path.join(APP_DIR, "contacts.csv")
+DEALS_FILE = os.path.join(APP_DIR, "deals.csv")
+DB_FILE = os.path.join(APP_DIR, "crm.db")
+
+# DataFrame column -> SQL column, per table, in display order
+TABLES = {
+    "contacts": {
+        "Name": "name",
+        "Company": "company",
+        "Email": "email",
+        "Phone": "phone",
+        "Status": "status",
+        "Last Contact": "last_contact",
+    },
+    "deals": {
+        "Deal Name": "deal_name",
+        "Company": "company",
+        "Value": "value",
+        "Stage": "stage",
+        "Close Date": "close_date",
+    },
+}
+CSV_FILES = {"contacts": CONTACTS_FILE, "deals": DEALS_FILE}
+
+CONTACT_STATUSES = ["Lead", "Customer", "Partner", "Inactive"]
+DEAL_STAGES = ["New", "Discovery", "Proposal", "Negotiation", "Closed Won", "Closed Lost"]
+# Column types after loading: "text", "int", "date" or a list of categories
+SCHEMAS = {
+    "contacts": {
+        "Name": "text",
+        "Company": "text",
+        "Email": "text",
+        "Phone": "text",
+        "Status": CONTACT_STATUSES,
+        "Last Contact": "date",
+    },
+    "deals": {
+        "Deal Name": "text",
+        "Company": "text",
+        "Value": "int",
+        "Stage": DEAL_STAGES,
+        "Close Date": "date",
+    },
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS contacts (
+    id INTEGER PRIMARY KEY,
+    name TEXT, company TEXT, email TEXT, phone TEXT, status TEXT, last_contact TEXT
+);
+CREATE INDEX IF NOT EXISTS contacts_name ON contacts (name);
+CREATE INDEX IF NOT EXISTS contacts_company ON contacts (company);
+CREATE INDEX IF NOT EXISTS contacts_status ON contacts (status);
+CREATE TABLE IF NOT EXISTS deals (
+    id INTEGER PRIMARY KEY,
+    deal_name TEXT, company TEXT, value INTEGER, stage TEXT, close_date TEXT
+);
+CREATE INDEX IF NOT EXISTS deals_stage ON deals (stage);
+CREATE INDEX IF NOT EXISTS deals_value ON deals (value);
+CREATE INDEX IF NOT EXISTS deals_company ON deals (company);
+CREATE INDEX IF NOT EXISTS deals_close_date ON deals (close_date);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def columns(table):
+    """The app's column names for `table`, in display order."""
+    return list(TABLES[table])
+
+
+def empty_frame(table):
+    return pd.DataFrame(columns=columns(table))
+
+
+def apply_schema(table, df):
+    """Casts a freshly read table to SCHEMAS (missing columns are added empty)."""
+    typed = {}
+    for col, kind in SCHEMAS[table].items():
+        values = df[col] if col in df.columns else pd.Series([None] * len(df), index=df.index, dtype=object)
+        if kind == "int":
+            typed[col] = pd.to_numeric(values, errors="coerce").fillna(0).astype("int64")
+        elif kind == "date":
+            typed[col] = pd.to_datetime(values, errors="coerce", format="ISO8601")
+        elif kind == "text":
+            typed[col] = values.astype(object).where(values.notna(), None).map(
+                lambda v: v if v is None or isinstance(v, str) else str(v))
+        else:
+            # Unknown values are kept as extra categories rather than lost
+            extra = sorted(set(values.dropna().astype(str)) - set(kind))
+            typed[col] = pd.Categorical(values, categories=kind + extra)
+    return pd.DataFrame(typed, index=df.index)
+
+
+def _sql_value(value):
+    """A cell as SQLite stores it: None for blanks, ISO text for dates, plain ints."""
+    if value is None:
+        return None
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if value is pd.NaT:
+        return None
+    if isinstance(value, (pd.Timestamp, datetime.datetime)):
+        return value.strftime("%Y-%m-%d")
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if hasattr(value, "item"):
+        return _sql_value(value.item())  # numpy scalars
+    return value
+
+
+class SQLiteStore:
+    """CRM tables in one SQLite file (WAL); every write touches only its rows."""
+
+    name = "sqlite"
+
+    def __init__(self, path=DB_FILE):
+        self.path = path
+        # Streamlit runs each session's script on its own thread: one shared
+        # connection, serialized by a lock (writes are a few rows each)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.RLock()
+        self._writes = collections.Counter()  # table -> writes through this store
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")  # Durable enough with WAL, far fewer fsyncs
+            self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def version(self, table):
+        """Changes whenever `table` may have changed; data_version catches other processes' commits."""
+        with self._lock:
+            return self._writes[table], self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    @contextlib.contextmanager
+    def _transaction(self, table):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            finally:
+                self._writes[table] += 1
+
+    def _write(self, table, sql, rows=None, many=False):
+        with self._transaction(table) as conn:
+            return conn.executemany(sql, rows) if many else conn.execute(sql, rows or ())
+
+    @staticmethod
+    def _insert_sql(table, names):
+        mapping = TABLES[table]
+        return (f"INSERT INTO {table} ({', '.join(mapping[col] for col in names)}) "
+                f"VALUES ({', '.join('?' for _ in names)})")
+
+    @staticmethod
+    def _update_sql(table, names):
+        mapping = TABLES[table]
+        return f"UPDATE {table} SET {', '.join(f'{mapping[col]} = ?' for col in names)} WHERE id = ?"
+
+    def load(self, table):
+        """The whole table as a DataFrame indexed by row id."""
+        mapping = TABLES[table]
+        select = ", ".join(f'{sql} AS "{col}"' for col, sql in mapping.items())
+        with self._lock:
+            df = pd.read_sql_query(f"SELECT id, {select} FROM {table} ORDER BY id", self._conn, index_col="id")
+        df.index.name = None
+        return df
+
+    def _where(self, table, filters):
+        mapping = TABLES[table]
+        if not filters:
+            return "", []
+        return (" WHERE " + " AND ".join(f"{mapping[col]} = ?" for col in filters),
+                [_sql_value(value) for value in filters.values()])
+
+    def page(self, table, offset, limit, sort_by=None, descending=False, filters=None):
+        """One page of rows (typed, indexed by id), sorted and filtered by SQLite."""
+        mapping = TABLES[table]
+        select = ", ".join(f'{sql} AS "{col}"' for col, sql in mapping.items())
+        where, params = self._where(table, filters)
+        direction = "DESC" if descending else "ASC"
+        order = f"{mapping[sort_by]} {direction}, id {direction}" if sort_by else f"id {direction}"
+        with self._lock:
+            df = pd.read_sql_query(f"SELECT id, {select} FROM {table}{where} ORDER BY {order} LIMIT ? OFFSET ?",
+                                   self._conn, params=params + [int(limit), int(offset)], index_col="id")
+        df.index.name = None
+        return apply_schema(table, df)
+
+    def count(self, table, filters=None):
+        where, params = self._where(table, filters)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {table}{where}", params).fetchone()[0]
+
+    def total(self, table, column, filters=None):
+        """SUM of a numeric column."""
+        where, params = self._where(table, filters)
+        with self._lock:
+            return self._conn.execute(f"SELECT COALESCE(SUM({TABLES[table][column]}), 0) FROM {table}{where}",
+                                      params).fetchone()[0]
+
+    def distinct(self, table, column):
+        """Sorted distinct non-empty values of a column."""
+        sql_column = TABLES[table][column]
+        with self._lock:
+            rows = self._conn.execute(f"SELECT DISTINCT {sql_column} FROM {table} WHERE {sql_column} IS NOT NULL "
+                                      f"AND {sql_column} != '' ORDER BY {sql_column}").fetchall()
+        return [row[0] for row in rows]
+
+    def insert(self, table, row):
+        """Adds one row (a dict keyed by the app's column names); returns its id."""
+        names = [col for col in TABLES[table] if col in row]
+        return self._write(table, self._insert_sql(table, names), [_sql_value(row[col]) for col in names]).lastrowid
+
+    def update(self, table, row_id, changes):
+        """Sets some columns of one row."""
+        if not changes:
+            return
+        self._write(table, self._update_sql(table, list(changes)),
+                    [_sql_value(value) for value in changes.values()] + [int(row_id)])
+
+    def delete(self, table, row_ids):
+        """Deletes rows by id."""
+        self._write(table, f"DELETE FROM {table} WHERE id = ?", [(int(row_id),) for row_id in row_ids], many=True)
+
+    def replace(self, table, df):
+        """Replaces the whole table with `df` in one transaction (imports, bulk edits)."""
+        mapping = TABLES[table]
+        names = [col for col in mapping if col in df.columns]
+        keep_ids = pd.api.types.is_integer_dtype(df.index) and df.index.is_unique
+        sql_columns = (["id"] if keep_ids else []) + [mapping[col] for col in names]
+        rows = [
+            ([int(row_id)] if keep_ids else []) + [_sql_value(value) for value in values]
+            for row_id, values in zip(df.index, df[names].itertuples(index=False, name=None))
+        ]
+        with self._transaction(table) as conn:
+            conn.execute(f"DELETE FROM {table}")
+            conn.executemany(
+                f"INSERT INTO {table} ({', '.join(sql_columns)}) VALUES ({', '.join('?' for _ in sql_columns)})", rows)
+
+    def apply_changes(self, table, updates=None, inserts=(), deletes=()):
+        """
+        One transaction of row edits: `updates` maps row id -> {column: value},
+        `inserts` are row dicts, `deletes` row ids. Returns the new ids.
+        """
+        new_ids = []
+        with self._transaction(table) as conn:
+            for row_id, changes in (updates or {}).items():
+                if changes:
+                    conn.execute(self._update_sql(table, list(changes)),
+                                 [_sql_value(value) for value in changes.values()] + [int(row_id)])
+            for row in inserts:
+                names = [col for col in TABLES[table] if col in row]
+                new_ids.append(conn.execute(self._insert_sql(table, names),
+                                            [_sql_value(row[col]) for col in names]).lastrowid)
+            if deletes:
+                conn.executemany(f"DELETE FROM {table} WHERE id = ?", [(int(row_id),) for row_id in deletes])
+        return new_ids
+
+    def get_meta(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        self._write("meta", "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+
+class CSVStore:
+    """The original CSV files behind the same interface; row ids are row positions."""
+
+    name = "csv"
+
+    def __init__(self, files=None):
+        self.files = dict(files or CSV_FILES)
+        self._lock = threading.RLock()
+        self._writes = collections.Counter()  # table -> writes through this store
+
+    def version(self, table):
+        """
+        Changes whenever `table` may have changed. The write counter catches our
+        own writes, even two same-size rewrites within the mtime granularity;
+        mtime and size catch other processes'.
+        """
+        try:
+            stat = os.stat(self.files[table])
+        except OSError:
+            return self._writes[table], None
+        return self._writes[table], stat.st_mtime_ns, stat.st_size
+
+    def load(self, table):
+        path = self.files[table]
+        if not os.path.exists(path):
+            df = empty_frame(table)
+            df.to_csv(path, index=False)
+            return df
+        # Text columns stay text (phone numbers must not become floats)
+        text = [col for col, kind in SCHEMAS[table].items() if kind != "int" and kind != "date"]
+        return pd.read_csv(path, dtype={col: str for col in text})
+
+    def _save(self, table, df):
+        try:
+            df.to_csv(self.files[table], index=False)
+        finally:
+            self._writes[table] += 1
+
+    def insert(self, table, row):
+        with self._lock:
+            df = self.load(table)
+            new_row = pd.DataFrame([{col: row.get(col) for col in columns(table)}])
+            # Append one line instead of rewriting the file
+            try:
+                new_row.to_csv(self.files[table], mode="a", header=False, index=False)
+            finally:
+                self._writes[table] += 1
+            return len(df)
+
+    def update(self, table, row_id, changes):
+        with self._lock:
+            df = self.load(table)
+            for col, value in changes.items():
+                df.loc[row_id, col] = _sql_value(value)
+            self._save(table, df)
+
+    def delete(self, table, row_ids):
+        with self._lock:
+            df = self.load(table)
+            self._save(table, df.drop(index=list(row_ids), errors="ignore").reset_index(drop=True))
+
+    def replace(self, table, df):
+        with self._lock:
+            self._save(table, df)
+
+    # Queries run in memory over the cached typed frame: CSV can't do better
+    def _filtered(self, table, filters):
+        df = load_frame(table, self)
+        for col, value in (filters or {}).items():
+            df = df[df[col] == value]
+        return df
+
+    def page(self, table, offset, limit, sort_by=None, descending=False, filters=None):
+        df = self._filtered(table, filters)
+        if sort_by:
+            df = df.sort_values(sort_by, ascending=not descending, kind="stable")
+        elif descending:
+            df = df.iloc[::-1]
+        return df.iloc[offset:offset + limit]
+
+    def count(self, table, filters=None):
+        return len(self._filtered(table, filters))
+
+    def total(self, table, column, filters=None):
+        return int(self._filtered(table, filters)[column].sum())
+
+    def distinct(self, table, column):
+        values = load_frame(table, self)[column].dropna()
+        return sorted(value for value in values.unique().tolist() if value != "")
+
+    def apply_changes(self, table, updates=None, inserts=(), deletes=()):
+        """Same contract as SQLiteStore.apply_changes, with one rewrite of the file."""
+        with self._lock:
+            df = self.load(table)
+            for row_id, changes in (updates or {}).items():
+                for col, value in changes.items():
+                    df.loc[row_id, col] = _sql_value(value)
+            df = df.drop(index=list(deletes), errors="ignore")
+            if inserts:
+                added = pd.DataFrame([{col: row.get(col) for col in columns(table)} for row in inserts])
+                df = pd.concat([df, added], ignore_index=True)
+            self._save(table, df.reset_index(drop=True))
+            return list(range(len(df) - len(inserts), len(df)))
+
+
+def coerce(table, col, value):
+    """A value typed in the data editor, converted to the column's schema type."""
+    kind = SCHEMAS[table][col]
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return 0 if kind == "int" else None
+    if kind == "int":
+        try:
+            return int(float(value))
+        except (TypeError, ValueError):
+            return 0
+    if kind == "date":
+        date = pd.to_datetime(value, errors="coerce")
+        return None if date is pd.NaT else date
+    return str(value)
+
+
+def _is_blank(row):
+    return not any(value not in (None, "") for value in row.values())
+
+
+def editor_changes(table, frame, state):
+    """
+    Translates st.data_editor's change set (its session_state value) into
+    apply_changes arguments. Row positions refer to `frame`, the frame the
+    editor was given; its index holds the row ids. Positions past the end of
+    `frame` are blank rows carried over from an earlier editor: filling one
+    in inserts it.
+    """
+    known = SCHEMAS[table]
+    deleted = {int(position) for position in state.get("deleted_rows", [])}
+    updates = {}
+    added = []
+    for position, changes in state.get("edited_rows", {}).items():
+        position = int(position)
+        if position >= len(frame):
+            if position not in deleted:
+                added.append(changes)
+            continue
+        row_id = frame.index[position]
+        updates[row_id] = {col: coerce(table, col, value) for col, value in changes.items() if col in known}
+    added.extend(state.get("added_rows", []))
+    inserts = [
+        {col: coerce(table, col, row.get(col)) for col in known}
+        for row in added
+        if not _is_blank(row)  # Skip rows left blank
+    ]
+    deletes = [frame.index[position] for position in sorted(deleted) if position < len(frame)]
+    return updates, inserts, deletes
+
+
+def blank_rows(frame, state, carried=0):
+    """
+    How many rows of an editor's change set are still blank: the `carried`
+    ones shown after `frame` that weren't filled in or deleted, plus the
+    added ones.
+    """
+    deleted = {int(position) for position in state.get("deleted_rows", [])}
+    edited = {int(position): changes for position, changes in state.get("edited_rows", {}).items()}
+    kept = sum(
+        1 for position in range(len(frame), len(frame) + carried)
+        if position not in deleted and _is_blank(edited.get(position, {}))
+    )
+    return kept + sum(1 for row in state.get("added_rows", []) if _is_blank(row))
+
+
+def migrate_csv(store, files=None, force=False):
+    """
+    Imports the CSV files into `store` once (recorded in the meta table, so
+    emptying the CRM later doesn't bring the old rows back). Returns the
+    number of rows imported per table.
+    """
+    if not force and store.get_meta("csv_migrated"):
+        return {}
+    imported = {}
+    for table, path in (files or CSV_FILES).items():
+        if not os.path.exists(path):
+            continue
+        df = pd.read_csv(path, dtype=str)
+        df = df[[col for col in columns(table) if col in df.columns]]
+        df.index = pd.RangeIndex(1, len(df) + 1)
+        store.replace(table, df)
+        imported[table] = len(df)
+    store.set_meta("csv_migrated", datetime.datetime.now().isoformat(timespec="seconds"))
+    return imported
+
+
+def export_csv(store, table, path):
+    """Writes one table to CSV with the app's column names (no ids)."""
+    store.load(table).to_csv(path, index=False)
+
+
+_frames_lock = threading.Lock()
+# (store id, table) -> (version, typed DataFrame)
+_frames = {}
+
+
+def load_frame(table, store=None):
+    """
+    The typed table, parsed once per version and shared by every rerun and
+    session. Callers get a shallow copy: with pandas' copy-on-write (always on
+    from pandas 3, hence the pin in requirements.txt), changing it never
+    touches the cached frame. `frame.attrs["version"]` identifies
+    the data, for caches built on top of it (contact_search).
+    """
+    store = store or get_store()
+    key = (id(store), table)
+    version = store.version(table)
+    cached = _frames.get(key)
+    if cached is None or cached[0] != version:
+        with _frames_lock:
+            cached = _frames.get(key)
+            if cached is None or cached[0] != version:
+                frame = apply_schema(table, store.load(table))
+                frame.attrs["version"] = key + (version,)
+                cached = (version, frame)
+                _frames[key] = cached
+    return cached[1].copy(deep=False)
+
+
+# Small results (pages, counts, sums) keyed by table version, like load_frame
+QUERY_CACHE_SIZE = 128
+_queries = collections.OrderedDict()
+_queries_lock = threading.Lock()
+
+
+def query(table, method, *args, store=None, **kwargs):
+    """
+    Runs a read-only store method ("page", "count", "total", "distinct") and
+    caches its result until the table changes. Filters are dicts, so they are
+    keyed by their sorted items.
+    """
+    store = store or get_store()
+    version = store.version(table)
+    key = (id(store), table, version, method, args,
+           tuple(sorted((name, tuple(sorted(value.items())) if isinstance(value, dict) else value)
+                        for name, value in kwargs.items())))
+    with _queries_lock:
+        if key in _queries:
+            _queries.move_to_end(key)
+            result = _queries[key]
+            return result.copy(deep=False) if isinstance(result, pd.DataFrame) else result
+    result = getattr(store, method)(table, *args, **kwargs)
+    with _queries_lock:
+        _queries[key] = result
+        while len(_queries) > QUERY_CACHE_SIZE:
+            _queries.popitem(last=False)
+    return result.copy(deep=False) if isinstance(result, pd.DataFrame) else result
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """
+    Returns the process-wide store: SQLite (CRM_DB_FILE, default crm.db) unless
+    CRM_STORAGE=csv. A new SQLite database imports the existing CSVs first.
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if os.getenv("CRM_STORAGE", "sqlite").lower() == "csv":
+                    store = CSVStore()
+                else:
+                    store = SQLiteStore(os.getenv("CRM_DB_FILE") or DB_FILE)
+                    migrate_csv(store)
+                _store = store
+    return _store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Almacenamiento del CRM (SQLite / CSV).")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="exporta contactos y negocios a CSV")
+    export.add_argument("--out", default=".", help="carpeta de destino")
+    commands.add_parser("migrate", help="vuelve a importar contacts.csv y deals.csv (reemplaza las tablas)")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        store = get_store()
+        os.makedirs(args.out, exist_ok=True)
+        for table, path in CSV_FILES.items():
+            target = os.path.join(args.out, os.path.basename(path))
+            export_csv(store, table, target)
+            print(f"{table} -> {target}")
+    else:
+        store = SQLiteStore(os.getenv("CRM_DB_FILE") or DB_FILE)
+        for table, count in migrate_csv(store, force=True).items():
+            print(f"{table}: {count} filas importadas")
+
+
+if __name__ == "__main__":
+    main()
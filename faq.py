@@ -0,0 +1,279 @@
+"""
+Instant answers for the questions customers ask all the time.
+
+- LocalAnswerer answers price, allergen/diet, pairing, location and "what do
+  you sell" questions straight from the catalog, in La Vaquita's voice, with
+  no API call. It only answers when it's sure of the intent and the product;
+  anything else goes to the model. When OpenRouter is busy or down,
+  fallback() replies with a cached near-duplicate answer or catalog facts.
+- ResponseCache keeps remote answers to first-turn questions, keyed by the
+  normalized question and the catalog version, with a TTL and LRU eviction.
+"""
+import collections
+import threading
+import time
+
+from catalog import declared_free, has_allergen
+from knowledge import Chunk, KnowledgeIndex, normalize
+
+# Cached answers expire after this many seconds; at most this many are kept
+CACHE_TTL = 6 * 3600
+CACHE_MAX_ENTRIES = 512
+
+SHOP_ADDRESS = "Carrera 50 # 25-10, Sevilla, Valle del Cauca, frente al parque principal"
+SHOP_PHONE = "310 123 4567"
+
+# Intent cue words, already normalized (no accents, lowercase)
+PRICE_WORDS = {"cuanto", "vale", "valen", "cuesta", "cuestan", "precio", "precios", "cobran", "plata"}
+PAIRING_WORDS = {"acompanar", "acompano", "acompana", "combinar", "combina", "maridaje", "marida", "pega"}
+LOCATION_WORDS = {"donde", "direccion", "ubicados", "ubicacion", "quedan", "queda", "llegar"}
+CONTACT_WORDS = {"telefono", "numero", "whatsapp", "llamar", "celular", "domicilio", "domicilios"}
+# Location and contact cues only count when the question is about the shop:
+# "¿Dónde queda el Mirador El Morro?" is for the model
+SHOP_WORDS = {"ustedes", "local", "tienda", "negocio"}
+SHOP_NAME = "kumis del balcon"
+# ...or when it is one of these short questions, whole (normalized)
+SHOP_QUESTIONS = {
+    "donde quedan", "donde estan", "donde estan ubicados", "donde los encuentro", "como llego", "como llegar",
+    "direccion", "cual es la direccion", "ubicacion", "telefono", "cual es el telefono", "numero de telefono",
+    "whatsapp", "cual es el whatsapp", "hacen domicilios", "tienen domicilios",
+}
+MENU_WORDS = {"menu", "carta", "venden", "ofrecen", "productos"}
+# normalized word -> catalog "contains" value
+ALLERGEN_WORDS = {
+    "gluten": "gluten", "celiaco": "gluten", "celiacos": "gluten", "trigo": "gluten",
+    "lactosa": "lactosa", "lacteos": "lácteos", "lacteo": "lácteos", "leche": "lácteos",
+    "huevo": "huevo", "huevos": "huevo", "azucar": "azúcar", "diabetico": "azúcar",
+}
+WITHOUT_WORDS = {"sin", "libre", "libres", "apto", "aptos", "intolerante", "alergico", "alergica"}
+
+# Minimum index score for a product match to count as "the customer named it"
+PRODUCT_MIN_SCORE = 1.0
+
+# Fallback replies may reuse a cached answer to a question sharing this much of
+# its words (stopwords included), if both agree on the words that flip meaning
+SIMILAR_MIN_OVERLAP = 0.75
+POLARITY_WORDS = {"sin", "con", "no", "libre", "libres"}
+
+
+class ResponseCache:
+    """Thread-safe TTL + LRU cache of answers keyed by normalized question."""
+
+    def __init__(self, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()  # key -> (expires_at, answer)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(question, catalog_version):
+        """
+        Same key for '¿Cuánto vale el pandebono?' and 'cuanto vale el pandebono'.
+        Stopwords are kept: 'sin azúcar' and 'con azúcar' are different
+        questions. None when there is nothing to key on (never cached).
+        """
+        text = normalize(question or "")
+        return (catalog_version, text) if text else None
+
+    def get(self, key):
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, answer):
+        if key is None:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, answer)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def similar(self, question, catalog_version):
+        """
+        The cached answer to the closest near-duplicate of `question` ('cuanto
+        vale el pandebono' for 'y cuanto vale el pandebono'), or None.
+        Scans every entry: only used when no model can answer.
+        """
+        words = set(normalize(question or "").split())
+        if not words:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entries = [(key[1], entry[1]) for key, entry in self._entries.items()
+                       if key[0] == catalog_version and entry[0] >= now]
+        best, best_overlap = None, SIMILAR_MIN_OVERLAP
+        for text, answer in entries:
+            other = set(text.split())
+            if other & POLARITY_WORDS != words & POLARITY_WORDS:
+                continue
+            overlap = len(words & other) / len(words | other)
+            if overlap >= best_overlap:
+                best, best_overlap = answer, overlap
+        return best
+
+    def caching(self, key, stream):
+        """Yields `stream`'s chunks and caches the full text if it finishes cleanly."""
+        chunks = []
+        for chunk in stream:
+            chunks.append(chunk)
+            yield chunk
+        text = "".join(chunks).strip()
+        if text and key is not None:
+            self.put(key, text)
+
+
+def _names(items):
+    names = [item["name"] for item in items]
+    if len(names) <= 1:
+        return "".join(names)
+    return ", ".join(names[:-1]) + " y " + names[-1]
+
+
+class LocalAnswerer:
+    """Deterministic answers built from one catalog version."""
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self._products = KnowledgeIndex(
+            Chunk(sku, "product", item["name"], item["name"], keywords=(sku.replace("-", " "), sku.replace("-", "")))
+            for sku, item in catalog.items_by_sku.items()
+        )
+
+    def _named_products(self, question):
+        """Products the question names, best first (typos and accents are fine)."""
+        results = self._products.search(question)
+        if not results:
+            return []
+        top = results[0][0]
+        if top < PRODUCT_MIN_SCORE:
+            return []
+        # Keep the ones tied with the best match: "kumis" names both sizes
+        return [self.catalog.item(chunk.id) for score, chunk in results if score >= top * 0.99]
+
+    def answer(self, question):
+        """Returns an answer, or None when the model should handle the question."""
+        if not question:
+            return None
+        normalized = normalize(question)
+        about_shop = normalized in SHOP_QUESTIONS or SHOP_NAME in normalized
+        if about_shop:
+            # "Kumis del Balcón" is the shop, not the kumis
+            normalized = normalized.replace(SHOP_NAME, " ").strip()
+        words = set(normalized.split())
+        about_shop = about_shop or bool(words & SHOP_WORDS)
+        products = self._named_products(normalized) if normalized else []
+        # "arroz con leche" names a product, it doesn't ask about milk
+        named_words = {word for item in products for word in normalize(item["name"]).split()}
+        allergens = {ALLERGEN_WORDS[word] for word in words - named_words if word in ALLERGEN_WORDS}
+
+        if about_shop and words & LOCATION_WORDS and not products:
+            return (f"¡Aquí lo esperamos, vecino! 🐮 Estamos en la {SHOP_ADDRESS}. "
+                    f"Para domicilios y reservas: 📞 {SHOP_PHONE}.")
+        if about_shop and words & CONTACT_WORDS and not products:
+            return (f"¡De una! Nos encuentra al 📞 {SHOP_PHONE} (llamadas y WhatsApp). "
+                    "También puede armar su pedido en el carrito 🛒 y enviarlo por WhatsApp.")
+        if allergens and words & WITHOUT_WORDS and not products:
+            return self._without(allergens)
+        if allergens and products:
+            return self._contains(products, allergens)
+        if products and words & PAIRING_WORDS:
+            return self._pairing(products[0])
+        if products and words & PRICE_WORDS:
+            return self._prices(products)
+        if words & MENU_WORDS and not products:
+            return "¡Con mucho gusto, corazón! 🐮 Este es nuestro menú:\n" + self.catalog.prompt_menu
+        return None
+
+    def fallback(self, question, cache=None):
+        """
+        Best-effort reply for when no model can answer (saturated, busy or
+        every model failed): a cached answer to a near-identical question,
+        else what the catalog says about the products named, else the menu.
+        Always says to try again, so it never hides that the model is down.
+        """
+        cached = cache.similar(question, self.catalog.version) if cache is not None else None
+        if cached:
+            return cached
+        products = self._named_products(question or "")
+        if products:
+            lines = [f"- **{item['name']}** (${item['price']:,}): {item.get('details') or item['desc']}"
+                     for item in products]
+            body = "Mientras tanto, le cuento lo que sé 🐮:\n" + "\n".join(lines)
+        else:
+            body = "Mientras tanto, aquí tiene nuestro menú 🐮:\n" + self.catalog.prompt_menu
+        return (f"Muuu... ahorita no alcanzo a responderle con calma, vecino. {body}\n"
+                f"Vuelva a preguntarme en unos segunditos o llámenos al 📞 {SHOP_PHONE}.")
+
+    def _pairs(self, item):
+        items = self.catalog.items_by_sku
+        return [items[sku] for sku in item.get("pairs_with", ()) if sku in items]
+
+    def _prices(self, products):
+        lines = [f"- **{item['name']}**: ${item['price']:,}" for item in products]
+        pairs = self._pairs(products[0])
+        hint = f"\n\nY queda delicioso con {_names(pairs)}. ¡Qué rico! 🥛" if pairs else ""
+        return "¡Claro que sí, vecino! 🐮\n" + "\n".join(lines) + hint
+
+    def _pairing(self, item):
+        pairs = self._pairs(item)
+        if not pairs:
+            return f"El {item['name']} va bien con cualquier cosa del menú, mijo. ¡Pruébelo con lo que más le antoje! ☕"
+        return f"¡Uy, buena pregunta! El {item['name']} queda delicioso con {_names(pairs)}. ¡De una! 🥛"
+
+    def _contains(self, products, allergens):
+        lines = []
+        for item in products:
+            for allergen in sorted(allergens):
+                if has_allergen(item, allergen):
+                    lines.append(f"- **{item['name']}**: sí contiene {allergen}.")
+                elif declared_free(item, allergen):
+                    lines.append(f"- **{item['name']}**: no contiene {allergen}.")
+                else:
+                    return None  # Not declared either way: let the model or the phone handle it
+        return ("Le cuento con cariño, vecino 🐮:\n" + "\n".join(lines)
+                + f"\n\nSi tiene una alergia fuerte, llámenos al 📞 {SHOP_PHONE} y le confirmamos.")
+
+    def _without(self, allergens):
+        items = self.catalog.items_by_sku.values()
+        label = ", ".join(sorted(allergens))
+        if all(any(has_allergen(item, allergen) for allergen in allergens) for item in items):
+            return f"Ay, corazón, por ahora todo nuestro menú lleva {label}. Llámenos al 📞 {SHOP_PHONE} y le ayudamos. 🐮"
+        free = [item for item in items if all(declared_free(item, allergen) for allergen in allergens)]
+        if not free:
+            return None  # Nothing is declared free of it: the model (or the phone) can say more
+        lines = [f"- **{item['name']}**: ${item['price']:,}" for item in free]
+        return f"¡Claro! Sin {label} tenemos 🐮:\n" + "\n".join(lines)
+
+
+_lock = threading.Lock()
+_answerer = None
+_cache = ResponseCache()
+
+
+def get_answerer(catalog):
+    """Returns the LocalAnswerer for this catalog version (rebuilt when the menu changes)."""
+    global _answerer
+    answerer = _answerer
+    if answerer is not None and answerer.catalog.version == catalog.version:
+        return answerer
+    with _lock:
+        if _answerer is None or _answerer.catalog.version != catalog.version:
+            _answerer = LocalAnswerer(catalog)
+        return _answerer
+
+
+def get_response_cache():
+    """Returns the process-wide ResponseCache."""
+    return _cache
@@ -0,0 +1,169 @@
+"""
+Small offline lexical index for the assistant's knowledge base.
+
+Text is normalized (lowercase, no accents, ñ -> n) and split into tokens, so
+"Buñuelo", "bunuelo" and "BUÑUELO" are the same term. Query words that
+aren't in the vocabulary are matched to close spellings ("cumis" -> "kumis",
+"buñelo" -> "bunuelo"), and adjacent words are also tried joined
+("pan de bono" -> "pandebono"). Chunks are ranked with a simple idf-weighted
+score and picked greedily under a token budget.
+"""
+import difflib
+import math
+import re
+import unicodedata
+from functools import lru_cache
+
+# Rough offline token estimate for Spanish text (no tokenizer dependency)
+CHARS_PER_TOKEN = 3.5
+
+# Words too common to say anything about which chunk is relevant
+STOPWORDS = frozenset("""
+a al algo como con cual cuales cuando de del el ella en es esa ese eso esta este
+esto hay la las le lo los me mi mas muy no o para pero por que se si sin son su
+sus tiene tienen tienes tu un una uno unos usted y ya yo quiero dime puedo porfa
+favor hola buenas buenos dias tardes noches gracias cuanto vale cuesta valen cuestan
+""".split())
+
+# Query words must be at least this similar to a vocabulary word to count as a typo
+FUZZY_CUTOFF = 0.75
+# Title and keyword matches weigh more than body matches
+TITLE_WEIGHT = 2.0
+# Chunks scoring below this share of the best one are left out, unless they are
+# the best match for one of the query's terms
+MIN_SHARE = 0.6
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def normalize(text):
+    """Lowercase, strip accents and punctuation: 'Buñuelo ¿Cuánto?' -> 'bunuelo cuanto'."""
+    text = text.lower()
+    if not text.isascii():  # Plain ASCII has no accents to strip
+        text = unicodedata.normalize("NFKD", text)
+        text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(_TOKEN_RE.findall(text))
+
+
+def tokenize(text):
+    return [tok for tok in normalize(text).split() if tok not in STOPWORDS]
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+class Chunk:
+    """One retrievable piece of knowledge."""
+
+    def __init__(self, chunk_id, kind, title, text, keywords=()):
+        self.id = chunk_id
+        self.kind = kind
+        self.title = title
+        self.text = text
+        self.keywords = tuple(keywords)
+        self.tokens = estimate_tokens(text)
+
+
+class KnowledgeIndex:
+    """Inverted index over chunks with accent- and typo-tolerant lookups."""
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        # term -> {chunk index: weight}
+        self._postings = {}
+        for index, chunk in enumerate(self.chunks):
+            weights = {}
+            for tok in tokenize(chunk.text):
+                weights[tok] = max(weights.get(tok, 0.0), 1.0)
+            for tok in tokenize(" ".join((chunk.title,) + chunk.keywords)):
+                weights[tok] = TITLE_WEIGHT
+            for tok, weight in weights.items():
+                self._postings.setdefault(tok, {})[index] = weight
+        self._vocabulary = sorted(self._postings)
+        total = len(self.chunks) or 1
+        self._idf = {
+            tok: math.log(1 + total / len(postings))
+            for tok, postings in self._postings.items()
+        }
+        # Per-index memo of fuzzy lookups (the vocabulary is fixed per index)
+        self._expand = lru_cache(maxsize=4096)(self._expand_uncached)
+
+    def _expand_uncached(self, token):
+        """Vocabulary terms a query token stands for, with a similarity weight."""
+        if token in self._postings:
+            return ((token, 1.0),)
+        if len(token) < 4:
+            return ()
+        matches = difflib.get_close_matches(token, self._vocabulary, n=1, cutoff=FUZZY_CUTOFF)
+        return tuple((match, difflib.SequenceMatcher(None, token, match).ratio()) for match in matches)
+
+    def _query_terms(self, query):
+        tokens = normalize(query).split()
+        # "pan de bono" -> "pandebono": adjacent words that form a known term
+        # replace the words they're made of
+        joined_terms = []
+        used = set()
+        for size in (3, 2):
+            for start in range(len(tokens) - size + 1):
+                span = range(start, start + size)
+                joined = "".join(tokens[start:start + size])
+                if joined in self._postings and not used.intersection(span):
+                    joined_terms.append(joined)
+                    used.update(span)
+        candidates = joined_terms + [
+            tok for position, tok in enumerate(tokens)
+            if position not in used and tok not in STOPWORDS
+        ]
+        terms = {}
+        for tok in candidates:
+            for term, similarity in self._expand(tok):
+                terms[term] = max(terms.get(term, 0.0), similarity)
+        return terms
+
+    def _score(self, query):
+        """Returns ({chunk index: score}, {term: best chunk index for that term})."""
+        scores = {}
+        best_for_term = {}
+        for term, similarity in self._query_terms(query).items():
+            idf = self._idf[term]
+            best = None
+            for index, weight in self._postings[term].items():
+                gain = similarity * idf * weight
+                scores[index] = scores.get(index, 0.0) + gain
+                if best is None or gain > best[0]:
+                    best = (gain, index)
+            best_for_term[term] = best[1]
+        return scores, best_for_term
+
+    def search(self, query, limit=None):
+        """Returns [(score, chunk)] best first; chunks with no matching term are left out."""
+        scores, _ = self._score(query)
+        ranked = sorted(scores.items(), key=lambda pair: (-pair[1], pair[0]))
+        if limit is not None:
+            ranked = ranked[:limit]
+        return [(score, self.chunks[index]) for index, score in ranked]
+
+    def select(self, query, token_budget, min_share=MIN_SHARE):
+        """
+        Relevant chunks for `query` whose combined size fits `token_budget`:
+        the best match for each query term first, then anything scoring at
+        least `min_share` of the top chunk.
+        """
+        scores, best_for_term = self._score(query)
+        if not scores:
+            return []
+        top = max(scores.values())
+        must = set(best_for_term.values())
+        ranked = sorted(scores.items(), key=lambda pair: (pair[0] not in must, -pair[1], pair[0]))
+        selected = []
+        used = 0
+        for index, score in ranked:
+            if index not in must and score < top * min_share:
+                break
+            chunk = self.chunks[index]
+            if used + chunk.tokens > token_budget:
+                continue
+            selected.append(chunk)
+            used += chunk.tokens
+        return selected
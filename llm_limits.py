@@ -0,0 +1,160 @@
+"""
+Client-side admission control for LLM traffic.
+
+All storefront sessions share one OpenRouter free-tier quota. Without a
+limit, a busy hour becomes a storm of requests that mostly come back 429
+and then cascade through every fallback model. This module puts, in front of
+utils.call_openrouter:
+- a process-wide token bucket (calls per minute) and one bucket per model;
+- a bounded FIFO queue of concurrent calls, with at most
+  MAX_CALLS_PER_SESSION per browser session so one chatty tab can't starve
+  the rest;
+- a fast "busy" answer (LLMBusy) instead of burning timeouts when full.
+"""
+import collections
+import threading
+import time
+
+# Free-tier OpenRouter allows roughly 20 requests/minute per model
+GLOBAL_RATE_PER_MINUTE = 60
+MODEL_RATE_PER_MINUTE = 20
+# Concurrent calls (each may stream for a while) and how many may wait for a slot
+MAX_CONCURRENT_CALLS = 8
+MAX_QUEUED_CALLS = 16
+QUEUE_TIMEOUT = 10.0
+MAX_CALLS_PER_SESSION = 1
+
+
+class LLMBusy(Exception):
+    """The call was refused locally: too much traffic right now."""
+
+
+class TokenBucket:
+    """Classic token bucket; `rate` tokens per second, up to `burst` saved."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self):
+        """Takes a token if one is available; returns the seconds to wait otherwise (0 = taken)."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+
+class AdmissionController:
+    """Bounded FIFO of LLM calls with a per-session cap and a global rate."""
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT_CALLS, max_queued=MAX_QUEUED_CALLS,
+                 per_session=MAX_CALLS_PER_SESSION, rate_per_minute=GLOBAL_RATE_PER_MINUTE,
+                 model_rate_per_minute=MODEL_RATE_PER_MINUTE):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.per_session = per_session
+        self.model_rate = model_rate_per_minute / 60.0
+        self._global_bucket = TokenBucket(rate_per_minute / 60.0, max(1, rate_per_minute // 6))
+        self._model_buckets = {}
+        self._lock = threading.Lock()
+        self._waiters = collections.deque()
+        self._active = 0
+        self._per_session = collections.Counter()
+
+    def is_saturated(self):
+        """True when a new call would be refused or have to wait."""
+        with self._lock:
+            return self._active >= self.max_concurrent or len(self._waiters) >= self.max_queued
+
+    def acquire(self, session_id=None, timeout=QUEUE_TIMEOUT):
+        """
+        Waits (FIFO) for a call slot and a global rate token.
+        Raises LLMBusy right away if the queue is full or the session already
+        has its share of calls, or after `timeout` seconds of waiting.
+        """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            if session_id is not None and self._per_session[session_id] >= self.per_session:
+                raise LLMBusy("session")
+            if self._active < self.max_concurrent and not self._waiters:
+                self._take(session_id)
+            elif len(self._waiters) >= self.max_queued:
+                raise LLMBusy("queue")
+            else:
+                turn = threading.Event()
+                self._waiters.append(turn)
+                self._per_session[session_id] += 1  # Counts while queued too
+                try:
+                    self._lock.release()
+                    try:
+                        got_turn = turn.wait(max(0.0, deadline - time.monotonic()))
+                    finally:
+                        self._lock.acquire()
+                finally:
+                    self._per_session[session_id] -= 1
+                    if self._per_session[session_id] <= 0:
+                        del self._per_session[session_id]  # Else every timed-out session leaves a key behind
+                if not got_turn:
+                    if turn in self._waiters:
+                        self._waiters.remove(turn)
+                        raise LLMBusy("timeout")
+                    # Handed a slot just as we timed out: keep it
+                self._take(session_id, handed_over=True)
+
+        # Global rate: wait for a token, but never past the deadline
+        while True:
+            wait = self._global_bucket.try_acquire()
+            if not wait:
+                return
+            if time.monotonic() + wait > deadline:
+                self.release(session_id)
+                raise LLMBusy("rate")
+            time.sleep(wait)
+
+    def _take(self, session_id, handed_over=False):
+        if not handed_over:
+            self._active += 1
+        self._per_session[session_id] += 1
+
+    def release(self, session_id=None):
+        """Frees a slot, handing it straight to the oldest waiter if any."""
+        with self._lock:
+            self._per_session[session_id] -= 1
+            if self._per_session[session_id] <= 0:
+                del self._per_session[session_id]
+            if self._waiters:
+                self._waiters.popleft().set()  # Slot stays counted in _active
+            else:
+                self._active -= 1
+
+    def allow_model(self, model):
+        """Per-model rate check for one attempt; False means skip this model for now."""
+        with self._lock:
+            bucket = self._model_buckets.get(model)
+            if bucket is None:
+                bucket = self._model_buckets[model] = TokenBucket(self.model_rate, max(1, int(self.model_rate * 60) // 4))
+        return bucket.try_acquire() == 0.0
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission():
+    """Returns the process-wide AdmissionController."""
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = AdmissionController()
+    return _controller
@@ -0,0 +1,200 @@
+"""
+Process-wide health scoreboard for the OpenRouter models.
+
+Every attempt made by utils.call_openrouter is recorded here: success with its
+time-to-first-token, or failure with its error class (rate_limit, payment,
+timeout, ...). Models that keep failing get an open circuit and are skipped
+for a cooldown, and the candidate list is reordered by recent success rate
+and latency, so each call stops rediscovering the same 429s.
+
+Set MODEL_HEALTH_FILE (env var) to persist the scoreboard across restarts.
+"""
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+
+# Weight of the newest observation in the moving averages
+EWMA_ALPHA = 0.3
+
+# Priors for models we have no data on yet: optimistic enough that they get tried
+PRIOR_SUCCESS = 0.75
+PRIOR_TTFT = 5.0
+# Seconds of time-to-first-token that cost as much score as a 100% failure rate
+TTFT_PENALTY_SCALE = 30.0
+
+# Circuit breaker cooldowns (seconds)
+COOLDOWNS = {
+    "rate_limit": 60,       # 429: free-tier quota, usually back within a minute
+    "payment": 3600,        # 402: needs credits, won't fix itself soon
+}
+# Other error classes open the circuit after this many failures in a row
+FAILURE_THRESHOLD = 3
+BASE_COOLDOWN = 30
+MAX_COOLDOWN = 600
+
+# Persist at most this often (seconds)
+SAVE_INTERVAL = 30
+
+
+class ModelHealth:
+    """Rolling stats for one model."""
+
+    def __init__(self):
+        self.success_rate = PRIOR_SUCCESS
+        self.ttft = PRIOR_TTFT
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.last_error = ""
+        self.errors = {}     # error class -> count
+        self.calls = 0
+
+    def score(self):
+        return self.success_rate - self.ttft / TTFT_PENALTY_SCALE
+
+    def to_dict(self):
+        data = dict(self.__dict__)
+        data["errors"] = dict(self.errors)
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        health = cls()
+        for name, value in data.items():
+            if hasattr(health, name):
+                setattr(health, name, value)
+        return health
+
+
+class HealthRegistry:
+    """Thread-safe scoreboard shared by every session in the process."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._models = {}
+        self._last_save = 0.0
+        if path:
+            self._load()
+
+    def _get(self, model):
+        health = self._models.get(model)
+        if health is None:
+            health = self._models[model] = ModelHealth()
+        return health
+
+    def record_success(self, model, ttft):
+        with self._lock:
+            health = self._get(model)
+            health.calls += 1
+            health.success_rate += EWMA_ALPHA * (1.0 - health.success_rate)
+            health.ttft += EWMA_ALPHA * (ttft - health.ttft)
+            health.consecutive_failures = 0
+            health.open_until = 0.0
+        self._maybe_save()
+
+    def record_failure(self, model, kind, message=""):
+        with self._lock:
+            health = self._get(model)
+            health.calls += 1
+            health.success_rate += EWMA_ALPHA * (0.0 - health.success_rate)
+            health.consecutive_failures += 1
+            health.last_error = message or kind
+            health.errors[kind] = health.errors.get(kind, 0) + 1
+
+            cooldown = COOLDOWNS.get(kind)
+            if cooldown is None and health.consecutive_failures >= FAILURE_THRESHOLD:
+                # Doubles for every further failure after the circuit reopens
+                extra = health.consecutive_failures - FAILURE_THRESHOLD
+                cooldown = min(BASE_COOLDOWN * 2 ** extra, MAX_COOLDOWN)
+            if cooldown:
+                health.open_until = time.time() + cooldown
+        self._maybe_save()
+
+    def is_open(self, model, now=None):
+        """True while the model's circuit is open (it should be skipped)."""
+        health = self._models.get(model)
+        return health is not None and health.open_until > (now or time.time())
+
+    def order(self, models):
+        """
+        Returns the candidates worth trying, best first: models with an open
+        circuit are skipped, the rest are ranked by score with the configured
+        order as tie-breaker. If every circuit is open, returns only the model
+        that reopens soonest, as a probe.
+        """
+        now = time.time()
+        available = []
+        tripped = []
+        with self._lock:
+            for index, model in enumerate(models):
+                health = self._models.get(model) or ModelHealth()
+                if health.open_until > now:
+                    tripped.append((health.open_until, index, model))
+                else:
+                    available.append((-health.score(), index, model))
+        if not available:
+            return [min(tripped)[2]] if tripped else []
+        available.sort()
+        return [model for *_, model in available]
+
+    def snapshot(self):
+        """Copy of the stats, for display or debugging."""
+        with self._lock:
+            return {model: health.to_dict() for model, health in self._models.items()}
+
+    def _maybe_save(self, force=False):
+        if not self.path:
+            return
+        with self._lock:
+            now = time.time()
+            if not force and now - self._last_save < SAVE_INTERVAL:
+                return
+            self._last_save = now
+            data = {model: health.to_dict() for model, health in self._models.items()}
+            # Unique temp file: concurrent saves (or other processes) never share one
+            tmp_path = None
+            try:
+                with tempfile.NamedTemporaryFile("w", encoding="utf-8", delete=False, suffix=".tmp",
+                                                 dir=os.path.dirname(os.path.abspath(self.path)),
+                                                 prefix=os.path.basename(self.path) + ".") as f:
+                    tmp_path = f.name
+                    json.dump(data, f)
+                os.replace(tmp_path, self.path)
+            except OSError:
+                if tmp_path:
+                    try:
+                        os.remove(tmp_path)
+                    except OSError:
+                        pass
+
+    def save(self):
+        self._maybe_save(force=True)
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        for model, stats in data.items():
+            self._models[model] = ModelHealth.from_dict(stats)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """Returns the process-wide registry (persisted if MODEL_HEALTH_FILE is set)."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = HealthRegistry(os.getenv("MODEL_HEALTH_FILE") or None)
+                if _registry.path:
+                    # Saves are throttled: keep the last cooldowns on shutdown
+                    atexit.register(_registry.save)
+    return _registry
@@ -0,0 +1,377 @@
+"""
+asyncio-native OpenRouter client.
+
+Same behaviour as utils.call_openrouter (fallbacks, health registry,
+admission control, hedging, local answers), but built on httpx.AsyncClient:
+- acall_openrouter() returns an AsyncOpenRouterStream (an async iterator of
+  content deltas) or an error string;
+- a stream is a coroutine on the event loop, not a thread, and cancelling the
+  task (or aclose()) closes its HTTP response right away;
+- `deadline` bounds the whole call, first token and streaming included;
+- hedged fan-out races models as tasks and cancels the losers.
+
+Streamlit scripts are synchronous: call_openrouter_on_loop() runs the call on
+one shared background event loop and hands back a plain iterator, so the
+result works with st.write_stream and chat_worker.BackgroundReply. Every
+concurrent stream shares that one loop thread.
+"""
+import asyncio
+import json
+import threading
+import time
+
+import httpx
+
+from llm_limits import LLMBusy, get_admission
+from model_health import get_registry
+from sse import Delta, StreamError, StreamStats, aiter_events
+from telemetry import get_telemetry
+from utils import (
+    API_KEY_MESSAGE, BUSY_MESSAGE, CONNECT_TIMEOUT, MAX_IN_FLIGHT, OPENROUTER_URL, POOL_MAXSIZE, READ_TIMEOUT,
+    ModelCallError, all_failed_message, build_messages, build_payload,
+    candidate_models, get_api_key, get_http_session, status_error,
+)
+
+DEFAULT_MODEL = "google/gemini-2.0-flash-lite-preview-02-05:free"
+
+
+class DeadlineExceeded(Exception):
+    """The call ran past its `deadline`."""
+
+
+class AsyncOpenRouterStream:
+    """
+    Async iterable of content deltas from the model that answered.
+    - `model` tells which model won.
+    - The first token is already received when the stream is handed out.
+    - `stats` (sse.StreamStats) has timings, token usage and finish reason.
+    - aclose() (or cancelling the consuming task) closes the response.
+    """
+
+    def __init__(self, model, response, stats, deadline_at=None, on_close=None):
+        self.model = model
+        self.stats = stats
+        self._first_chunk = None
+        self._response = response
+        self._events = aiter_events(response.aiter_bytes(), stats)
+        self._deadline_at = deadline_at
+        self._on_close = on_close
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        try:
+            yield self._first_chunk
+            while True:
+                text = await self._next_delta()
+                if text is None:
+                    break
+                yield text
+        finally:
+            await self.aclose()
+
+    async def _next_delta(self):
+        """Next content delta (None at the end); provider errors raise ModelCallError."""
+        while True:
+            event = await self._next_event()
+            if event is None or isinstance(event, Delta):
+                return event and event.text
+            if isinstance(event, StreamError) and event.code != "malformed":
+                raise ModelCallError(self.model, f"error del proveedor: {event.message[:80]}", "provider")
+
+    async def _next_event(self):
+        if self._deadline_at is None:
+            return await anext(self._events, None)
+        remaining = self._deadline_at - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded(self.model)
+        try:
+            return await asyncio.wait_for(anext(self._events, None), remaining)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(self.model) from None
+
+    async def aclose(self):
+        """Closes the HTTP response and runs `on_close` (once)."""
+        response, self._response = self._response, None
+        if response is not None:
+            await self._events.aclose()
+            await response.aclose()
+        on_close, self._on_close = self._on_close, None
+        if on_close is not None:
+            on_close()
+
+
+# One AsyncClient per event loop (httpx clients can't be shared across loops)
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_async_client():
+    """Returns the pooled AsyncClient for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        with _clients_lock:
+            client = _clients.get(loop)
+            if client is None or client.is_closed:
+                client = _clients[loop] = httpx.AsyncClient(
+                    timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+                    limits=httpx.Limits(max_connections=POOL_MAXSIZE, max_keepalive_connections=POOL_MAXSIZE),
+                    # Same identification headers as the sync session; no cookies kept
+                    headers=dict(get_http_session().headers),
+                )
+    return client
+
+
+async def _aopen_stream(client, api_key, model, messages, deadline_at=None):
+    """One streaming attempt; waits for the first content token."""
+    request = client.build_request(
+        "POST", OPENROUTER_URL,
+        headers={"Authorization": f"Bearer {api_key}"},
+        content=json.dumps(build_payload(model, messages)),
+    )
+    started = time.monotonic()
+    try:
+        response = await client.send(request, stream=True)
+    except httpx.TimeoutException:
+        raise ModelCallError(model, "tiempo de espera agotado.", "timeout")
+    except httpx.HTTPError as e:
+        raise ModelCallError(model, str(e)[:80])
+    connected = time.monotonic()
+
+    try:
+        if response.status_code != 200:
+            await response.aread()  # Small error body: lets the connection go back to the pool
+            raise status_error(model, response.status_code)
+        stats = StreamStats(started)
+        stats.connected = connected
+        stream = AsyncOpenRouterStream(model, response, stats, deadline_at)
+        first_chunk = await stream._next_delta()
+        if first_chunk is None:
+            raise ModelCallError(model, "respuesta vacía.", "empty")
+        stream._first_chunk = first_chunk
+        return stream
+    except httpx.TimeoutException:
+        await response.aclose()
+        raise ModelCallError(model, "tiempo de espera agotado.", "timeout")
+    except httpx.HTTPError as e:
+        await response.aclose()
+        raise ModelCallError(model, str(e)[:80])
+    except BaseException:
+        # ModelCallError, DeadlineExceeded or cancellation by a hedging winner
+        await response.aclose()
+        raise
+
+
+async def _arace_models(start_attempt, models, hedge_delay, race, max_in_flight):
+    """
+    Async twin of utils._race_models: runs attempts as tasks and returns the
+    first stream to produce a token; the other tasks are cancelled.
+    """
+    pending = list(models)
+    tasks = set()
+
+    def launch():
+        tasks.add(asyncio.create_task(start_attempt(pending.pop(0))))
+
+    for _ in range(min(max(race, 1), max_in_flight, len(pending))):
+        launch()
+
+    last_error = None
+    try:
+        while tasks:
+            can_hedge = pending and len(tasks) < max_in_flight
+            done, _ = await asyncio.wait(tasks, timeout=hedge_delay if can_hedge else None,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                launch()
+                continue
+            winner = None
+            for task in done:
+                tasks.discard(task)
+                error = task.exception()
+                if error is None and winner is None:
+                    winner = task.result()
+                elif error is None:
+                    await task.result().aclose()  # Runner-up finished at the same time
+                elif isinstance(error, ModelCallError):
+                    last_error = error
+                else:
+                    raise error
+            if winner is not None:
+                return winner
+            if pending:
+                launch()
+    finally:
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+    raise last_error
+
+
+async def acall_openrouter(prompt=None, system_context="", model=DEFAULT_MODEL, manual_api_key="", messages=None,
+                           hedge_delay=None, race=1, max_in_flight=MAX_IN_FLIGHT, session_id=None,
+                           local_answer=None, cache_system=False, fit_messages=None, deadline=None):
+    """
+    Async version of utils.call_openrouter (same arguments), plus `deadline`:
+    seconds for the whole call, including streaming the answer. Past it, the
+    call returns the error message (before the first token) or the stream
+    raises DeadlineExceeded.
+    Returns an AsyncOpenRouterStream or an error string.
+    """
+    trace = get_telemetry().start_call(model, session_id, client="async")
+    api_key = manual_api_key if manual_api_key else get_api_key()
+    if not api_key:
+        trace.finish("no_key")
+        return API_KEY_MESSAGE
+    deadline_at = time.monotonic() + deadline if deadline is not None else None
+
+    health = get_registry()
+    models = candidate_models(model)
+    base_messages = build_messages(prompt, system_context, messages, cache_system)
+
+    admission = get_admission()
+    if local_answer is not None and admission.is_saturated():
+        answer = local_answer(prompt, messages)
+        if answer:
+            trace.finish("local", "saturated")
+            return answer
+    try:
+        # The queue wait blocks on a threading primitive: keep it off the loop
+        await asyncio.to_thread(admission.acquire, session_id)
+    except LLMBusy as e:
+        answer = local_answer(prompt, messages) if local_answer is not None else None
+        trace.finish("local" if answer else "busy", f"busy: {e}")
+        return answer or BUSY_MESSAGE
+    trace.admitted()
+
+    client = get_async_client()
+
+    async def start_attempt(current_model):
+        started = time.monotonic()
+        if not admission.allow_model(current_model):
+            trace.attempt(current_model, "throttled", started)
+            raise ModelCallError(current_model, "límite local de solicitudes.", "throttled")
+        payload = fit_messages(current_model, base_messages) if fit_messages else base_messages
+        try:
+            stream = await _aopen_stream(client, api_key, current_model, payload, deadline_at)
+        except ModelCallError as e:
+            trace.attempt(current_model, e.kind, started)
+            if e.kind != "throttled":
+                health.record_failure(current_model, e.kind, str(e))
+            raise
+        except asyncio.CancelledError:
+            # Hedging loser: says nothing about the model's health
+            trace.attempt(current_model, "cancelled", started, cancelled=True)
+            raise
+        trace.attempt(current_model, "ok", started, stream.stats.connected)
+        health.record_success(current_model, time.monotonic() - started)
+        return stream
+
+    async def attempt_all():
+        if hedge_delay is not None or race > 1:
+            return await _arace_models(start_attempt, models, hedge_delay, race, max_in_flight)
+        last_error = None
+        for current_model in models:
+            try:
+                return await start_attempt(current_model)
+            except ModelCallError as e:
+                last_error = e
+        raise last_error or ModelCallError(model, "sin modelos disponibles.")
+
+    last_error = ""
+    stream = None
+    try:
+        remaining = deadline_at - time.monotonic() if deadline_at is not None else None
+        stream = await asyncio.wait_for(attempt_all(), remaining)
+    except ModelCallError as e:
+        last_error = str(e)
+    except (asyncio.TimeoutError, DeadlineExceeded):
+        last_error = "tiempo límite de la consulta agotado."
+    finally:
+        if stream is None:
+            admission.release(session_id)
+    if stream is not None:
+        def on_close(stream=stream):
+            admission.release(session_id)
+            trace.finish_stream(stream)
+        stream._on_close = on_close
+        return stream
+
+    answer = local_answer(prompt, messages) if local_answer is not None else None
+    trace.finish("local" if answer else "error", last_error)
+    if answer:
+        return answer
+    return all_failed_message(last_error)
+
+
+# --- Sync adapter ---
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop():
+    """The shared background event loop (started on first use)."""
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="openrouter-loop", daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+class SyncStream:
+    """Plain iterator over an AsyncOpenRouterStream running on the shared loop."""
+
+    def __init__(self, stream, loop):
+        self.model = stream.model
+        self._stream = stream
+        self._iterator = stream.__aiter__()
+        self._loop = loop
+
+    def __iter__(self):
+        try:
+            while True:
+                future = asyncio.run_coroutine_threadsafe(anext(self._iterator, None), self._loop)
+                chunk = future.result()
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self, wait=True):
+        """Stops the stream on the loop; `wait=False` only schedules it."""
+        iterator, self._iterator = self._iterator, None
+        if iterator is None:
+            return
+        future = asyncio.run_coroutine_threadsafe(self._aclose(iterator), self._loop)
+        if wait:
+            future.result()
+
+    async def _aclose(self, iterator):
+        await iterator.aclose()
+        await self._stream.aclose()  # In case iteration never started
+
+    def __del__(self):
+        # May run on any thread, including the loop's own: never block here
+        if self._loop.is_running():
+            self.close(wait=False)
+
+
+def call_openrouter_on_loop(*args, **kwargs):
+    """
+    Drop-in for utils.call_openrouter backed by acall_openrouter: blocks until
+    the first token, then returns a SyncStream (or an error string). Usable
+    with st.write_stream or BackgroundReply.
+    """
+    loop = get_event_loop()
+    result = asyncio.run_coroutine_threadsafe(acall_openrouter(*args, **kwargs), loop).result()
+    if isinstance(result, str):
+        return result
+    return SyncStream(result, loop)
@@ -4,14 +4,28 @@ import random
 import urllib.parse
 import requests
 import json
+import os
+import uuid
 from utils import call_openrouter
+from assets import picture_html, publish, static_url
+from catalog import load_catalog
+from cart import Cart
+from chat_worker import BackgroundReply
+from chat_history import ChatHistory, fit_to_context
+from vaquita import get_system_prompt
+from faq import get_answerer, get_response_cache
+from telemetry import get_telemetry
+from model_health import get_registry
 
 # --- CONFIGURATION ---
 st.set_page_config(page_title="Kumis del Balcón 🐮", page_icon="🐮", layout="wide", initial_sidebar_state="expanded")
 
 # --- SESSION STATE ---
 if 'cart' not in st.session_state:
-    st.session_state.cart = []
+    st.session_state.cart = Cart()
+# Identifies this browser session to the LLM admission queue (fair share per session)
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
 # We no longer cache wompi_ref in session state to ensure unique references per payment attempt
 
 # --- HELPERS ---
@@ -23,186 +37,64 @@ def get_wompi_key():
         return "pub_test_Q5yDA9xoKdePzhSGeVe9HAez74wxobRY"
 
 # --- CUSTOM CSS ---
-st.markdown("""
-<style>
-    @import url('https://fonts.googleapis.com/css2?family=Fredoka:wght@400;600&family=Nunito:wght@400;700&display=swap');
-    
-    html, body, [class*="css"] {
-        font-family: 'Nunito', sans-serif;
-    }
-
-    @media (prefers-color-scheme: dark) {
-        .footer, .sevilla-section {
-            background-color: rgba(255, 255, 255, 0.05) !important;
-        }
-    }
-    
-    .main-title {
-        font-family: 'Fredoka', sans-serif;
-        color: #2c3e50;
-        text-align: center;
-        font-size: 3.5rem;
-        font-weight: 600;
-        margin-bottom: 0;
-        text-shadow: 2px 2px 4px rgba(0,0,0,0.1);
-    }
-    
-    .slogan {
-        font-family: 'Fredoka', sans-serif;
-        color: #e67e22;
-        text-align: center;
-        font-size: 1.5rem;
-        margin-top: -10px;
-        margin-bottom: 30px;
-    }
-    
-    .category-title {
-        font-family: 'Fredoka', sans-serif;
-        color: #d35400;
-        border-bottom: 2px solid #fad390;
-        padding-bottom: 5px;
-        margin-top: 20px;
-        margin-bottom: 20px;
-    }
-
-    .stButton button {
-        background-color: #27ae60;
-        color: white;
-        border-radius: 20px;
-        font-weight: bold;
-        border: none;
-        transition: all 0.3s;
-    }
-    .stButton button:hover {
-        background-color: #219150;
-        transform: scale(1.05);
-    }
-    
-    .footer, .sevilla-section {
-        background-color: rgba(0, 0, 0, 0.05);
-        padding: 40px;
-        margin-top: 50px;
-        border-top: 3px solid #e67e22;
-        border-radius: 15px;
-        text-align: center;
-    }
-
-    .intro-box {
-        text-align: center;
-        max-width: 800px;
-        margin: 0 auto;
-        font-size: 1.2rem;
-        background-color: #fff9c4;
-        color: #4a4a4a;
-        padding: 15px;
-        border-radius: 10px;
-    }
-
-    @media (prefers-color-scheme: dark) {
-        .footer, .sevilla-section {
-            background-color: rgba(255, 255, 255, 0.05) !important;
-        }
-        .intro-box {
-            background-color: rgba(255, 249, 196, 0.15) !important;
-            color: #eee !important;
-        }
-    }
-
-    /* Target specific headings within sections for better contrast */
-    .sevilla-section h2, .sevilla-section h3, .footer h3 {
-        color: inherit !important;
-    }
-</style>
-""", unsafe_allow_html=True)
+# The stylesheet lives in styles.css and is served as a hashed static file, so
+# browsers cache it instead of receiving the whole block on every rerun.
+st.markdown(f'<link rel="stylesheet" href="{publish("styles.css")}">', unsafe_allow_html=True)
 
 # --- DATA: MENU ITEMS ---
-menu_categories = {
-    "🐮 Lácteos y Arroz con Leche": [
-        {"name": "Kumis Tradicional (16oz)", "price": 8000, "desc": "Cremoso, dulce y delicioso. El favorito.", "img": "kumis.png"},
-        {"name": "Kumis Litro", "price": 18000, "desc": "Para compartir en familia.", "img": "kumis.png"},
-        {"name": "Yogurt de Frutas", "price": 9000, "desc": "Mora, Melocotón o Fresa.", "img": "yogurt.png"},
-        {"name": "Arroz con Leche", "price": 6500, "desc": "Con canela, pasas y queso rallado.", "img": "arroz.png"},
-        {"name": "Fresas con Crema", "price": 12000, "desc": "Fresas del campo con nuestra crema especial.", "img": "fresas.png"},
-    ],
-    "🥐 Panadería y Tradición": [
-        {"name": "Torta de Almojábana", "price": 7000, "desc": "Esponjosa torta de queso y maíz.", "img": "torta_almojabana.png"},
-        {"name": "Torta de Choclo", "price": 7000, "desc": "Dulce de maíz tierno con queso.", "img": "torta_choclo.png"},
-        {"name": "Pandebono Valluno", "price": 3500, "desc": "Calientito y chicludo.", "img": "pandebono.png"},
-        {"name": "Buñuelo Grande", "price": 3000, "desc": "Crocante por fuera, suave por dentro.", "img": "bunuelo.png"},
-        {"name": "Empanada de Cambray", "price": 4000, "desc": "Rellena de dulce de guayaba y queso.", "img": "empanada.png"},
-    ],
-    "🍰 Repostería y Dulces": [
-        {"name": "Cheesecake de Maracuyá", "price": 9500, "desc": "Postre frío con salsa natural.", "img": "cheesecake.png"},
-        {"name": "Galleta de Chip", "price": 2500, "desc": "Galleta estilo americano.", "img": "galleta.png"},
-        {"name": "Torta de Zanahoria", "price": 7500, "desc": "Con frosting de queso crema.", "img": "torta_zanahoria.png"},
-    ],
-    "☕ Bebidas y Algo más": [
-        {"name": "Café de la Casa", "price": 4000, "desc": "Tinto campesino cultivado en Sevilla.", "img": "cafe.png"},
-        {"name": "Chocolate Santafereno", "price": 6000, "desc": "En leche, espumoso y con clavos.", "img": "chocolate.png"},
-        {"name": "Avena Helada", "price": 5000, "desc": "Espesa y refrescante.", "img": "avena.png"},
-        {"name": "Sándwich Jamón y Queso", "price": 9000, "desc": "En pan artesanal.", "img": "sandwich.png"},
-    ]
-}
+# Loaded from menu.json; re-read only when the file changes (see catalog.py)
+catalog = load_catalog()
+menu_categories = catalog.categories
 
 
-# --- SIDEBAR (CONFIG & CART) ---
-with st.sidebar:
-    # --- VISUALS ---
-    st.title("🐮 Menú y Pedidos")
-    
-    # Check for developer mode via URL query parameter (?dev=true)
-    is_dev = st.query_params.get("dev", "false").lower() == "true"
+# --- CART (FRAGMENTS) ---
+# The cart, the checkout form and each product card are fragments: clicking
+# "Agregar al Carrito" reruns only the cart instead of the whole storefront.
+def add_to_cart(item):
+    st.session_state.cart.add(item)
+    # Shown by the cart fragment: callbacks can't draw elements during a fragment rerun
+    st.session_state.cart_toast = f"✅ ¡{item['name']} agregado!"
+    st.rerun("cart")
 
-    st.markdown("### 🛒 Tu Carrito")
+def remove_from_cart(sku):
+    st.session_state.cart.remove(sku)
 
-    if st.session_state.cart:
-        total = sum(item['price'] for item in st.session_state.cart)
-        
-        for i, item in enumerate(st.session_state.cart):
-            c1, c2 = st.columns([3, 1])
-            c1.markdown(f"**{item['name']}**")
-            c2.markdown(f"${item['price']:,}")
-        
-        st.markdown("---")
-        st.markdown(f"### Total: ${total:,}")
-        
-        if st.button("🗑️ Vaciar Carrito"):
-            st.session_state.cart = []
-            st.rerun()
+def clear_cart():
+    st.session_state.cart.clear()
 
-        st.markdown("---")
-        
-        # --- CHECKOUT FORM ---
-        st.subheader("🛍️ Finalizar Pedido")
-        order_type = st.selectbox("¿Dónde recibirás tu pedido?", ["🏠 A domicilio", "🪑 Para la mesa"])
+
+@st.fragment(key="checkout")
+def render_checkout():
+    cart = st.session_state.cart
+    total = cart.total
+    st.subheader("🛍️ Finalizar Pedido")
+    order_type = st.selectbox("¿Dónde recibirás tu pedido?", ["🏠 A domicilio", "🪑 Para la mesa"])
+    
+    with st.form("checkout_form"):
+        client_name = st.text_input("Nombre Completo:")
         
-        with st.form("checkout_form"):
-            client_name = st.text_input("Nombre Completo:")
-            
-            if order_type == "🏠 A domicilio":
-                client_address = st.text_input("Dirección de Entrega:")
-                table_info = ""
-            else:
-                table_info = st.text_input("Número de Mesa:")
-                client_address = "Local - Mesa " + table_info
-                
-            client_phone = st.text_input("Teléfono / WhatsApp:")
-            payment_method = st.radio("Método de Pago:", ["Nequi / Bancolombia", "Efectivo", "Wompi"])
+        if order_type == "🏠 A domicilio":
+            client_address = st.text_input("Dirección de Entrega:")
+            table_info = ""
+        else:
+            table_info = st.text_input("Número de Mesa:")
+            client_address = "Local - Mesa " + table_info
             
-            submitted = st.form_submit_button("✅ Confirmar Datos")
-        
-        # --- WHATSAPP MESSAGE GENERATOR ---
-        check_condition = submitted and client_name and client_phone and (client_address if order_type == "🏠 A domicilio" else table_info)
+        client_phone = st.text_input("Teléfono / WhatsApp:")
+        payment_method = st.radio("Método de Pago:", ["Nequi / Bancolombia", "Efectivo", "Wompi"])
         
-        if check_condition:
-            # Create text for message
-            items_list = ""
-            for item in st.session_state.cart:
-                items_list += f"- {item['name']} (${item['price']:,})\n"
-                
-            order_details = f"*Mesa:* {table_info}" if order_type == "🪑 Para la mesa" else f"*Dirección:* {client_address}"
+        submitted = st.form_submit_button("✅ Confirmar Datos")
+    
+    # --- WHATSAPP MESSAGE GENERATOR ---
+    check_condition = submitted and client_name and client_phone and (client_address if order_type == "🏠 A domicilio" else table_info)
+    
+    if check_condition:
+        # Create text for message (one line per product, built in a single pass)
+        items_list = cart.order_text() + "\n"
             
-            whatsapp_msg = f"""*¡Hola Kumis del Balcón!* 🐮
+        order_details = f"*Mesa:* {table_info}" if order_type == "🪑 Para la mesa" else f"*Dirección:* {client_address}"
+        
+        whatsapp_msg = f"""*¡Hola Kumis del Balcón!* 🐮
 Quiero hacer el siguiente pedido (*{order_type}*):
 
 {items_list}
@@ -214,227 +106,257 @@ Quiero hacer el siguiente pedido (*{order_type}*):
 *Tel:* {client_phone}
 *Pago:* {payment_method}
 """
-            whatsapp_encoded = urllib.parse.quote(whatsapp_msg)
-            whatsapp_link = f"https://wa.me/573127321920?text={whatsapp_encoded}"
-            
-            st.success("✅ ¡Datos listos!")
-            st.markdown(f"""
-            <a href="{whatsapp_link}" target="_blank">
-                <button style="background-color: #25D366; color: white; border: none; padding: 12px; width: 100%; border-radius: 10px; font-weight: bold; font-size: 1.1rem; cursor: pointer;">
-                    📲 Enviar Pedido por WhatsApp
-                </button>
-            </a>
-            """, unsafe_allow_html=True)
-            
-            if payment_method == "Wompi":
-                wompi_key = get_wompi_key()
-                url_wompi = (
-                    f"https://checkout.wompi.co/p/"
-                    f"?public-key={wompi_key}"
-                    f"&currency=COP"
-                    f"&amount-in-cents={total * 100}"
-                    f"&reference=KB-{random.randint(100, 999)}-{random.randint(1000, 9999)}"
-                )
-                st.markdown("<br>", unsafe_allow_html=True)
-                st.link_button(f"💳 Ir a Pagar ${total:,} con Wompi", url_wompi)
-            
-            # Add Nequi QR for Eat-in orders
-            if order_type == "🪑 Para la mesa" and payment_method == "Nequi / Bancolombia":
-                st.markdown("---")
-                st.subheader("📱 Pago Rápido Nequi")
-                try:
-                    st.image("nequi_qr.png", caption="Escanea para pagar tu pedido en mesa")
-                except:
-                    st.warning("⚠️ QR de Nequi no disponible en este momento.")
-                 
-        elif submitted:
-            warning_msg = "⚠️ Por favor completa tus datos para finalizar el pedido."
-            if order_type == "🪑 Para la mesa" and not table_info:
-                warning_msg = "⚠️ Por favor indica tu número de mesa."
-            st.warning(warning_msg)
+        whatsapp_encoded = urllib.parse.quote(whatsapp_msg)
+        whatsapp_link = f"https://wa.me/573127321920?text={whatsapp_encoded}"
+        
+        st.success("✅ ¡Datos listos!")
+        st.markdown(f"""
+        <a href="{whatsapp_link}" target="_blank">
+            <button style="background-color: #25D366; color: white; border: none; padding: 12px; width: 100%; border-radius: 10px; font-weight: bold; font-size: 1.1rem; cursor: pointer;">
+                📲 Enviar Pedido por WhatsApp
+            </button>
+        </a>
+        """, unsafe_allow_html=True)
+        
+        if payment_method == "Wompi":
+            wompi_key = get_wompi_key()
+            url_wompi = (
+                f"https://checkout.wompi.co/p/"
+                f"?public-key={wompi_key}"
+                f"&currency=COP"
+                f"&amount-in-cents={cart.amount_in_cents()}"
+                f"&reference=KB-{random.randint(100, 999)}-{random.randint(1000, 9999)}"
+            )
+            st.markdown("<br>", unsafe_allow_html=True)
+            st.link_button(f"💳 Ir a Pagar ${total:,} con Wompi", url_wompi)
+        
+        # Add Nequi QR for Eat-in orders
+        if order_type == "🪑 Para la mesa" and payment_method == "Nequi / Bancolombia":
+            st.markdown("---")
+            st.subheader("📱 Pago Rápido Nequi")
+            try:
+                st.markdown(f'<img src="{publish("nequi_qr.png")}" alt="QR Nequi" style="width: 100%;">', unsafe_allow_html=True)
+                st.caption("Escanea para pagar tu pedido en mesa")
+            except:
+                st.warning("⚠️ QR de Nequi no disponible en este momento.")
+             
+    elif submitted:
+        warning_msg = "⚠️ Por favor completa tus datos para finalizar el pedido."
+        if order_type == "🪑 Para la mesa" and not table_info:
+            warning_msg = "⚠️ Por favor indica tu número de mesa."
+        st.warning(warning_msg)
+
+
+@st.fragment(key="cart")
+def render_cart():
+    if toast_msg := st.session_state.pop("cart_toast", None):
+        st.toast(toast_msg)
+
+    st.markdown("### 🛒 Tu Carrito")
+
+    cart = st.session_state.cart
+    if cart:
+        for sku, line in cart.lines.items():
+            item = line["item"]
+            c1, c2 = st.columns([3, 1])
+            c1.markdown(f"**{item['name']}**")
+            c2.markdown(f"${item['price'] * line['qty']:,}")
+            c_minus, c_qty, c_plus = st.columns([1, 1, 1])
+            c_minus.button("➖", key=f"cart_minus_{sku}", on_click=remove_from_cart, args=(sku,))
+            c_qty.markdown(f"<div style='text-align: center;'>x{line['qty']}</div>", unsafe_allow_html=True)
+            c_plus.button("➕", key=f"cart_plus_{sku}", on_click=add_to_cart, args=(item,))
+        
+        st.markdown("---")
+        st.markdown(f"### Total: ${cart.total:,}")
+        
+        st.button("🗑️ Vaciar Carrito", on_click=clear_cart)
+
+        st.markdown("---")
+        
+        render_checkout()
         
     else:
         st.info("Tu carrito está vacío. ¡Antójate de algo delicioso! 😋")
 
-# --- AI ASSISTANT (CHATBOT) ---
-st.sidebar.markdown("---")
-st.sidebar.subheader("🐮 Chat con la Vaquita (IA)")
-st.sidebar.caption("¡Pregúntame sobre el menú o sobre Sevilla!")
 
+# How often the developer panel refreshes its numbers (seconds)
+DEV_PANEL_REFRESH_SECONDS = 5
+
+
+def _fmt_seconds(value):
+    return "—" if value is None else f"{value:.2f}s"
+
+
+@st.fragment(run_every=DEV_PANEL_REFRESH_SECONDS)
+def render_dev_panel():
+    # Rolling LLM metrics for tuning the fallback list (only with ?dev=true)
+    summary = get_telemetry().summary()
+    with st.expander("🛠️ Rendimiento del LLM", expanded=True):
+        st.caption(f"Últimas {summary['calls']} llamadas · {summary['outcomes']}")
+        col_ttft, col_latency = st.columns(2)
+        col_ttft.metric("TTFT p50", _fmt_seconds(summary["ttft"]["p50"]),
+                        help=f"p90 {_fmt_seconds(summary['ttft']['p90'])} · p99 {_fmt_seconds(summary['ttft']['p99'])}")
+        col_latency.metric("Latencia p50", _fmt_seconds(summary["latency"]["p50"]),
+                           help=f"p90 {_fmt_seconds(summary['latency']['p90'])} · p99 {_fmt_seconds(summary['latency']['p99'])}")
+        col_connect, col_speed = st.columns(2)
+        col_connect.metric("Conexión p50", _fmt_seconds(summary["connect"]["p50"]))
+        tokens_per_s = summary["tokens_per_s"]["p50"]
+        col_speed.metric("Tokens/s p50", "—" if tokens_per_s is None else f"{tokens_per_s:.0f}")
+        if summary["attempts_per_call"] is not None:
+            st.caption(f"Intentos por llamada: {summary['attempts_per_call']:.2f} · "
+                       f"espera en cola p90: {_fmt_seconds(summary['queue_wait']['p90'])}")
+        if summary["winners"]:
+            st.write("**Modelos que respondieron**", summary["winners"])
+        if summary["errors"]:
+            st.write("**Errores por clase**", summary["errors"])
+        health = get_registry().snapshot()
+        if health:
+            st.write("**Salud de modelos**")
+            st.dataframe(
+                [{"modelo": model, "éxito": round(stats["success_rate"], 2), "ttft": round(stats["ttft"], 2),
+                  "fallos seguidos": stats["consecutive_failures"], "último error": stats["last_error"]}
+                 for model, stats in health.items()],
+                hide_index=True,
+            )
 
-def call_openrouter_assistant(prompt):
-    try:
-        # Contexto del negocio para la IA - Generado dinámicamente
-        menu_ctx = ""
-        for cat, items in menu_categories.items():
-            menu_ctx += f"\n### {cat}:\n"
-            for item in items:
-                menu_ctx += f"- {item['name']}: ${item['price']:,} ({item['desc']})\n"
-
-        full_context = f"""
-        Eres 'La Vaquita', la asistente virtual experta de 'Kumis del Balcón', ubicado en Sevilla, Valle del Cauca, Colombia. 🐮☕
-        Tu misión es antojar, informar y enamorar a los clientes con nuestros productos y con la riqueza cultural de Sevilla.
-        Responde SIEMPRE en español, de forma cálida, detallada y con personalidad campesina amable.
-
-        ══════════════════════════════════════════
-        🐮 CONOCIMIENTO PROFUNDO DE PRODUCTOS
-        ══════════════════════════════════════════
-
-        LÁCTEOS:
-        - Kumis Tradicional (16oz) / Kumis Litro: Bebida láctea fermentada de forma natural durante 24-48 horas.
-          Ingredientes: leche fresca de vaca, azúcar y cultivos lácticos vivos (Lactobacillus). Textura cremosa
-          y espesa, sabor suavemente ácido y dulce a la vez. Es el producto estrella del local. Ideal para
-          personas con digestión delicada pues sus probióticos ayudan al intestino. Contiene lactosa y azúcar.
-          Maridaje perfecto: Pandebono valluno o buñuelo recién hecho.
-
-        - Yogurt de Frutas: Elaborado con leche entera, fermentado y mezclado con pulpa natural de mora,
-          melocotón o fresa según disponibilidad. Espeso, sin colorantes artificiales. Contiene lactosa y azúcar.
-          Maridaje: Galleta de chip o torta de zanahoria.
-
-        - Arroz con Leche: Receta tradicional de la abuela. Arroz de grano largo cocido lentamente en leche
-          entera con canela en rama, panela/azúcar, uvas pasas y coronado con queso rallado. Es un postre
-          caliente y reconfortante. Contiene lácteos y azúcar. Maridaje: Café de la casa o chocolate santafereño.
-
-        - Fresas con Crema: Fresas frescas de campo bañadas con nuestra crema de leche especial.
-          Postre frío y ligero. Contiene lácteos. Maridaje: Avena helada o café.
-
-        PANADERÍA:
-        - Torta de Almojábana: Torta típica vallecaucana hecha con harina de maíz, queso blanco costeño y
-          huevo. Textura esponjosa, levemente salada. Contiene lácteos y huevo. Maridaje: Café tinto o chocolate caliente.
-
-        - Torta de Choclo: Elaborada con maíz tierno (choclo) molido, queso cuajada fresco, huevo y un toque
-          de azúcar. Sabor a maíz fresco muy característico. Contiene lácteos y huevo. Maridaje: Kumis frío o café.
-
-        - Pandebono Valluno: Ícono de la gastronomía vallecaucana. Hecho con almidón de yuca agria, queso
-          costeño rallado, huevo y poca sal. Crocante por fuera y chicloso por dentro. Sin gluten (es de yuca).
-          Contiene lácteos y huevo. Maridaje ideal: Kumis o chocolate santafereño.
-
-        - Buñuelo Grande: Masa de queso blanco y maicena, frita en aceite caliente. Crocante por fuera,
-          hueco y suave por dentro. Sin gluten. Contiene lácteos. Maridaje: Café tinto o chocolate.
-
-        - Empanada de Cambray: Masa de maíz artesanal rellena de dulce de guayaba casero y queso blanco.
-          Combinación dulce-salada muy típica del Valle. Contiene lácteos. Maridaje: Café o avena helada.
-
-        REPOSTERÍA:
-        - Cheesecake de Maracuyá: Postre frío con base de galleta, relleno cremoso de queso crema y salsa
-          natural de maracuyá. Dulce con toque ácido tropical. Contiene gluten y lácteos.
-          Maridaje: Café o avena helada.
-
-        - Galleta de Chip: Galleta horneada estilo americano con chips de chocolate. Contiene gluten, lácteos
-          y huevo. Maridaje: Yogurt o kumis.
-
-        - Torta de Zanahoria: Bizcocho húmedo de zanahoria con especias (canela, clavo), coronado con
-          frosting de queso crema. Contiene gluten, lácteos y huevo. Maridaje: Café de la casa.
-
-        BEBIDAS:
-        - Café de la Casa: Tinto campesino con granos cultivados en las montañas de Sevilla. Tostado medio,
-          notas a chocolate y caramelo. Sin lácteos, sin gluten. Maridaje: Cualquier producto del menú.
-
-        - Chocolate Santafereño: Chocolate de mesa en leche entera caliente, batido hasta producir espuma
-          gruesa. Se sirve con clavos de olor. Con lácteos. Maridaje: Pandebono, almojábana o buñuelo.
-
-        - Avena Helada: Bebida fría de avena, leche, canela y azúcar. Espesa y refrescante.
-          Contiene gluten y lácteos. Maridaje: Empanada o fresas.
-
-        - Sándwich Jamón y Queso: Pan artesanal con jamón cocido y queso derretido. Contiene gluten y lácteos.
-          Maridaje: Café o avena.
-
-        MENÚ COMPLETO Y PRECIOS:
-        {menu_ctx}
-
-        ══════════════════════════════════════════
-        🌄 HISTORIA Y CULTURA DE SEVILLA, VALLE DEL CAUCA
-        ══════════════════════════════════════════
-
-        HISTORIA:
-        - Sevilla fue fundada el 28 de octubre de 1903 por colonizadores antioqueños (paisas) que llegaron
-          al norte del Valle del Cauca buscando tierras fértiles para café.
-        - Su nombre fue inspirado en la ciudad española de Sevilla por la hermosura de sus paisajes.
-        - Declarada municipio oficial en 1907. Es conocida como la 'Capital Cafetera de Colombia' y como
-          la 'Ciudad de los Balcones' por sus coloridos balcones floridos, herencia de la arquitectura paisa.
-        - Durante el siglo XX fue clave en el desarrollo agrícola del Valle, con cultivos de café, caña,
-          plátano y frutales.
-
-        GEOGRAFÍA:
-        - Ubicada al norte del Valle del Cauca, a ~1.550 metros sobre el nivel del mar.
-        - Clima templado agradable: entre 18°C y 24°C todo el año.
-        - Rodeada de la cordillera central de los Andes, con paisajes cafeteros espectaculares.
-        - A unas 3 horas de Cali y cerca de Cartago y Caicedonia.
-        - Forma parte del 'Paisaje Cultural Cafetero de Colombia', declarado Patrimonio de la Humanidad
-          por la UNESCO en 2011.
-
-        CULTURA Y TRADICIONES:
-        - Festival Nacional de la Bandola (agosto): El festival de bandola más importante de Colombia.
-          Reúne músicos de todo el país que tocan música tradicional andina (bambuco, pasillo, torbellino).
-          La bandola es un instrumento de cuerda típico de la zona andina, similar al laúd.
-        - Basílica San Luis Gonzaga: Iglesia principal en el parque central, joya de arquitectura
-          neogótica-republicana y símbolo del municipio.
-        - Gastronomía local: kumis, pandebono, empanadas, buñuelos, arroz con leche, sancocho de gallina,
-          tamales y en cada esquina: café de origen.
-        - La gente sevillana es famosa por ser amable, hospitalaria y muy orgullosa de sus raíces.
-
-        TURISMO:
-        - Parque Principal: Corazón del municipio, rodeado de la Basílica y coloridos balcones.
-        - Mirador El Morro: Vista panorámica espectacular de Sevilla y sus montañas.
-        - Fincas cafeteras: Tours del café para conocer el proceso desde la mata hasta la taza.
-        - Kumis del Balcón está ubicado frente al parque principal, en el corazón turístico del municipio.
-
-        ══════════════════════════════════════════
-        🐮 PERSONALIDAD DE LA VAQUITA
-        ══════════════════════════════════════════
-        - Eres una campesina sevillana amable, sabia y muy orgullosa de su tierra.
-        - Usas emojis con moderación: 🐮 🥛 🌽 🧀 ☕ 🌄 🎸 🌺
-        - Tratas al cliente de: "Vecino/a", "Corazón", "Mijo/a", "Paisano/a".
-        - Usas expresiones colombianas naturales y espontáneas: "¡De una!", "¿Listo pues?", "¡Qué rico!".
-        - Tus respuestas son cálidas, nunca frías ni robóticas.
-        - Si alguien pregunta algo fuera de tu conocimiento, reconoces que no sabes y ofreces el teléfono: 📞 310 123 4567.
-
-        ══════════════════════════════════════════
-        📋 REGLAS DE RESPUESTA
-        ══════════════════════════════════════════
-        1. MENÚ: Responde sobre productos, ingredientes, precios, tamaños y preparación con detalle.
-        2. MARIDAJES: SIEMPRE sugiere una combinación de productos al final de tu respuesta.
-        3. DIETA: Para preguntas sobre gluten, lactosa, vegetariano o azúcar, usa la info real de los ingredientes.
-        4. HISTORIA/TURISMO: Responde con detalle y orgullo sobre Sevilla, su historia, cultura y turismo.
-        5. ORTOGRAFÍA: Entiende preguntas mal escritas (cumis, pan de bono, buñelo, almojabana). NUNCA corrijas.
-        6. PEDIDOS: Si alguien quiere pedir, indícale que use el carrito de la izquierda 🛒 y el botón de WhatsApp.
-        7. FUERA DE TEMA: Si la pregunta no tiene NADA que ver con el menú, Sevilla o gastronomía colombiana,
-           dilo amablemente y redirige la conversación.
-        8. LONGITUD: Sé completa y útil, pero concisa. Máximo 3-4 párrafos cortos por respuesta.
-        """
-        
-        # Pass the history from session state
-        return call_openrouter(prompt, system_context=full_context, messages=st.session_state.messages)
-    except Exception as e:
-        return f"Lo siento, amiguito, mi ubre se enredó (Error: {str(e)[:50]}). 🐮"
 
-if "messages" not in st.session_state:
-    st.session_state.messages = []
+# --- SIDEBAR (CONFIG & CART) ---
+with st.sidebar:
+    # --- VISUALS ---
+    st.title("🐮 Menú y Pedidos")
+    
+    # Check for developer mode via URL query parameter (?dev=true)
+    is_dev = st.query_params.get("dev", "false").lower() == "true"
+
+    render_cart()
 
-# Display chat messages from history on app rerun
-for message in st.session_state.messages:
-    with st.sidebar.chat_message(message["role"]):
-        st.markdown(message["content"])
+    if is_dev:
+        render_dev_panel()
 
-# React to user input
-if prompt := st.sidebar.chat_input("¿Qué me recomiendas?"):
-    st.sidebar.chat_message("user").markdown(prompt)
-    st.session_state.messages.append({"role": "user", "content": prompt})
+# --- AI ASSISTANT (CHATBOT) ---
+# How often the chat polls a reply that is still being generated
+CHAT_POLL_SECONDS = 0.3
+# When a poll finds nothing new, it waits this long for a flush about to land
+# before repainting the same text. The wait blocks the script thread, so a
+# click in this session can wait this long too: keep it a small fraction of
+# CHAT_POLL_SECONDS
+CHAT_IDLE_WAIT = 0.05
+# If a model hasn't started answering after this many seconds, start the next
+# fallback model in parallel; the first one to stream wins (max 2 in flight).
+CHAT_HEDGE_DELAY = 4.0
+CHAT_MAX_IN_FLIGHT = 2
+# User turns used to pick the knowledge chunks for a reply
+CHAT_RETRIEVAL_TURNS = 2
+# OPENROUTER_ASYNC=1 streams replies on one shared asyncio loop (openrouter_async.py)
+# instead of one blocking requests stream per reply
+if os.getenv("OPENROUTER_ASYNC") == "1":
+    from openrouter_async import call_openrouter_on_loop as chat_client
+else:
+    chat_client = call_openrouter
+
+
+def call_openrouter_assistant(prompt, history, session_id=None):
+    """Runs in the reply worker thread: it must not touch st.session_state."""
+    try:
+        # Preguntas frecuentes (precios, alérgenos, maridajes, ubicación): respuesta local instantánea
+        answerer = get_answerer(catalog)
+        local = answerer.answer(prompt)
+        if local:
+            return local
+
+        # Remote answers to a first question don't depend on the conversation, so they're cached
+        first_turn = sum(1 for m in history if m["role"] == "user") == 1
+        cache = get_response_cache()
+        cache_key = cache.key(prompt, catalog.version)
+        if first_turn:
+            cached = cache.get(cache_key)
+            if cached:
+                return cached
+
+        # Contexto del negocio para la IA - Índice construido una vez por versión del menú;
+        # cada pregunta recibe solo los fragmentos relevantes (más la anterior, para "¿y ese?")
+        system_prompt = get_system_prompt(catalog)
+        recent_questions = [m["content"] for m in history if m["role"] == "user"][-CHAT_RETRIEVAL_TURNS:]
+        system_parts = system_prompt.parts_for(" ".join(recent_questions) or prompt)
+
+        # History is a snapshot (summary + recent turns) taken before the worker started
+        response = chat_client(prompt, system_context=system_parts, messages=history, cache_system=True,
+                             hedge_delay=CHAT_HEDGE_DELAY, max_in_flight=CHAT_MAX_IN_FLIGHT,
+                             session_id=session_id, fit_messages=fit_to_context,
+                             # answer() already passed on this prompt: when no model can take it, fall back
+                             # to a cached near-duplicate or the catalog rather than "busy"
+                             local_answer=lambda _prompt, _messages: answerer.fallback(prompt, cache))
+        if first_turn and not isinstance(response, str):
+            return cache.caching(cache_key, response)
+        return response
+    except Exception as e:
+        return f"Lo siento, amiguito, mi ubre se enredó (Error: {str(e)[:50]}). 🐮"
 
-    with st.sidebar.chat_message("assistant"):
-        response = call_openrouter_assistant(prompt)
-        if hasattr(response, '__iter__') and not isinstance(response, str):
-            # It's a streaming generator
-            full_response = st.write_stream(response)
+if "chat_history" not in st.session_state:
+    st.session_state.chat_history = ChatHistory()
+
+def clear_chat():
+    st.session_state.chat_history.clear()
+    reply = st.session_state.pop("pending_reply", None)
+    if reply is not None and not reply.done:
+        # Stop it so it frees the session's admission slot; the next reply waits for that
+        reply.cancel()
+        st.session_state.cancelled_reply = reply
+    st.session_state.pop("reply_painted", None)
+
+
+@st.fragment(run_every=CHAT_POLL_SECONDS)
+def render_pending_reply():
+    # Paints the worker's buffer while La Vaquita is answering; the model call
+    # itself never blocks a script run.
+    reply = st.session_state.get("pending_reply")
+    if reply is None:
+        return
+    # A fragment run that doesn't redraw the message erases it, so a poll can't
+    # skip an unchanged buffer; it gives the worker's next flush a brief chance
+    # to land instead, without holding up the rest of the page
+    if reply.version == st.session_state.get("reply_painted"):
+        reply.wait_for_update(reply.version, CHAT_IDLE_WAIT)
+    text, st.session_state.reply_painted = reply.snapshot()
+    with st.chat_message("assistant"):
+        if text:
+            st.markdown(text if reply.done else text + " ▌")
         else:
-            # It's a plain string (error message)
-            st.markdown(response)
-            full_response = response
-    st.session_state.messages.append({"role": "assistant", "content": full_response})
-
-if st.sidebar.button("Borrar Chat", key="clear_chat"):
-    st.session_state.messages = []
-    st.rerun()
+            st.caption("🐮 La Vaquita está pensando...")
+    if reply.done:
+        st.session_state.chat_history.append("assistant", reply.text())
+        del st.session_state.pending_reply
+        st.session_state.pop("reply_painted", None)
+        # Full rerun so the chat redraws with the new message and this poller stops
+        st.rerun()
+
+
+@st.fragment(key="chat")
+def render_chat():
+    st.markdown("---")
+    st.subheader("🐮 Chat con la Vaquita (IA)")
+    st.caption("¡Pregúntame sobre el menú o sobre Sevilla!")
+
+    # Display chat messages from history on app rerun
+    for message in st.session_state.chat_history.messages:
+        with st.chat_message(message["role"]):
+            st.markdown(message["content"])
+
+    # React to user input (disabled while a reply is still on its way)
+    pending = "pending_reply" in st.session_state
+    if prompt := st.chat_input("¿Qué me recomiendas?", disabled=pending):
+        st.chat_message("user").markdown(prompt)
+        st.session_state.chat_history.append("user", prompt)
+        history = st.session_state.chat_history.payload()
+        session_id = st.session_state.session_id
+        st.session_state.pending_reply = BackgroundReply(lambda: call_openrouter_assistant(prompt, history, session_id),
+                                                         after=st.session_state.pop("cancelled_reply", None))
+        pending = True
+
+    if pending:
+        render_pending_reply()
+
+    st.button("Borrar Chat", key="clear_chat", on_click=clear_chat)
 
 st.write("---")
 
@@ -449,7 +371,7 @@ with col_title:
 
 with col_logo:
     try:
-        st.image("logo.png", width=220)
+        st.markdown(picture_html("logo.png", "logo", alt="Kumis del Balcón", style="width: 220px; max-width: 100%;"), unsafe_allow_html=True)
     except:
         st.markdown("# 🐮")
 
@@ -465,36 +387,64 @@ st.markdown("""
 # --- RENDER MENU ---
 st.markdown("<h2 style='text-align: center; color: #2c3e50;'>Nuestra Carta</h2>", unsafe_allow_html=True)
 
-tabs = st.tabs(list(menu_categories.keys()))
-
-for tab, (category, items) in zip(tabs, menu_categories.items()):
-    with tab:
-        st.markdown(f"<h3 class='category-title'>{category}</h3>", unsafe_allow_html=True)
+@st.fragment
+def render_product_card(category, i, item):
+    with st.container(border=True):
+        # Image handling
+        if item["img"]:
+            try:
+                # Resized card variant, fetched by the browser from its static URL
+                st.markdown(picture_html(item["img"], "card", alt=item["name"], style="width: 100%; border-radius: 8px;"), unsafe_allow_html=True)
+            except:
+                st.markdown(f"<div style='height: 150px; background: #eee; display: flex; align-items: center; justify-content: center; font-size: 3rem;'>🍽️</div>", unsafe_allow_html=True)
+        else:
+            st.markdown(f"<div style='height: 150px; background: #f0f0f0; display: flex; align-items: center; justify-content: center; font-size: 4rem;'>🍽️</div>", unsafe_allow_html=True)
         
-        # Grid layout for items
-        cols = st.columns(3)
-        for i, item in enumerate(items):
-            col = cols[i % 3]
-            with col:
-                with st.container(border=True):
-                    # Image handling
-                    if item["img"]:
-                        try:
-                            # Use Image.open to handle local files safely
-                            st.image(item["img"], width='stretch')
-                        except:
-                            st.markdown(f"<div style='height: 150px; background: #eee; display: flex; align-items: center; justify-content: center; font-size: 3rem;'>🍽️</div>", unsafe_allow_html=True)
-                    else:
-                        st.markdown(f"<div style='height: 150px; background: #f0f0f0; display: flex; align-items: center; justify-content: center; font-size: 4rem;'>🍽️</div>", unsafe_allow_html=True)
-                    
-                    st.markdown(f"#### {item['name']}")
-                    st.markdown(f"_{item['desc']}_")
-                    st.markdown(f"**${item['price']:,}**")
-                    
-                    if st.button(f"Agregar al Carrito", key=f"btn_{category}_{i}"):
-                        st.session_state.cart.append(item)
-                        st.toast(f"✅ ¡{item['name']} agregado!")
-                        st.rerun()
+        st.markdown(f"#### {item['name']}")
+        st.markdown(f"_{item['desc']}_")
+        st.markdown(f"**${item['price']:,}**")
+        
+        # Only the cart fragment reruns after the click (see add_to_cart)
+        st.button(f"Agregar al Carrito", key=f"btn_{item['sku']}", on_click=add_to_cart, args=(item,))
+
+
+# Warm the browser cache with the next category's images while the customer
+# is looking at the current one, so switching tabs feels instant.
+PREFETCH_NEXT_CATEGORY = True
+
+
+@st.fragment(key="menu")
+def render_menu():
+    # Only the open tab is rendered (and only its images are fetched); switching
+    # tabs reruns this fragment alone, so first paint doesn't grow with the menu.
+    categories = list(menu_categories.keys())
+    tabs = st.tabs(categories, on_change="rerun", key="menu_tab")
+
+    for idx, (tab, (category, items)) in enumerate(zip(tabs, menu_categories.items())):
+        if not tab.open:
+            continue
+        with tab:
+            st.markdown(f"<h3 class='category-title'>{category}</h3>", unsafe_allow_html=True)
+            
+            # Grid layout for items
+            cols = st.columns(3)
+            for i, item in enumerate(items):
+                with cols[i % 3]:
+                    render_product_card(category, i, item)
+
+            if PREFETCH_NEXT_CATEGORY and len(categories) > 1:
+                next_items = menu_categories[categories[(idx + 1) % len(categories)]]
+                links = ""
+                for item in next_items:
+                    try:
+                        links += f'<link rel="prefetch" as="image" type="image/avif" href="{static_url(item["img"], "card", "avif")}">'
+                    except Exception:
+                        pass
+                if links:
+                    st.markdown(links, unsafe_allow_html=True)
+
+
+render_menu()
 
 st.write("")
 st.write("---")
@@ -508,21 +458,21 @@ st.write("Ven a conocer nuestro hermoso municipio, famoso por sus balcones, su g
 c1, c2, c3 = st.columns(3)
 with c1:
     try:
-        st.image("sevilla_plaza.png", width='stretch')
+        st.markdown(picture_html("sevilla_plaza.png", "sevilla", alt="Basílica San Luis Gonzaga"), unsafe_allow_html=True)
     except:
         st.write("📷")
     st.markdown("🏰 **Basílica San Luis Gonzaga**")
     st.write("Una joya arquitectónica en el corazón del parque principal.")
 with c2:
     try:
-        st.image("sevilla_paisaje.png", width='stretch')
+        st.markdown(picture_html("sevilla_paisaje.png", "sevilla", alt="Paisaje Cultural Cafetero"), unsafe_allow_html=True)
     except:
         st.write("📷")
     st.markdown("☕ **Paisaje Cultural Cafetero**")
     st.write("Patrimonio de la humanidad. Vistas inigualables.")
 with c3:
     try:
-        st.image("logo.png", width='stretch') # Reuse logo or another img
+        st.markdown(picture_html("logo.png", "sevilla", alt="Festival de la Bandola"), unsafe_allow_html=True) # Reuse logo or another img
     except:
         st.write("📷")
     st.markdown("🎉 **Festival de la Bandola**")
@@ -547,3 +497,7 @@ st.markdown("""
     <small>© 2026 Kumis del Balcón. Hecho con ❤️ en Colombia.</small>
 </div>
 """, unsafe_allow_html=True)
+
+# --- CHAT (LAST, SO THE STOREFRONT PAINTS FIRST) ---
+with st.sidebar:
+    render_chat()
@@ -0,0 +1,239 @@
+"""
+Incremental Server-Sent Events decoder for OpenRouter streams.
+
+SSEDecoder takes raw byte chunks as they arrive from the socket (split
+anywhere, even mid-line or mid-UTF-8 character) and returns complete events.
+It handles multi-line `data:` fields, CRLF line endings and `:` comment
+keep-alives (OpenRouter sends ": OPENROUTER PROCESSING" while a model warms
+up), which are counted but never JSON-parsed.
+
+iter_events() turns the raw events into typed ones:
+- Delta(text): a content delta;
+- Usage(prompt_tokens, completion_tokens, total_tokens): token accounting,
+  usually in the last frame;
+- Finish(reason): "stop", "length", "content_filter", ...;
+- StreamError(message, code): an error the provider sent mid-stream, or a
+  frame that isn't valid JSON;
+and records timings in a StreamStats.
+
+The cost per frame is one JSON decode, as with the old line-by-line parser.
+"""
+import collections
+import json
+import time
+
+Delta = collections.namedtuple("Delta", "text")
+Usage = collections.namedtuple("Usage", "prompt_tokens completion_tokens total_tokens")
+Finish = collections.namedtuple("Finish", "reason")
+StreamError = collections.namedtuple("StreamError", "message code")
+
+
+class SSEDecoder:
+    """Byte chunks in, (event, data bytes) pairs out; keeps partial lines between feeds."""
+
+    def __init__(self):
+        self._pending = []   # Bytes of the unfinished line, one part per feed
+        self._data = []
+        self._event = "message"
+        self.comments = 0
+
+    def feed(self, chunk):
+        """Returns the events completed by `chunk`."""
+        if b"\n" not in chunk and b"\r" not in chunk:
+            # No line ends here (small socket reads): keep the bytes, join them once a line ends
+            if chunk:
+                self._pending.append(chunk)
+            return ()
+        if self._pending:
+            self._pending.append(chunk)
+            buffer = b"".join(self._pending)
+            self._pending.clear()
+        else:
+            buffer = chunk
+        if b"\r" in buffer:
+            # A trailing \r may be the first half of \r\n: keep it for the next feed
+            tail = b"\r" if buffer.endswith(b"\r") else b""
+            buffer = buffer[:len(buffer) - len(tail)].replace(b"\r\n", b"\n").replace(b"\r", b"\n") + tail
+        lines = buffer.split(b"\n")
+        rest = lines.pop()
+        if rest:
+            self._pending.append(rest)
+        events = []
+        data = self._data
+        for line in lines:
+            # Fast path: almost every line of an OpenRouter stream is "data: {...}" or blank
+            if line[:6] == b"data: ":
+                data.append(line[6:])
+            elif not line:
+                if data:
+                    events.append((self._event, data[0] if len(data) == 1 else b"\n".join(data)))
+                    data.clear()
+                self._event = "message"
+            else:
+                self._field(line)
+        return events
+
+    def flush(self):
+        """Events left when the stream ends without a final blank line."""
+        tail = b"".join(self._pending).rstrip(b"\r")
+        self._pending.clear()
+        events = self.feed(tail + b"\n\n") if tail or self._data else []
+        self._pending.clear()
+        return events
+
+    def _field(self, line):
+        if line[0] == 0x3A:  # ":" comment / keep-alive
+            self.comments += 1
+            return
+        field, sep, value = line.partition(b":")
+        if sep and value[:1] == b" ":
+            value = value[1:]
+        if field == b"data":
+            self._data.append(value)
+        elif field == b"event":
+            self._event = value.decode("utf-8", errors="replace")
+        # id: and retry: mean nothing for a one-shot completion stream
+
+
+class StreamStats:
+    """Timings and accounting of one stream (clock: time.monotonic)."""
+
+    def __init__(self, started=None):
+        self.started = started if started is not None else time.monotonic()
+        # When the response headers arrived
+        self.connected = None
+        self.chunk_times = []
+        self.chars = 0
+        self.usage = None
+        self.finish_reason = None
+        self.errors = []
+        self.keepalives = 0
+
+    def record(self, event, clock=time.monotonic):
+        kind = type(event)
+        if kind is Delta:
+            self.chunk_times.append(clock())
+            self.chars += len(event.text)
+        elif kind is Usage:
+            self.usage = event
+        elif kind is Finish:
+            self.finish_reason = event.reason
+        else:
+            self.errors.append(event)
+
+    @property
+    def ttft(self):
+        """Seconds to the first content delta (None before it)."""
+        return self.chunk_times[0] - self.started if self.chunk_times else None
+
+    @property
+    def duration(self):
+        return self.chunk_times[-1] - self.started if self.chunk_times else None
+
+    def gaps(self):
+        """Seconds between consecutive content deltas."""
+        return [later - earlier for earlier, later in zip(self.chunk_times, self.chunk_times[1:])]
+
+    def to_dict(self):
+        return {
+            "connect": self.connected - self.started if self.connected else None,
+            "ttft": self.ttft,
+            "duration": self.duration,
+            "chunks": len(self.chunk_times),
+            "chars": self.chars,
+            "usage": self.usage._asdict() if self.usage else None,
+            "finish_reason": self.finish_reason,
+            "errors": [error._asdict() for error in self.errors],
+            "keepalives": self.keepalives,
+        }
+
+
+# JSONDecoder.raw_decode on a str skips json.loads' encoding sniffing and
+# whitespace regexes: a measurable share of the per-frame cost
+_raw_decode = json.JSONDecoder().raw_decode
+
+
+def parse_frame(data):
+    """Typed events in one OpenRouter `data:` payload (bytes or str)."""
+    text = data.decode("utf-8", errors="replace") if isinstance(data, bytes) else data
+    try:
+        frame, end = _raw_decode(text)
+        if end != len(text) and text[end:].strip():
+            raise ValueError("trailing data")
+    except ValueError:
+        return [StreamError(f"JSON inválido en el stream: {text[:60]}", "malformed")]
+    try:
+        # Fast path: a plain content delta, by far the most common frame
+        choice = frame["choices"][0]
+        content = choice["delta"]["content"]
+        if content and not choice.get("finish_reason") and "usage" not in frame and "error" not in frame:
+            return [Delta(content)]
+    except (KeyError, IndexError, TypeError):
+        pass
+    if not isinstance(frame, dict):
+        return [StreamError("Frame inesperado en el stream.", "malformed")]
+    events = []
+    error = frame.get("error")
+    if error:
+        if isinstance(error, dict):
+            events.append(StreamError(str(error.get("message", error))[:200], error.get("code")))
+        else:
+            events.append(StreamError(str(error)[:200], None))
+    for choice in frame.get("choices") or ():
+        content = (choice.get("delta") or {}).get("content")
+        if content:
+            events.append(Delta(content))
+        if choice.get("finish_reason"):
+            events.append(Finish(choice["finish_reason"]))
+        break  # Only the first choice is used
+    usage = frame.get("usage")
+    if usage:
+        events.append(Usage(usage.get("prompt_tokens"), usage.get("completion_tokens"), usage.get("total_tokens")))
+    return events
+
+
+def iter_events(byte_chunks, stats=None, clock=time.monotonic):
+    """
+    Typed events from an iterable of raw byte chunks, until [DONE] or the end
+    of the input. Fills `stats` (a StreamStats) as it goes.
+    """
+    stats = stats if stats is not None else StreamStats(clock())
+    decoder = SSEDecoder()
+    try:
+        for chunk in byte_chunks:
+            for _event, data in decoder.feed(chunk):
+                if data == b"[DONE]":
+                    return
+                for event in parse_frame(data):
+                    stats.record(event, clock)
+                    yield event
+        for _event, data in decoder.flush():
+            if data == b"[DONE]":
+                return
+            for event in parse_frame(data):
+                stats.record(event, clock)
+                yield event
+    finally:
+        stats.keepalives = decoder.comments
+
+
+async def aiter_events(byte_chunks, stats=None, clock=time.monotonic):
+    """iter_events for an async iterable of byte chunks."""
+    stats = stats if stats is not None else StreamStats(clock())
+    decoder = SSEDecoder()
+    try:
+        async for chunk in byte_chunks:
+            for _event, data in decoder.feed(chunk):
+                if data == b"[DONE]":
+                    return
+                for event in parse_frame(data):
+                    stats.record(event, clock)
+                    yield event
+        for _event, data in decoder.flush():
+            if data == b"[DONE]":
+                return
+            for event in parse_frame(data):
+                stats.record(event, clock)
+                yield event
+    finally:
+        stats.keepalives = decoder.comments
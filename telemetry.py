@@ -0,0 +1,208 @@
+"""
+Telemetry for LLM calls.
+
+utils.call_openrouter (and the async client) open a CallTrace per call and
+record every attempt: model, outcome or error class, connect time and
+time-to-first-token. When the call ends (the stream is closed, or a local /
+busy / error answer is returned) the finished record goes to every
+listener:
+- the process-wide Telemetry keeps the last WINDOW_SIZE records for the dev
+  panel (`?dev=true`) and computes rolling percentiles;
+- set LLM_METRICS_FILE (env var) to also append each record as one JSON line
+  for offline analysis.
+"""
+import collections
+import json
+import os
+import threading
+import time
+import uuid
+
+# Records kept in memory for the rolling percentiles
+WINDOW_SIZE = 500
+
+
+class CallTrace:
+    """Collects what happens during one call; finish() publishes it once."""
+
+    def __init__(self, telemetry, requested_model, session_id=None, client="sync"):
+        self._telemetry = telemetry
+        self._lock = threading.Lock()
+        self._finished = False
+        self.started = time.monotonic()
+        self.record = {
+            "id": uuid.uuid4().hex[:12],
+            "ts": time.time(),
+            "client": client,
+            "session": session_id,
+            "requested_model": requested_model,
+            "model": None,
+            "outcome": None,
+            "attempts": [],
+            "queue_wait": None,
+            "connect": None,
+            "ttft": None,
+            "latency": None,
+            "chars": 0,
+            "completion_tokens": None,
+            "tokens_per_s": None,
+            "finish_reason": None,
+            "error": None,
+        }
+
+    def admitted(self):
+        """Marks the end of the admission-control wait."""
+        self.record["queue_wait"] = round(time.monotonic() - self.started, 4)
+
+    def attempt(self, model, kind, started, connected=None, cancelled=False):
+        """One model attempt; `kind` is "ok" or the ModelCallError kind."""
+        now = time.monotonic()
+        with self._lock:
+            if self._finished:
+                return  # A hedging loser that outlived the call: the record is already out
+            self.record["attempts"].append({
+                "model": model,
+                "kind": "cancelled" if cancelled else kind,
+                "elapsed": round(now - started, 4),
+                "connect": round(connected - started, 4) if connected else None,
+            })
+
+    def finish_stream(self, stream):
+        """The winning stream was closed: compute latency, TTFT and throughput."""
+        stats = stream.stats
+        record = self.record
+        record["outcome"] = "stream"
+        record["model"] = stream.model
+        if stats is not None:
+            if stats.connected:
+                record["connect"] = round(stats.connected - stats.started, 4)
+            if stats.chunk_times:
+                record["ttft"] = round(stats.chunk_times[0] - self.started, 4)
+                streaming = stats.chunk_times[-1] - stats.chunk_times[0]
+                tokens = stats.usage.completion_tokens if stats.usage and stats.usage.completion_tokens else None
+                record["completion_tokens"] = tokens
+                if streaming > 0:
+                    # Without a usage frame, ~4 characters per token
+                    record["tokens_per_s"] = round((tokens or stats.chars / 4) / streaming, 2)
+            record["chars"] = stats.chars
+            record["finish_reason"] = stats.finish_reason
+            if stats.errors:
+                record["error"] = stats.errors[-1].message
+        self._finish()
+
+    def finish(self, outcome, error=None):
+        """The call ended without a stream: "local", "busy", "error" or "no_key"."""
+        self.record["outcome"] = outcome
+        self.record["error"] = error
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            if self._finished:
+                return
+            self._finished = True
+        self.record["latency"] = round(time.monotonic() - self.started, 4)
+        self._telemetry.publish(self.record)
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of `values` (q in 0..100); None if empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, min(len(ordered), round(q / 100 * len(ordered) + 0.5)))
+    return ordered[rank - 1]
+
+
+class JsonlSink:
+    """Listener that appends each record to a JSON Lines file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+            except OSError:
+                pass
+
+
+class Telemetry:
+    """Rolling window of call records plus the listeners they are sent to."""
+
+    def __init__(self, window=WINDOW_SIZE):
+        self._records = collections.deque(maxlen=window)
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def start_call(self, requested_model, session_id=None, client="sync"):
+        return CallTrace(self, requested_model, session_id, client)
+
+    def add_listener(self, listener):
+        """`listener(record)` is called for every finished call, on the caller's thread."""
+        with self._lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def publish(self, record):
+        with self._lock:
+            self._records.append(record)
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(record)
+            except Exception:
+                pass  # Telemetry must never break a call
+
+    def records(self):
+        with self._lock:
+            return list(self._records)
+
+    def summary(self):
+        """Percentiles and counters over the current window, for the dev panel."""
+        records = self.records()
+        streams = [r for r in records if r["outcome"] == "stream"]
+
+        def pcts(name):
+            values = [r[name] for r in streams if r[name] is not None]
+            return {"p50": percentile(values, 50), "p90": percentile(values, 90), "p99": percentile(values, 99)}
+
+        attempts = [a for r in records for a in r["attempts"]]
+        return {
+            "calls": len(records),
+            "outcomes": dict(collections.Counter(r["outcome"] for r in records)),
+            "ttft": pcts("ttft"),
+            "latency": pcts("latency"),
+            "connect": pcts("connect"),
+            "tokens_per_s": pcts("tokens_per_s"),
+            "queue_wait": pcts("queue_wait"),
+            "attempts_per_call": (len(attempts) / len(records)) if records else None,
+            "winners": dict(collections.Counter(r["model"] for r in streams)),
+            "errors": dict(collections.Counter(a["kind"] for a in attempts if a["kind"] not in ("ok", "cancelled"))),
+        }
+
+
+_telemetry = None
+_telemetry_lock = threading.Lock()
+
+
+def get_telemetry():
+    """Returns the process-wide Telemetry (with a JSONL sink if LLM_METRICS_FILE is set)."""
+    global _telemetry
+    if _telemetry is None:
+        with _telemetry_lock:
+            if _telemetry is None:
+                telemetry = Telemetry()
+                path = os.getenv("LLM_METRICS_FILE")
+                if path:
+                    telemetry.add_listener(JsonlSink(path))
+                _telemetry = telemetry
+    return _telemetry
@@ -1,11 +1,21 @@
 import sys
+import time
 from utils import call_openrouter
 
 def test_call(model):
     print(f"\nTesting: {model}")
     try:
+        start = time.perf_counter()
         response = call_openrouter("Dime 'hola'", model=model)
-        print(f"Response: {response}")
+        stats = None
+        if not isinstance(response, str):
+            # Streaming generator: consume it so the pooled connection is released
+            stats = response.stats
+            response = "".join(response)
+        # Calls after the first reuse the pooled connection (no new TLS handshake)
+        print(f"Response ({time.perf_counter() - start:.2f}s): {response}")
+        if stats is not None:
+            print(f"TTFT {stats.ttft:.2f}s, finish: {stats.finish_reason}, usage: {stats.usage}")
     except Exception as e:
         print(f"Exception: {e}")
 
@@ -0,0 +1,65 @@
+import threading
+import time
+
+from chat_worker import BackgroundReply
+from llm_limits import AdmissionController, LLMBusy
+from utils import OpenRouterStream
+
+
+def _streaming_call(admission, session_id, started=None):
+    """Stands in for call_openrouter: takes the session's slot, gives it back when the stream closes."""
+    def produce():
+        admission.acquire(session_id, timeout=1)
+
+        def chunks():
+            for i in range(1000):
+                time.sleep(0.01)
+                yield f"delta {i} "
+
+        if started is not None:
+            started.set()
+        return OpenRouterStream("mock", "Hola ", chunks(), on_close=lambda: admission.release(session_id))
+    return produce
+
+
+def test_clear_then_ask_gets_the_slot():
+    admission = AdmissionController(per_session=1)
+    started = threading.Event()
+    first = BackgroundReply(_streaming_call(admission, "tab", started))
+    assert started.wait(2)
+    time.sleep(0.05)
+    assert not first.done
+
+    # "Borrar chat" while it streams, then a new question
+    first.cancel()
+    second = BackgroundReply(lambda: (admission.acquire("tab", timeout=1), "respuesta")[1], after=first)
+    assert second.wait(5)
+    assert second.error is None
+    assert second.text() == "respuesta"
+    assert first.done
+    admission.release("tab")
+
+
+def test_cancelled_stream_frees_the_slot():
+    admission = AdmissionController(per_session=1)
+    started = threading.Event()
+    reply = BackgroundReply(_streaming_call(admission, "tab", started))
+    assert started.wait(2)
+    try:
+        admission.acquire("tab", timeout=0.1)
+        raise AssertionError("the streaming reply should hold the slot")
+    except LLMBusy:
+        pass
+    reply.cancel()
+    assert reply.wait(2)
+    admission.acquire("tab", timeout=0.1)
+    admission.release("tab")
+
+
+def test_cancel_before_start_skips_the_call():
+    calls = []
+    blocker = BackgroundReply(lambda: time.sleep(0.1) or "primero")
+    reply = BackgroundReply(lambda: calls.append(1) or "no", after=blocker)
+    reply.cancel()
+    assert reply.wait(2)
+    assert calls == [] and reply.text() == ""
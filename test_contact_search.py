@@ -0,0 +1,39 @@
+import pandas as pd
+
+from contact_search import ContactIndex
+
+
+def _frame():
+    return pd.DataFrame({
+        "Name": ["Ana Mas", "Luis Cuesta", "Juan Pérez", "Sin Nombre"],
+        "Company": ["Kumis del Balcón", "Uno SAS", "Acme", "Yo Ltda"],
+        "Email": ["ana@mas.co", "luis@uno.co", "juan@acme.co", "contacto@yo.co"],
+        "Phone": ["310 123 4567", "", "(602) 555-0101", None],
+    })
+
+
+def _names(index, query):
+    positions, total = index.search(query)
+    return [_frame()["Name"][position] for position in positions], total
+
+
+def test_stopword_names_are_searchable():
+    index = ContactIndex(_frame())
+    assert _names(index, "mas") == (["Ana Mas"], 1)
+    assert _names(index, "Cuesta") == (["Luis Cuesta"], 1)
+    assert _names(index, "uno") == (["Luis Cuesta"], 1)
+    assert _names(index, "sin") == (["Sin Nombre"], 1)
+
+
+def test_stopword_query_does_not_match_everything():
+    index = ContactIndex(_frame())
+    names, total = _names(index, "yo")
+    assert total == 1 and names == ["Sin Nombre"]
+    assert _names(index, "vale") == ([], 0)
+
+
+def test_accents_and_phone_digits():
+    index = ContactIndex(_frame())
+    assert _names(index, "balcon")[0] == ["Ana Mas"]
+    assert _names(index, "perez")[0] == ["Juan Pérez"]
+    assert _names(index, "5550101")[0] == ["Juan Pérez"]
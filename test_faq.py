@@ -0,0 +1,39 @@
+import pytest
+
+from catalog import load_catalog
+from faq import SHOP_ADDRESS, SHOP_PHONE, LocalAnswerer
+
+
+@pytest.fixture(scope="module")
+def answerer():
+    return LocalAnswerer(load_catalog())
+
+
+@pytest.mark.parametrize("question", [
+    "¿De dónde viene el nombre de Sevilla?",
+    "¿Dónde queda el Mirador El Morro?",
+    "¿Dónde nació la bandola?",
+    "¿Cuál es el número de la basílica?",
+    "¿cuanto vale un domicilio?",
+])
+def test_location_and_contact_words_alone_go_to_the_model(answerer, question):
+    assert answerer.answer(question) is None
+
+
+@pytest.mark.parametrize("question", [
+    "¿Dónde quedan?",
+    "¿Dónde queda la tienda?",
+    "¿Dónde queda Kumis del Balcón?",
+    "¿Cuál es la dirección?",
+])
+def test_shop_location(answerer, question):
+    assert SHOP_ADDRESS in answerer.answer(question)
+
+
+@pytest.mark.parametrize("question", [
+    "¿Cuál es el teléfono de ustedes?",
+    "Teléfono",
+    "¿Hacen domicilios?",
+])
+def test_shop_contact(answerer, question):
+    assert SHOP_PHONE in answerer.answer(question)
@@ -2,11 +2,37 @@ import requests
 import json
 import streamlit as st
 import os
+import queue
+import threading
+import time
+from http.cookiejar import DefaultCookiePolicy
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
+from model_health import get_registry
+from llm_limits import LLMBusy, get_admission
+from sse import Delta, StreamError, StreamStats, iter_events
+from telemetry import get_telemetry
 
 # Load environment variables if available
 load_dotenv()
 
+# OPENROUTER_BASE_URL points the client elsewhere, e.g. at benchmarks/mock_openrouter.py
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1").rstrip("/")
+OPENROUTER_URL = f"{OPENROUTER_BASE_URL}/chat/completions"
+
+# Split timeouts: fail fast if openrouter.ai is unreachable, but give slow
+# free-tier models time to start streaming.
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+
+# Keep-alive pool shared by every session and thread in the process.
+# POOL_MAXSIZE bounds concurrent connections to openrouter.ai.
+POOL_CONNECTIONS = 2
+POOL_MAXSIZE = 16
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
 def get_api_key():
     """Retrieves the OpenRouter API key from Streamlit secrets or environment variables."""
     try:
@@ -16,96 +42,407 @@ def get_api_key():
         pass
     return os.getenv("OPENROUTER_API_KEY", "")
 
-def call_openrouter(prompt=None, system_context="", model="google/gemini-2.0-flash-lite-preview-02-05:free", manual_api_key="", messages=None):
+def get_http_session():
     """
-    Calls the OpenRouter API with fallback logic and message history support.
-    - Uses free-tier model IDs with the correct :free suffix.
-    - Falls back through multiple models if the primary fails.
-    - Timeout set to 30s to handle slow free-tier responses.
+    Returns the process-wide requests.Session used for OpenRouter calls.
+    - Reuses TCP/TLS connections across chat turns and fallback attempts.
+    - Never stores cookies, so sharing it between user sessions leaks nothing.
     """
-    api_key = manual_api_key if manual_api_key else get_api_key()
-    
-    if not api_key:
-        return "⚠️ Error: API Key no configurada. Por favor, revisa st.secrets o tu archivo .env."
-
-    # Free-tier models confirmed working on OpenRouter (tested 2026-03-01).
-    # Order matters: best quality first, lightest models last as final fallbacks.
-    fallback_models = [
-        "mistralai/mistral-small-3.1-24b-instruct:free",  # Best quality (may hit 429 under load)
-        "meta-llama/llama-3.2-3b-instruct:free",          # Widely available
-        "google/gemma-3-e4b-it:free",                     # Updated Gemini-family model
-        "cognitivecomputations/dolphin3.0-r1-mistral-24b:free", 
-        "liquid/lfm-2.5-1.2b-instruct:free",               # Fast lightweight fallback ✅
-        "nvidia/nemotron-nano-9b-v2:free",                  # Final fallback ✅
-    ]
-
-    # Build the final ordered list: requested model first, then fallbacks (no duplicates)
-    models = [model] + [m for m in fallback_models if m != model]
-
-    # Build the base message payload
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=POOL_CONNECTIONS,
+                    pool_maxsize=POOL_MAXSIZE,
+                    max_retries=0,  # Retrying is the fallback list's job
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)  # Local mock server
+                session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+                session.headers.update({
+                    "HTTP-Referer": "https://kumis-del-balcon.streamlit.app",
+                    "X-Title": "Kumis del Balcon",
+                    "Content-Type": "application/json",
+                })
+                _http_session = session
+    return _http_session
+
+# Free-tier models confirmed working on OpenRouter (tested 2026-03-01).
+# Order matters: best quality first, lightest models last as final fallbacks.
+FALLBACK_MODELS = [
+    "mistralai/mistral-small-3.1-24b-instruct:free",  # Best quality (may hit 429 under load)
+    "meta-llama/llama-3.2-3b-instruct:free",          # Widely available
+    "google/gemma-3-e4b-it:free",                     # Updated Gemini-family model
+    "cognitivecomputations/dolphin3.0-r1-mistral-24b:free", 
+    "liquid/lfm-2.5-1.2b-instruct:free",               # Fast lightweight fallback ✅
+    "nvidia/nemotron-nano-9b-v2:free",                  # Final fallback ✅
+]
+
+# Hedged mode: never more than this many requests in flight for one call
+MAX_IN_FLIGHT = 3
+
+API_KEY_MESSAGE = "⚠️ Error: API Key no configurada. Por favor, revisa st.secrets o tu archivo .env."
+BUSY_MESSAGE = "Muuu... ¡hay mucha gente preguntándome al mismo tiempo! 🐮 Dame unos segunditos y vuelve a intentarlo."
+
+
+class ModelCallError(Exception):
+    """
+    One model attempt failed; the message is user-facing (Spanish).
+    `kind` is the error class recorded in the health registry:
+    rate_limit, payment, timeout, http, empty, provider (an error sent
+    mid-stream) or network. "throttled" means our own per-model limit
+    skipped it, and is not recorded.
+    """
+
+    def __init__(self, model, message, kind="network"):
+        super().__init__(f"Modelo {model}: {message}")
+        self.model = model
+        self.kind = kind
+
+
+class OpenRouterStream:
+    """
+    Iterable of content deltas from the model that answered.
+    - `model` tells which model won (useful with fallbacks and hedging).
+    - The first token is already received when the stream is handed out.
+    - `stats` (sse.StreamStats) has the timings, token usage and finish reason,
+      complete once the stream is exhausted.
+    """
+
+    def __init__(self, model, first_chunk, chunks, on_close=None, stats=None):
+        self.model = model
+        self.stats = stats
+        self._first_chunk = first_chunk
+        self._chunks = chunks
+        self._on_close = on_close
+
+    def __iter__(self):
+        try:
+            yield self._first_chunk
+            yield from self._chunks
+        finally:
+            self.close()
+
+    def close(self):
+        """Closes the HTTP response and runs `on_close` (once)."""
+        self._chunks.close()
+        on_close, self._on_close = self._on_close, None
+        if on_close is not None:
+            on_close()
+
+    def __del__(self):
+        # An abandoned stream must still give back its admission slot
+        self.close()
+
+
+def _iter_content(response, model, stats):
+    """
+    Yields content deltas from an SSE response (see sse.py) and always closes it.
+    An error sent by the provider mid-stream raises ModelCallError; malformed
+    frames are skipped but kept in `stats.errors`.
+    """
+    try:
+        for event in iter_events(response.iter_content(chunk_size=None), stats):
+            if isinstance(event, Delta):
+                yield event.text
+            elif isinstance(event, StreamError) and event.code != "malformed":
+                raise ModelCallError(model, f"error del proveedor: {event.message[:80]}", "provider")
+    finally:
+        # Runs on completion, error or an abandoned stream
+        response.close()
+
+
+def build_payload(model, messages):
+    """Request body for one streaming attempt."""
+    return {
+        "model": model,
+        "messages": messages,
+        "temperature": 0.7,        # Conversational but focused
+        "max_tokens": 512,         # Keep responses concise
+        "stream": True,            # Empezar a mandar palabras rápido
+    }
+
+
+def status_error(model, status_code):
+    """ModelCallError for a non-200 answer."""
+    if status_code == 429:
+        return ModelCallError(model, "límite de tasa alcanzado (429).", "rate_limit")
+    elif status_code == 402:
+        return ModelCallError(model, "requiere créditos (402).", "payment")
+    return ModelCallError(model, f"Error {status_code}.", "http")
+
+
+def _open_stream(session, api_key, model, base_messages, on_response=None):
+    """
+    Makes one streaming attempt and waits for the first content token.
+    Returns an OpenRouterStream or raises ModelCallError.
+    `on_response` receives the live response so a racing caller can close it.
+    """
+    payload = build_payload(model, base_messages)
+    started = time.monotonic()
+    try:
+        response = session.post(
+            url=OPENROUTER_URL,
+            headers={"Authorization": f"Bearer {api_key}"},
+            data=json.dumps(payload),
+            timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+            stream=True, # Enable Server-Sent Events
+        )
+    except requests.exceptions.Timeout:
+        raise ModelCallError(model, "tiempo de espera agotado.", "timeout")
+    except Exception as e:
+        raise ModelCallError(model, str(e)[:80])
+
+    connected = time.monotonic()
+    if on_response is not None:
+        on_response(response)
+
+    if response.status_code != 200:
+        try:
+            # Error bodies are small: read them so the connection goes back to the pool
+            response.content
+        except Exception:
+            pass
+        response.close()
+        raise status_error(model, response.status_code)
+
+    stats = StreamStats(started)
+    stats.connected = connected
+    chunks = _iter_content(response, model, stats)
+    try:
+        first_chunk = next(chunks, None)
+    except ModelCallError:
+        raise
+    except requests.exceptions.Timeout:
+        raise ModelCallError(model, "tiempo de espera agotado.", "timeout")
+    except Exception as e:
+        raise ModelCallError(model, str(e)[:80])
+    if first_chunk is None:
+        raise ModelCallError(model, "respuesta vacía.", "empty")
+    return OpenRouterStream(model, first_chunk, chunks, stats=stats)
+
+
+def _race_models(start_attempt, models, hedge_delay, race, max_in_flight):
+    """
+    Runs attempts concurrently and returns the first stream that produces a
+    content token, or raises the last ModelCallError.
+    - Starts `race` models at once, then one more every `hedge_delay` seconds
+      (or as soon as one fails), never exceeding `max_in_flight`.
+    - Losers are cancelled by closing their responses.
+    """
+    results = queue.Queue()
+    lock = threading.Lock()
+    live_responses = {}
+    cancelled = threading.Event()
+
+    def track(model, response):
+        with lock:
+            if cancelled.is_set():
+                response.close()
+            else:
+                live_responses[model] = response
+
+    def run(model):
+        try:
+            stream = start_attempt(model, lambda response: track(model, response), cancelled.is_set)
+        except ModelCallError as e:
+            results.put((None, e))
+            return
+        with lock:
+            if not cancelled.is_set():
+                results.put((stream, None))
+                return
+        stream.close()
+
+    pending = list(models)
+    in_flight = 0
+
+    def launch():
+        nonlocal in_flight
+        model = pending.pop(0)
+        in_flight += 1
+        threading.Thread(target=run, args=(model,), name=f"openrouter-{model}", daemon=True).start()
+
+    for _ in range(min(max(race, 1), max_in_flight, len(pending))):
+        launch()
+
+    last_error = None
+    while in_flight:
+        can_hedge = pending and in_flight < max_in_flight
+        try:
+            stream, error = results.get(timeout=hedge_delay if can_hedge else None)
+        except queue.Empty:
+            launch()
+            continue
+        in_flight -= 1
+        if stream is not None:
+            with lock:
+                cancelled.set()
+                for model, response in live_responses.items():
+                    if model != stream.model:
+                        response.close()
+            # Close runners-up that finished at the same time; attempts still
+            # running will see `cancelled` and close themselves
+            while True:
+                try:
+                    other, _ = results.get_nowait()
+                except queue.Empty:
+                    break
+                if other is not None:
+                    other.close()
+            return stream
+        last_error = error
+        if pending:
+            launch()
+    raise last_error
+
+
+def build_messages(prompt, system_context, messages=None, cache_system=False):
+    """
+    The base message list: system prompt, then the history (which already
+    ends with the latest user message) or just `prompt`.
+    `system_context` may be a list of parts (stable prefix first, then
+    per-question context).
+    """
+    parts = [system_context] if isinstance(system_context, str) else [p for p in system_context if p]
+    if cache_system and parts and parts[0]:
+        # Content-part form with a cache breakpoint after the stable prefix; providers
+        # with automatic prefix caching also benefit since the prefix is byte-identical
+        system_message = {"role": "system", "content": [
+            {"type": "text", "text": parts[0], "cache_control": {"type": "ephemeral"}},
+        ] + [{"type": "text", "text": part} for part in parts[1:]]}
+    else:
+        system_message = {"role": "system", "content": "\n\n".join(parts)}
     if messages:
         # Use provided conversation history (already contains the latest user message)
-        base_messages = [{"role": "system", "content": system_context}] + messages
+        base_messages = [system_message] + messages
     else:
         # Single-turn fallback
         base_messages = [
-            {"role": "system", "content": system_context},
+            system_message,
             {"role": "user", "content": prompt or ""},
         ]
+    return base_messages
 
-    last_error = ""
-    for current_model in models:
+
+def all_failed_message(last_error):
+    return f"Muuu... tuve problemas técnicos con todos los modelos disponibles ({last_error}). Intenta de nuevo en un momento. 🐮"
+
+
+def candidate_models(model):
+    """Requested model first, then fallbacks (no duplicates), ranked by the health registry."""
+    return get_registry().order([model] + [m for m in FALLBACK_MODELS if m != model])
+
+
+def call_openrouter(prompt=None, system_context="", model="google/gemini-2.0-flash-lite-preview-02-05:free", manual_api_key="", messages=None,
+                    hedge_delay=None, race=1, max_in_flight=MAX_IN_FLIGHT, session_id=None, local_answer=None,
+                    cache_system=False, fit_messages=None):
+    """
+    Calls the OpenRouter API with fallback logic and message history support.
+    - Uses free-tier model IDs with the correct :free suffix.
+    - Falls back through multiple models if the primary fails.
+    - Reuses pooled keep-alive connections (see get_http_session).
+    - 5s to connect, 30s read timeout to handle slow free-tier responses.
+    - Hedged mode: with `hedge_delay` (seconds) the next model starts if the
+      current ones haven't produced a token in time; `race` starts the top N
+      at once. The first model to stream wins and the others are cancelled.
+    - Candidates are ranked by the health registry (model_health.py): models
+      with an open circuit are skipped, healthy fast ones go first.
+    - Admission control (llm_limits.py): calls wait in a bounded FIFO queue,
+      limited per `session_id`, per model and globally. When saturated, or
+      when every model fails, `local_answer(prompt, messages)` is tried
+      before answering "busy" or with the error message.
+    - Every call is traced (telemetry.py): attempts, error classes, connect
+      time, TTFT, tokens/s and total latency, published when it ends.
+    - `system_context` is a string or a list of parts; `cache_system=True`
+      marks the first part as a cacheable prefix, for providers that support
+      prompt caching (it must be identical across turns).
+    - `fit_messages(model, messages)`, if given, trims the payload for each
+      model tried (e.g. chat_history.fit_to_context for its context window).
+    Returns an OpenRouterStream (`.model` is the winner) or an error string.
+    """
+    trace = get_telemetry().start_call(model, session_id)
+    api_key = manual_api_key if manual_api_key else get_api_key()
+    
+    if not api_key:
+        trace.finish("no_key")
+        return API_KEY_MESSAGE
+
+    # Requested model first, then fallbacks, reordered by recent health so
+    # known-bad models don't cost a timeout each call
+    health = get_registry()
+    models = candidate_models(model)
+
+    base_messages = build_messages(prompt, system_context, messages, cache_system)
+
+    admission = get_admission()
+    # Under load, a local answer now beats a queued remote one
+    if local_answer is not None and admission.is_saturated():
+        answer = local_answer(prompt, messages)
+        if answer:
+            trace.finish("local", "saturated")
+            return answer
+    try:
+        admission.acquire(session_id)
+    except LLMBusy as e:
+        answer = local_answer(prompt, messages) if local_answer is not None else None
+        trace.finish("local" if answer else "busy", f"busy: {e}")
+        return answer or BUSY_MESSAGE
+    trace.admitted()
+
+    session = get_http_session()
+
+    def start_attempt(current_model, on_response=None, is_cancelled=None):
+        started = time.monotonic()
+        if not admission.allow_model(current_model):
+            trace.attempt(current_model, "throttled", started)
+            raise ModelCallError(current_model, "límite local de solicitudes.", "throttled")
         try:
-            payload = {
-                "model": current_model,
-                "messages": base_messages,
-                "temperature": 0.7,        # Conversational but focused
-                "max_tokens": 512,         # Keep responses concise
-                "stream": True,            # Empezar a mandar palabras rápido
-            }
-            response = requests.post(
-                url="https://openrouter.ai/api/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {api_key}",
-                    "HTTP-Referer": "https://kumis-del-balcon.streamlit.app",
-                    "X-Title": "Kumis del Balcon",
-                    "Content-Type": "application/json",
-                },
-                data=json.dumps(payload),
-                timeout=30,  # Increased from 15s — free-tier models can be slow
-                stream=True, # Enable Server-Sent Events
-            )
-
-            if response.status_code == 200:
-                def generator():
-                    for line in response.iter_lines():
-                        if line:
-                            line_str = line.decode('utf-8')
-                            if line_str.startswith('data: '):
-                                data_str = line_str[6:]
-                                if data_str == '[DONE]':
-                                    break
-                                try:
-                                    data_json = json.loads(data_str)
-                                    if "choices" in data_json and len(data_json["choices"]) > 0:
-                                        delta = data_json["choices"][0].get("delta", {})
-                                        if "content" in delta:
-                                            yield delta["content"]
-                                except Exception:
-                                    pass
-                return generator()
-            elif response.status_code == 429:
-                last_error = f"Modelo {current_model}: límite de tasa alcanzado (429)."
-            elif response.status_code == 402:
-                last_error = f"Modelo {current_model}: requiere créditos (402)."
-            else:
-                last_error = f"Modelo {current_model}: Error {response.status_code}."
+            payload = fit_messages(current_model, base_messages) if fit_messages else base_messages
+            stream = _open_stream(session, api_key, current_model, payload, on_response)
+        except ModelCallError as e:
+            # Hedging losers fail because we closed them: that says nothing about the model
+            cancelled = bool(is_cancelled and is_cancelled())
+            trace.attempt(current_model, e.kind, started, cancelled=cancelled)
+            if not cancelled and e.kind != "throttled":
+                health.record_failure(current_model, e.kind, str(e))
+            raise
+        trace.attempt(current_model, "ok", started, stream.stats.connected)
+        health.record_success(current_model, time.monotonic() - started)
+        return stream
 
-        except requests.exceptions.Timeout:
-            last_error = f"Modelo {current_model}: tiempo de espera agotado."
-            continue
-        except Exception as e:
-            last_error = f"Modelo {current_model}: {str(e)[:80]}"
-            continue
+    last_error = ""
+    stream = None
+    try:
+        if hedge_delay is not None or race > 1:
+            try:
+                stream = _race_models(start_attempt, models, hedge_delay, race, max_in_flight)
+            except ModelCallError as e:
+                last_error = str(e)
+        else:
+            for current_model in models:
+                try:
+                    stream = start_attempt(current_model)
+                    break
+                except ModelCallError as e:
+                    last_error = str(e)
+                    continue
+    finally:
+        if stream is None:
+            admission.release(session_id)
+    if stream is not None:
+        # The slot stays taken while the answer streams; the trace ends with it
+        def on_close(stream=stream):
+            admission.release(session_id)
+            trace.finish_stream(stream)
+        stream._on_close = on_close
+        return stream
 
-    return f"Muuu... tuve problemas técnicos con todos los modelos disponibles ({last_error}). Intenta de nuevo en un momento. 🐮"
+    # Every model failed: a local answer is still better than an apology
+    answer = local_answer(prompt, messages) if local_answer is not None else None
+    trace.finish("local" if answer else "error", last_error)
+    if answer:
+        return answer
+    return all_failed_message(last_error)
@@ -0,0 +1,183 @@
+"""
+La Vaquita: the storefront assistant's persona and knowledge.
+
+The prompt is split in two:
+- CORE_PROMPT (persona and rules) is the same on every turn, so providers
+  that support prompt caching can reuse it;
+- the knowledge (products, allergens, pairings, Sevilla) is cut into chunks
+  and indexed (knowledge.py), and each question only gets the chunks it
+  needs under KNOWLEDGE_TOKEN_BUDGET. "¿Cuánto vale el pandebono?" no longer
+  ships the whole history of Sevilla to a 3B model.
+
+Chunks and index are built once per catalog version (menu prices change
+them) and cached, so the per-message work is one index lookup.
+"""
+import threading
+
+from catalog import ALLERGENS, declared_free
+from knowledge import Chunk, KnowledgeIndex
+
+CORE_PROMPT = """\
+Eres 'La Vaquita', la asistente virtual experta de 'Kumis del Balcón', ubicado en Sevilla, Valle del Cauca, Colombia. 🐮☕
+Tu misión es antojar, informar y enamorar a los clientes con nuestros productos y con la riqueza cultural de Sevilla.
+Responde SIEMPRE en español, de forma cálida, detallada y con personalidad campesina amable.
+
+PERSONALIDAD:
+- Eres una campesina sevillana amable, sabia y muy orgullosa de su tierra.
+- Usas emojis con moderación: 🐮 🥛 🌽 🧀 ☕ 🌄 🎸 🌺
+- Tratas al cliente de: "Vecino/a", "Corazón", "Mijo/a", "Paisano/a".
+- Usas expresiones colombianas naturales y espontáneas: "¡De una!", "¿Listo pues?", "¡Qué rico!".
+- Tus respuestas son cálidas, nunca frías ni robóticas.
+
+REGLAS:
+1. Usa SOLO la información de la sección CONOCIMIENTO; si algo no está ahí, reconoce que no sabes
+   y ofrece el teléfono: 📞 310 123 4567.
+2. MARIDAJES: Sugiere una combinación de productos al final de tu respuesta cuando hables del menú.
+3. DIETA: Para preguntas sobre gluten, lactosa, vegetariano o azúcar, usa la info real de los ingredientes.
+4. ORTOGRAFÍA: Entiende preguntas mal escritas (cumis, pan de bono, buñelo, almojabana). NUNCA corrijas.
+5. PEDIDOS: Si alguien quiere pedir, indícale que use el carrito de la izquierda 🛒 y el botón de WhatsApp.
+6. FUERA DE TEMA: Si la pregunta no tiene NADA que ver con el menú, Sevilla o gastronomía colombiana,
+   dilo amablemente y redirige la conversación.
+7. LONGITUD: Sé completa y útil, pero concisa. Máximo 3-4 párrafos cortos por respuesta.
+"""
+
+# (id, title, keywords, text): Sevilla and the shop, independent of the menu
+SEVILLA_CHUNKS = [
+    ("sevilla-historia", "Historia de Sevilla", ("fundacion", "fundada", "capital cafetera", "balcones", "antioquenos", "paisas"), """\
+- Sevilla fue fundada el 28 de octubre de 1903 por colonizadores antioqueños (paisas) que llegaron
+  al norte del Valle del Cauca buscando tierras fértiles para café.
+- Su nombre fue inspirado en la ciudad española de Sevilla por la hermosura de sus paisajes.
+- Declarada municipio oficial en 1907. Es conocida como la 'Capital Cafetera de Colombia' y como
+  la 'Ciudad de los Balcones' por sus coloridos balcones floridos, herencia de la arquitectura paisa.
+- Durante el siglo XX fue clave en el desarrollo agrícola del Valle, con cultivos de café, caña,
+  plátano y frutales."""),
+    ("sevilla-geografia", "Geografía y clima de Sevilla", ("clima", "temperatura", "altura", "distancia", "cali", "ubicacion", "unesco"), """\
+- Ubicada al norte del Valle del Cauca, a ~1.550 metros sobre el nivel del mar.
+- Clima templado agradable: entre 18°C y 24°C todo el año.
+- Rodeada de la cordillera central de los Andes, con paisajes cafeteros espectaculares.
+- A unas 3 horas de Cali y cerca de Cartago y Caicedonia.
+- Forma parte del 'Paisaje Cultural Cafetero de Colombia', declarado Patrimonio de la Humanidad
+  por la UNESCO en 2011."""),
+    ("sevilla-cultura", "Cultura y tradiciones de Sevilla", ("festival", "bandola", "musica", "basilica", "iglesia", "gastronomia", "tradiciones"), """\
+- Festival Nacional de la Bandola (agosto): El festival de bandola más importante de Colombia.
+  Reúne músicos de todo el país que tocan música tradicional andina (bambuco, pasillo, torbellino).
+  La bandola es un instrumento de cuerda típico de la zona andina, similar al laúd.
+- Basílica San Luis Gonzaga: Iglesia principal en el parque central, joya de arquitectura
+  neogótica-republicana y símbolo del municipio.
+- Gastronomía local: kumis, pandebono, empanadas, buñuelos, arroz con leche, sancocho de gallina,
+  tamales y en cada esquina: café de origen.
+- La gente sevillana es famosa por ser amable, hospitalaria y muy orgullosa de sus raíces."""),
+    ("sevilla-turismo", "Turismo en Sevilla", ("turismo", "visitar", "conocer", "mirador", "morro", "fincas", "tour", "parque"), """\
+- Parque Principal: Corazón del municipio, rodeado de la Basílica y coloridos balcones.
+- Mirador El Morro: Vista panorámica espectacular de Sevilla y sus montañas.
+- Fincas cafeteras: Tours del café para conocer el proceso desde la mata hasta la taza.
+- Kumis del Balcón está ubicado frente al parque principal, en el corazón turístico del municipio."""),
+    ("local-contacto", "Ubicación y contacto", ("direccion", "donde", "queda", "telefono", "llamar", "contacto", "horario", "local"), """\
+- Kumis del Balcón: Carrera 50 # 25-10, Sevilla, Valle del Cauca, frente al parque principal.
+- Teléfono y WhatsApp: 📞 310 123 4567.
+- Pedidos: con el carrito de la izquierda 🛒 y el botón de WhatsApp, o pago en línea con Wompi."""),
+]
+
+# Knowledge the model gets for each question (chunks are picked best-first until it's full)
+KNOWLEDGE_TOKEN_BUDGET = 700
+# Chunks used when the question matches nothing (greetings, "¿qué me recomiendas?")
+DEFAULT_CHUNKS = ("menu-resumen",)
+
+# Allergen words that a question may use to ask about "sin X"
+DIET_KEYWORDS = ("gluten", "lactosa", "lacteos", "leche", "huevo", "azucar", "celiaco", "vegano",
+                 "vegetariano", "alergia", "alergico", "intolerante", "dieta", "diabetico")
+PAIRING_KEYWORDS = ("maridaje", "combinar", "acompanar", "recomiendas", "recomendacion", "sugerencia")
+
+
+def build_chunks(catalog):
+    """Knowledge chunks for one catalog version: one per product plus summaries."""
+    items = catalog.items_by_sku
+    chunks = []
+
+    for sku, item in items.items():
+        category = catalog.category_by_sku[sku]
+        lines = [f"{item['name']} ({category}): ${item['price']:,}. {item['desc']}"]
+        if item.get("details"):
+            lines.append(item["details"])
+        contains = item.get("contains") or []
+        if contains:
+            lines.append("Contiene: " + ", ".join(contains) + ".")
+        # Only what the catalog declares: an allergen missing from "contains" is not a "sin"
+        free = [allergen for allergen in ALLERGENS if declared_free(item, allergen)]
+        if free:
+            lines.append("Sin " + ", ".join(free) + ".")
+        pairs = [items[other]["name"] for other in item.get("pairs_with", ()) if other in items]
+        if pairs:
+            lines.append("Maridaje: " + ", ".join(pairs) + ".")
+        chunks.append(Chunk(f"producto-{sku}", "product", item["name"], "\n".join(lines),
+                            # "arrozconleche" lets the index join "arroz con leche" into one term
+                            keywords=(sku.replace("-", " "), sku.replace("-", ""))))
+
+    gluten_free = [item["name"] for item in items.values() if item.get("gluten_free")]
+    no_dairy = [item["name"] for item in items.values() if declared_free(item, "lácteos")]
+    allergen_lines = [f"- {item['name']}: " + (", ".join(item.get("contains") or ["ninguno declarado"]))
+                      for item in items.values()]
+    diet_text = "\n".join([
+        "Sin gluten: " + (", ".join(gluten_free) or "ninguno") + ".",
+        "Sin lácteos: " + (", ".join(no_dairy) or "ninguno") + ".",
+        "Alérgenos por producto:",
+    ] + allergen_lines + [
+        "Si un producto no aparece como 'sin' un alérgeno, no está confirmado: sugiere llamar al 📞 310 123 4567.",
+    ])
+    chunks.append(Chunk("dieta-alergenos", "allergens", "Alérgenos y dietas", diet_text, keywords=DIET_KEYWORDS))
+
+    pairing_text = "\n".join(
+        f"- {item['name']} → " + ", ".join(items[other]["name"] for other in item["pairs_with"] if other in items)
+        for item in items.values() if item.get("pairs_with")
+    )
+    chunks.append(Chunk("maridajes", "pairings", "Maridajes recomendados", pairing_text, keywords=PAIRING_KEYWORDS))
+
+    chunks.append(Chunk("menu-resumen", "menu", "Menú completo y precios", catalog.prompt_menu.strip(),
+                        keywords=("menu", "carta", "precios", "productos", "venden", "ofrecen")))
+
+    for chunk_id, title, keywords, text in SEVILLA_CHUNKS:
+        chunks.append(Chunk(chunk_id, "sevilla", title, text, keywords=keywords))
+    return chunks
+
+
+class SystemPrompt:
+    """The cacheable core prompt plus the knowledge index for one catalog version."""
+
+    def __init__(self, catalog):
+        self.catalog_version = catalog.version
+        self.text = CORE_PROMPT
+        self.index = KnowledgeIndex(build_chunks(catalog))
+        self._by_id = {chunk.id: chunk for chunk in self.index.chunks}
+
+    def knowledge_for(self, question, token_budget=KNOWLEDGE_TOKEN_BUDGET):
+        """The chunks relevant to `question`, or the menu overview if nothing matches."""
+        chunks = self.index.select(question or "", token_budget)
+        if not chunks:
+            chunks = [self._by_id[chunk_id] for chunk_id in DEFAULT_CHUNKS]
+        return chunks
+
+    def parts_for(self, question, token_budget=KNOWLEDGE_TOKEN_BUDGET):
+        """System prompt parts for one question: [core, knowledge]. The core part never changes."""
+        chunks = self.knowledge_for(question, token_budget)
+        knowledge = "CONOCIMIENTO:\n\n" + "\n\n".join(f"## {chunk.title}\n{chunk.text}" for chunk in chunks)
+        return [self.text, knowledge]
+
+
+_lock = threading.Lock()
+_current = None
+
+
+def get_system_prompt(catalog):
+    """
+    Returns the SystemPrompt for this catalog version, building chunks and
+    index only when the menu changed. Older versions are dropped, so stale
+    prices are never served after an update.
+    """
+    global _current
+    prompt = _current
+    if prompt is not None and prompt.catalog_version == catalog.version:
+        return prompt
+    with _lock:
+        if _current is None or _current.catalog_version != catalog.version:
+            _current = SystemPrompt(catalog)
+        return _current